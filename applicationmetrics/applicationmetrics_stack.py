@@ -4,9 +4,13 @@ from aws_cdk import (
     aws_cloudwatch,
     aws_cloudwatch_actions,
     aws_dynamodb,
+    aws_events,
+    aws_events_targets,
     aws_iam,
     aws_lambda,
+    aws_lambda_event_sources,
     aws_logs,
+    aws_s3,
     aws_sns,
     aws_sns_subscriptions,
 )
@@ -19,12 +23,63 @@ notification_emails = [
     'xxx@yahoo.com',
 ]
 
+# Tiers of the usage plans. Every API key of a tier is throttled to rate_limit requests per second on average, with
+# bursts of up to burst_limit requests.
+usage_plan_tiers = {
+    'free': {'rate_limit': 10, 'burst_limit': 20},
+    'standard': {'rate_limit': 100, 'burst_limit': 200},
+    'premium': {'rate_limit': 500, 'burst_limit': 1000},
+}
+
+# API keys to create, one per client application with the tier it belongs to. Clients send it as x-api-key.
+application_tiers = {
+    'xxx-application': 'standard',
+}
+
+# Throttles of the stage per method, a ceiling over every key together. Reads run the Lambda function and query the
+# table, so they get less room than writes.
+method_throttles = {
+    '/applications/PUT': {'rate_limit': 2000, 'burst_limit': 4000},
+    '/applications/POST': {'rate_limit': 200, 'burst_limit': 400},
+}
+
+# Throttled requests per minute over every key before the alarm goes off. A few are expected, that is a noisy
+# client being held back. Many mean the limits are too low for the traffic.
+throttled_requests_threshold = 100
+
+# Percentage of accepted PUTs which were retries of events already stored, over five minutes, before the alarm goes
+# off. Clients retrying in a storm send the same events again and again.
+duplicate_events_threshold = 10
+
+# Dates of POST requests, a day or a minute. Malformed dates are refused before the Lambda function is invoked.
+date_pattern = '^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])(T([01][0-9]|2[0-3]):[0-5][0-9])?$'
+
+# Ranges a POST can compare with the requested one, and their names. Names can't hold characters the request
+# template would have to escape.
+max_compared_ranges = 4
+range_name_pattern = '^[A-Za-z0-9_-]{1,32}$'
+
+# Share of the memory size of the read function it can use, and of its timeout it can take, before the alarms go
+# off. Sizes come from benchmarks/sizing.py, the alarms follow them.
+memory_alarm_ratio = 0.86
+duration_alarm_ratio = 1 / 3
+
 
 class ApplicationmetricsStack(core.Stack):
 
-    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: core.Construct, id: str, compact_user_agents: bool = False,
+                 approximate_budget: int = 200, max_event_lateness: int = 7 * 24 * 3600, max_event_lead: int = 300,
+                 tiers: dict = None, applications: dict = None, throttles: dict = None,
+                 minimum_compression_size: int = 1024, session_timeout: int = 1800, cache_url: str = None,
+                 max_range_days: int = 731, max_buckets: int = 400, snapshot_windows: list = None,
+                 snapshot_interval: int = 15, profile_rate: float = 0.0, profile_on_request: bool = False,
+                 memory_size: int = 128, timeout: int = 3, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        tiers = usage_plan_tiers if tiers is None else tiers
+        applications = application_tiers if applications is None else applications
+        throttles = method_throttles if throttles is None else throttles
+
         # TODO:: Add tags for resources.
 
         # [ DynamoDB ]
@@ -46,8 +101,69 @@ class ApplicationmetricsStack(core.Stack):
                                    # On-demand pricing and scaling. You only pay for what you use and
                                    # there is no read and write capacity for the table or its global
                                    # secondary indexes.
-                                   billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST
+                                   billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                   # New items are streamed to the aggregation function.
+                                   stream=aws_dynamodb.StreamViewType.NEW_IMAGE
                                    )
+
+        # [ DynamoDB ] Index: Operation
+        #
+        # - Events by application and operation (application#operation) and time. Counting one operation only reads
+        #   its own events instead of every event of the application.
+        #
+        # - Only the keys are projected, an index item is about a third of an event and counts never need more.
+        #
+        # - Sparse, events written before the index existed have no application_operation and are left out.
+
+        table.add_global_secondary_index(index_name='operation',
+                                         partition_key=aws_dynamodb.Attribute(
+                                             name='application_operation',
+                                             type=aws_dynamodb.AttributeType.STRING
+                                         ),
+                                         sort_key=aws_dynamodb.Attribute(
+                                             name='created_at',
+                                             type=aws_dynamodb.AttributeType.STRING
+                                         ),
+                                         projection_type=aws_dynamodb.ProjectionType.KEYS_ONLY
+                                         )
+
+        # [ DynamoDB ] Aggregates
+        #
+        # - Pre-computed aggregates of the events, like daily sketches per application. Reads of large ranges
+        #   only touch one item per bucket instead of every event.
+        #
+        # - Open sessions of visitors expire once idle, DynamoDB deletes them within a couple of days.
+
+        table_aggregates = aws_dynamodb.Table(self, 'aggregates',
+                                              partition_key=aws_dynamodb.Attribute(
+                                                  name='pk',
+                                                  type=aws_dynamodb.AttributeType.STRING
+                                              ),
+                                              sort_key=aws_dynamodb.Attribute(
+                                                  name='sk',
+                                                  type=aws_dynamodb.AttributeType.STRING
+                                              ),
+                                              billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                              # Open sessions of visitors who did not come back are deleted.
+                                              time_to_live_attribute='expires'
+                                              )
+
+        # [ S3 ] Bucket: Exports
+        #
+        # - Large exports are written here as newline delimited JSON and the client gets a presigned link. Links
+        #   expire after an hour, objects after a day.
+
+        bucket_exports = aws_s3.Bucket(self, 'exports',
+                                       block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                                       encryption=aws_s3.BucketEncryption.S3_MANAGED,
+                                       lifecycle_rules=[
+                                           aws_s3.LifecycleRule(
+                                               expiration=core.Duration.days(1),
+                                               abort_incomplete_multipart_upload_after=core.Duration.days(1),
+                                           )
+                                       ]
+                                       )
+
         # [ Lambda ]
         #
         # - Our single function to handle retrieving and manipulating data.
@@ -57,20 +173,134 @@ class ApplicationmetricsStack(core.Stack):
                                             handler='function_post.handler',
                                             code=aws_lambda.Code.asset('./lambdas/applications'),
                                             tracing=aws_lambda.Tracing.ACTIVE,
+                                            memory_size=memory_size,
+                                            timeout=core.Duration.seconds(timeout),
                                             log_retention=aws_logs.RetentionDays.ONE_YEAR
                                             )
 
+        # [ Lambda ] Stream
+        #
+        # - Consumes the table stream and keeps the aggregates up to date as events arrive.
+
+        function_stream = aws_lambda.Function(self, 'stream',
+                                              runtime=aws_lambda.Runtime.PYTHON_3_6,
+                                              handler='function_stream.handler',
+                                              code=aws_lambda.Code.asset('./lambdas/applications'),
+                                              tracing=aws_lambda.Tracing.ACTIVE,
+                                              log_retention=aws_logs.RetentionDays.ONE_YEAR
+                                              )
+
+        function_stream.add_event_source(aws_lambda_event_sources.DynamoEventSource(table,
+                                                                                    starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                                                                                    batch_size=100,
+                                                                                    # Split failing batches to isolate bad records.
+                                                                                    bisect_batch_on_error=True,
+                                                                                    retry_attempts=10
+                                                                                    ))
+
+        # [ Lambda ] Snapshot
+        #
+        # - Counts the most requested windows into snapshot items on a schedule, the read function serves them with
+        #   one GetItem.
+
+        function_snapshot = aws_lambda.Function(self, 'snapshot',
+                                                runtime=aws_lambda.Runtime.PYTHON_3_6,
+                                                handler='function_snapshot.handler',
+                                                code=aws_lambda.Code.asset('./lambdas/applications'),
+                                                tracing=aws_lambda.Tracing.ACTIVE,
+                                                timeout=core.Duration.minutes(5),
+                                                log_retention=aws_logs.RetentionDays.ONE_YEAR
+                                                )
+
+        # [ Events ] Rule: Snapshot
+        #
+        # - Runs the snapshot function every snapshot_interval minutes.
+
+        aws_events.Rule(self, 'SnapshotSchedule',
+                        schedule=aws_events.Schedule.rate(core.Duration.minutes(snapshot_interval)),
+                        targets=[aws_events_targets.LambdaFunction(function_snapshot)],
+                        )
+
         # [ DynamoDB ] Permission:
         #
         # - Allows the Lambda function read permissions.
 
         table.grant_read_data(function_post)
+        table_aggregates.grant_read_data(function_post)
+
+        # - Allows the Lambda function to count the windows it is asked for, snapshots are computed for the most
+        #   requested.
+
+        table_aggregates.grant_write_data(function_post)
+
+        # - Allows the snapshot function to count events and write the snapshots.
+
+        table.grant_read_data(function_snapshot)
+        table_aggregates.grant_read_write_data(function_snapshot)
+
+        # - Allows the Lambda function to write exports and sign links to them.
+
+        bucket_exports.grant_read_write(function_post)
+
+        # - Allows the stream function to merge into the aggregates.
+
+        table_aggregates.grant_read_write_data(function_stream)
+
+        # - Compact storage replaces user agents with short ids from a lookup table. Events are rewritten once by
+        #   the stream function, trading one extra write per event for smaller items on every read.
+
+        if compact_user_agents:
+            table.grant_write_data(function_stream)
+            function_stream.add_environment('COMPACT_USER_AGENTS', 'true')
 
         # [ Lambda ] Environment:
         #
         #   - Adds the DynamoDB table name to the Lambda function environment for later access.
 
         function_post.add_environment('TABLE_NAME', table.table_name)
+        function_post.add_environment('AGGREGATES_TABLE_NAME', table_aggregates.table_name)
+        function_post.add_environment('APPROXIMATE_BUDGET_MS', str(approximate_budget))
+        function_post.add_environment('EXPORT_BUCKET_NAME', bucket_exports.bucket_name)
+        function_post.add_environment('MAX_RANGE_DAYS', str(max_range_days))
+        function_post.add_environment('MAX_BUCKETS', str(max_buckets))
+        function_post.add_environment('SNAPSHOT_MAX_AGE_S', str(2 * snapshot_interval * 60))
+
+        # [ Lambda ] Environment: Profiling
+        #
+        # - Profiles profile_rate of the invocations to the logs. At most a few per minute and container, whatever
+        #   the rate.
+        #
+        # - Requests with an X-Profile: true header are only profiled with profile_on_request, any client could turn
+        #   the profilers on otherwise. They are limited apart from the sampled profiles.
+
+        function_post.add_environment('PROFILE_RATE', str(profile_rate))
+        if profile_on_request:
+            function_post.add_environment('PROFILE_ON_REQUEST', 'true')
+        function_stream.add_environment('TABLE_NAME', table.table_name)
+        function_stream.add_environment('AGGREGATES_TABLE_NAME', table_aggregates.table_name)
+        function_stream.add_environment('SESSION_TIMEOUT_S', str(session_timeout))
+
+        # [ Lambda ] Environment: Snapshot
+        #
+        # - Windows computed for every application with events today, in days ending today. Other windows are
+        #   computed once requested often enough. Snapshots are served until the run after next.
+
+        function_snapshot.add_environment('TABLE_NAME', table.table_name)
+        function_snapshot.add_environment('AGGREGATES_TABLE_NAME', table_aggregates.table_name)
+        function_snapshot.add_environment('SNAPSHOT_WINDOWS', ','.join(
+            str(days) for days in ([1, 7, 30] if snapshot_windows is None else snapshot_windows)))
+        function_snapshot.add_environment('SNAPSHOT_MAX_AGE_S', str(2 * snapshot_interval * 60))
+
+        # [ Lambda ] Environment: Cache
+        #
+        # - Daily counts are shared between containers through a Redis protocol server when a URL is given. The
+        #   server is not part of this stack, it lives in the network of the function.
+        #
+        # - Days are closed, cached for long, once events can no longer be accepted for them.
+
+        function_post.add_environment('MAX_EVENT_LATENESS_S', str(max_event_lateness))
+        if cache_url:
+            function_post.add_environment('CACHE_URL', cache_url)
 
         # [ Log ] LogGroup:
         #
@@ -115,6 +345,57 @@ class ApplicationmetricsStack(core.Stack):
                               metric_value="$memory_used_value",
                               )
 
+        # [ Log ] MetricFilter:
+        #
+        # - Counts the queries refused by the Lambda function before reading any table, like ranges over
+        #   max_range_days. Every ValidationException is logged once as "rejected: {...}", the runtime logs the
+        #   raised exception with the same message again without the prefix.
+
+        aws_logs.MetricFilter(self, 'LambdaLogRejectedQueries',
+                              filter_pattern=aws_logs.FilterPattern.literal(
+                                  '[level, timestamp, request_id, marker="rejected:", ...]'),
+                              log_group=function_post_log_group,
+                              metric_namespace='Lambdas',
+                              metric_name='RejectedQueries',
+                              default_value=0,
+                              metric_value='1',
+                              )
+
+        # [ Log ] MetricFilter:
+        #
+        # - Counts days read from the shared cache and from the tables, logged as "cache hits misses coalesced
+        #   errors". Days another container was reading count as hits.
+
+        aws_logs.MetricFilter(self, 'LambdaLogCacheHits',
+                              filter_pattern=aws_logs.FilterPattern.literal(
+                                  '[level, timestamp, request_id, marker="cache", hits, misses, coalesced, errors]'),
+                              log_group=function_post_log_group,
+                              metric_namespace='Lambdas',
+                              metric_name='CacheHits',
+                              default_value=0,
+                              metric_value='$hits',
+                              )
+
+        aws_logs.MetricFilter(self, 'LambdaLogCacheCoalesced',
+                              filter_pattern=aws_logs.FilterPattern.literal(
+                                  '[level, timestamp, request_id, marker="cache", hits, misses, coalesced, errors]'),
+                              log_group=function_post_log_group,
+                              metric_namespace='Lambdas',
+                              metric_name='CacheCoalesced',
+                              default_value=0,
+                              metric_value='$coalesced',
+                              )
+
+        aws_logs.MetricFilter(self, 'LambdaLogCacheMisses',
+                              filter_pattern=aws_logs.FilterPattern.literal(
+                                  '[level, timestamp, request_id, marker="cache", hits, misses, coalesced, errors]'),
+                              log_group=function_post_log_group,
+                              metric_namespace='Lambdas',
+                              metric_name='CacheMisses',
+                              default_value=0,
+                              metric_value='$misses',
+                              )
+
         # [ IAM ] Role
         #
         # - Allows API Gateway to assume this Role with the policies that allow access to DynamoDB.
@@ -136,6 +417,76 @@ class ApplicationmetricsStack(core.Stack):
             ]
         ))
 
+        # [ Log ] LogGroup: Api Gateway
+        #
+        # - Access logs of the stage, one JSON line per request with the API key and why it was refused if it was.
+        #   API Gateway only has a metric for all 4XX errors, throttled requests are counted from these.
+
+        api_access_log_group = aws_logs.LogGroup(self, 'ApiAccessLogGroup',
+                                                 retention=aws_logs.RetentionDays.ONE_MONTH
+                                                 )
+
+        # [ Log ] MetricFilter:
+        #
+        # - Counts accepted PUTs and those which were duplicates. A duplicate fails the condition of the PutItem and
+        #   is answered with a 200, only the integration status tells them apart.
+
+        aws_logs.MetricFilter(self, 'ApiAcceptedEvents',
+                              filter_pattern=aws_logs.FilterPattern.all(
+                                  aws_logs.FilterPattern.string_value('$.httpMethod', '=', 'PUT'),
+                                  aws_logs.FilterPattern.string_value('$.status', '=', '200'),
+                              ),
+                              log_group=api_access_log_group,
+                              metric_namespace='ApiGateway',
+                              metric_name='AcceptedEvents',
+                              default_value=0,
+                              metric_value='1',
+                              )
+
+        aws_logs.MetricFilter(self, 'ApiDuplicateEvents',
+                              filter_pattern=aws_logs.FilterPattern.all(
+                                  aws_logs.FilterPattern.string_value('$.httpMethod', '=', 'PUT'),
+                                  aws_logs.FilterPattern.string_value('$.status', '=', '200'),
+                                  aws_logs.FilterPattern.string_value('$.integrationStatus', '=', '400'),
+                              ),
+                              log_group=api_access_log_group,
+                              metric_namespace='ApiGateway',
+                              metric_name='DuplicateEvents',
+                              default_value=0,
+                              metric_value='1',
+                              )
+
+        # [ Log ] MetricFilter:
+        #
+        # - Counts the queries refused by the request validator, which never reach the Lambda function.
+
+        aws_logs.MetricFilter(self, 'ApiRejectedQueries',
+                              filter_pattern=aws_logs.FilterPattern.all(
+                                  aws_logs.FilterPattern.string_value('$.httpMethod', '=', 'POST'),
+                                  aws_logs.FilterPattern.string_value('$.errorResponseType', '=',
+                                                                      'BAD_REQUEST_BODY'),
+                              ),
+                              log_group=api_access_log_group,
+                              metric_namespace='ApiGateway',
+                              metric_name='RejectedQueries',
+                              default_value=0,
+                              metric_value='1',
+                              )
+
+        # [ Log ] MetricFilter:
+        #
+        # - Counts the requests refused by a usage plan or a stage throttle.
+
+        aws_logs.MetricFilter(self, 'ApiThrottledRequests',
+                              filter_pattern=aws_logs.FilterPattern.string_value('$.errorResponseType', '=',
+                                                                                 'THROTTLED'),
+                              log_group=api_access_log_group,
+                              metric_namespace='ApiGateway',
+                              metric_name='ThrottledRequests',
+                              default_value=0,
+                              metric_value='1',
+                              )
+
         # [ API Gateway ]
         #
         # - The point of entry for our API.
@@ -144,6 +495,9 @@ class ApplicationmetricsStack(core.Stack):
                                      default_cors_preflight_options=aws_apigateway.CorsOptions(
                                          allow_origins=['*'],
                                      ),
+                                     # Gzip bodies of at least this many bytes for clients that accept it. Small
+                                     # bodies are sent as they are, compressing them costs more than it saves.
+                                     minimum_compression_size=minimum_compression_size,
                                      deploy_options=aws_apigateway.StageOptions(
                                          logging_level=aws_apigateway.MethodLoggingLevel.INFO,
                                          # Log full requests/responses data
@@ -151,10 +505,59 @@ class ApplicationmetricsStack(core.Stack):
                                          # Enable Detailed CloudWatch Metrics
                                          metrics_enabled=True,
                                          # Enable X-Ray Tracing
-                                         tracing_enabled=True
+                                         tracing_enabled=True,
+                                         # Throttle each method over every client, so reads can't starve writes.
+                                         method_options={
+                                             path: aws_apigateway.MethodDeploymentOptions(
+                                                 throttling_rate_limit=throttle['rate_limit'],
+                                                 throttling_burst_limit=throttle['burst_limit'],
+                                             ) for path, throttle in throttles.items()
+                                         },
+                                         access_log_destination=aws_apigateway.LogGroupLogDestination(
+                                             api_access_log_group
+                                         ),
+                                         access_log_format=aws_apigateway.AccessLogFormat.custom(json.dumps({
+                                             'requestId': '$context.requestId',
+                                             'apiKeyId': '$context.identity.apiKeyId',
+                                             'httpMethod': '$context.httpMethod',
+                                             'resourcePath': '$context.resourcePath',
+                                             'status': '$context.status',
+                                             'integrationStatus': '$context.integration.status',
+                                             'errorResponseType': '$context.error.responseType',
+                                             'responseLatency': '$context.responseLatency',
+                                         }))
                                      )
                                      )
 
+        # [ API Gateway ] Usage Plan
+        #
+        # - One usage plan per tier. Requests over the limits of a key get a 429 before reaching the table, so one
+        #   client can't use up the capacity every other client shares.
+
+        api_usage_plans = {}
+        for tier, throttle in tiers.items():
+            api_usage_plans[tier] = api.add_usage_plan('UsagePlan' + tier.title(),
+                                                       name=tier,
+                                                       throttle=aws_apigateway.ThrottleSettings(
+                                                           rate_limit=throttle['rate_limit'],
+                                                           burst_limit=throttle['burst_limit'],
+                                                       ),
+                                                       api_stages=[
+                                                           aws_apigateway.UsagePlanPerApiStage(
+                                                               api=api,
+                                                               stage=api.deployment_stage,
+                                                           )
+                                                       ]
+                                                       )
+
+        # [ API Gateway ] Api Key
+        #
+        # - One key per client application, added to the usage plan of its tier.
+
+        for application, tier in applications.items():
+            api_usage_plans[tier].add_api_key(api.add_api_key('ApiKey' + application.title().replace('-', ''),
+                                                              api_key_name=application))
+
         # [ API Gateway ] Resource
         #
         # - Add the endpoint /applications
@@ -169,6 +572,64 @@ class ApplicationmetricsStack(core.Stack):
                                                           validate_request_body=True
                                                           )
 
+        # [ API Gateway ] Template: Event time
+        #
+        # - Clients may send the time of an event (eventTime, ms since the epoch) when it was buffered before being
+        #   sent. It replaces the request time as the sort key, so the event is counted on the day it happened.
+        #
+        # - Events older than max_event_lateness or ahead of the request by more than max_event_lead seconds
+        #   leave the sort key empty, which DynamoDB rejects with a 400.
+        #
+        # - VTL has no date functions, the Common Log Format date is computed from the days since the epoch.
+        #   http://howardhinnant.github.io/date_algorithms.html#civil_from_days
+
+        event_time_template = '''#set($eventTime = $input.path('$').eventTime)
+#if("$!eventTime" == "")
+#set($createdAt = $context.requestTime)
+#else
+#set($lateness = $context.requestTimeEpoch - $eventTime)
+#if($lateness > {max_lateness} || $lateness < -{max_lead})
+#set($createdAt = "")
+#else
+#set($seconds = $eventTime / 1000)
+#set($z = $seconds / 86400 + 719468)
+#set($second = $seconds % 86400)
+#set($era = $z / 146097)
+#set($doe = $z - $era * 146097)
+#set($yoe = ($doe - $doe / 1460 + $doe / 36524 - $doe / 146096) / 365)
+#set($doy = $doe - (365 * $yoe + $yoe / 4 - $yoe / 100))
+#set($mp = (5 * $doy + 2) / 153)
+#set($day = $doy - (153 * $mp + 2) / 5 + 1)
+#if($mp < 10)#set($month = $mp + 3)#else#set($month = $mp - 9)#end
+#if($month <= 2)#set($year = $yoe + $era * 400 + 1)#else#set($year = $yoe + $era * 400)#end
+#set($months = {{"1": "Jan", "2": "Feb", "3": "Mar", "4": "Apr", "5": "May", "6": "Jun", "7": "Jul", "8": "Aug", "9": "Sep", "10": "Oct", "11": "Nov", "12": "Dec"}})
+#set($monthName = $months.get("$month"))
+#set($hours = $second / 3600)
+#set($minutes = $second % 3600 / 60)
+#set($seconds = $second % 60)
+#if($day < 10)#set($dd = "0$day")#else#set($dd = "$day")#end
+#if($hours < 10)#set($hh = "0$hours")#else#set($hh = "$hours")#end
+#if($minutes < 10)#set($mm = "0$minutes")#else#set($mm = "$minutes")#end
+#if($seconds < 10)#set($ss = "0$seconds")#else#set($ss = "$seconds")#end
+#set($createdAt = "$dd/$monthName/$year:$hh:$mm:$ss +0000")
+#end
+#end
+#set($eventId = $input.path('$').eventId)
+#if("$!eventId" == "")#set($eventId = $context.requestId)#end
+#if("$createdAt" != "")#set($createdAt = "$createdAt#$eventId")#end
+'''.format(max_lateness=max_event_lateness * 1000, max_lead=max_event_lead * 1000)
+
+        duplicate_template = '''#if($input.path('$.__type').endsWith("ConditionalCheckFailedException"))
+#set($context.responseOverride.status = 200)
+{duplicate}
+#else
+{fail}
+#end'''
+
+        event_time_attributes = ('#if("$!eventTime" != ""),'
+                                 '"received_at": {"S": "$context.requestTime"}, '
+                                 '"lateness_ms": {"N": "$lateness"}#end')
+
         # [ API Gateway ] Integration: PUT
         #
         # - The AWS Integrations including both request and response.
@@ -186,9 +647,12 @@ class ApplicationmetricsStack(core.Stack):
                                                                 passthrough_behavior=aws_apigateway.PassthroughBehavior.NEVER,
                                                                 # Our PutItem template for inserting into DynamoDB table.
                                                                 request_templates={
-                                                                    'application/json': json.dumps(
+                                                                    'application/json': event_time_template + json.dumps(
                                                                         {
                                                                             "TableName": table.table_name,
+                                                                            # Retries of an event with an eventId
+                                                                            # have the same key and are dropped.
+                                                                            "ConditionExpression": "attribute_not_exists(created_at)",
                                                                             "Item": {
                                                                                 "application": {
                                                                                     "S": "$util.escapeJavaScript($input.path('$').application)"
@@ -196,6 +660,9 @@ class ApplicationmetricsStack(core.Stack):
                                                                                 "operation": {
                                                                                     "S": "$util.escapeJavaScript($input.path('$').operation)"
                                                                                 },
+                                                                                "application_operation": {
+                                                                                    "S": "$util.escapeJavaScript($input.path('$').application)#$util.escapeJavaScript($input.path('$').operation)"
+                                                                                },
                                                                                 "current_media_time": {
                                                                                     "N": "$input.path('$').currentMediaTime"
                                                                                 },
@@ -206,11 +673,12 @@ class ApplicationmetricsStack(core.Stack):
                                                                                     "S": "$context.identity.userAgent"
                                                                                 },
                                                                                 "created_at": {
-                                                                                    "S": "$context.requestTime"
+                                                                                    "S": "$createdAt"
                                                                                 }
                                                                             }
                                                                         }
-                                                                    )
+                                                                        # Events with a client time also keep when they were received.
+                                                                    )[:-2] + event_time_attributes + '}}'
                                                                 },
                                                                 integration_responses=[
                                                                     aws_apigateway.IntegrationResponse(
@@ -237,12 +705,22 @@ class ApplicationmetricsStack(core.Stack):
                                                                         selection_pattern='.*400.*',
                                                                         # We will set the response status code to 400
                                                                         status_code="400",
+                                                                        # Duplicates fail the condition and are
+                                                                        # answered as stored, so clients stop retrying.
                                                                         response_templates={
-                                                                            'application/json': json.dumps(
-                                                                                {
-                                                                                    "state": "Fail",
-                                                                                    "message": "Error, please contact the admin.",
-                                                                                }
+                                                                            'application/json': duplicate_template.format(
+                                                                                duplicate=json.dumps(
+                                                                                    {
+                                                                                        "state": "Duplicate",
+                                                                                        "message": "Event already stored.",
+                                                                                    }
+                                                                                ),
+                                                                                fail=json.dumps(
+                                                                                    {
+                                                                                        "state": "Fail",
+                                                                                        "message": "Error, please contact the admin.",
+                                                                                    }
+                                                                                )
                                                                             )
                                                                         },
                                                                         response_parameters={
@@ -400,6 +878,18 @@ class ApplicationmetricsStack(core.Stack):
                                                                             "start_date": "$util.escapeJavaScript($input.path('$').startDate)",
                                                                             "end_date": "$util.escapeJavaScript($input.path('$').endDate)",
                                                                             "application": "$util.escapeJavaScript($input.path('$').application)",
+                                                                            "metric": "$util.escapeJavaScript($input.path('$').metric)",
+                                                                            "operation": "$util.escapeJavaScript($input.path('$').operation)",
+                                                                            "top": "$input.path('$').top",
+                                                                            "approximate": "$input.path('$').approximate",
+                                                                            "timezone": "$util.escapeJavaScript($input.path('$').timezone)",
+                                                                            "format": "$util.escapeJavaScript($input.path('$').format)",
+                                                                            "export": "$input.path('$').export",
+                                                                            "granularity": "$util.escapeJavaScript($input.path('$').granularity)",
+                                                                            # Named ranges compared with the requested one, passed on as a JSON string.
+                                                                            "compare": "$util.escapeJavaScript($input.json('$.compare'))",
+                                                                            # Asks for a profile of the invocation, ignored unless profile_on_request is set.
+                                                                            "profile": "$util.escapeJavaScript($input.params('X-Profile'))",
                                                                         }
                                                                     )
                                                                 },
@@ -410,7 +900,8 @@ class ApplicationmetricsStack(core.Stack):
                                                                         # We will set the response status code to 200
                                                                         status_code="200",
                                                                         response_templates={
-                                                                            'application/json': "{\"counts\":$util.parseJson($input.json('$.response'))}"
+                                                                            # The body is encoded by the Lambda, it is passed through as it is.
+                                                                            'application/json': "$input.path('$.body')"
                                                                         },
                                                                         response_parameters={
                                                                             # We can map response parameters
@@ -485,6 +976,22 @@ class ApplicationmetricsStack(core.Stack):
                                                           type=aws_apigateway.JsonSchemaType.NUMBER,
                                                           min_length=1,
                                                       ),
+                                                      # Optional, ms since the epoch when the event happened.
+                                                      'eventTime': aws_apigateway.JsonSchema(
+                                                          type=aws_apigateway.JsonSchemaType.INTEGER,
+                                                          minimum=0,
+                                                      ),
+                                                      # Optional, an id the client picks per event. Retries with
+                                                      # the same id and eventTime are only stored once.
+                                                      'eventId': aws_apigateway.JsonSchema(
+                                                          type=aws_apigateway.JsonSchemaType.STRING,
+                                                          pattern='^[A-Za-z0-9_-]{1,64}$',
+                                                      ),
+                                                  },
+                                                  # Without a client time, retries would be stored under the time
+                                                  # they were received.
+                                                  dependencies={
+                                                      'eventId': ['eventTime'],
                                                   },
                                                   # The parameters that are required to be submitted
                                                   required=[
@@ -508,24 +1015,99 @@ class ApplicationmetricsStack(core.Stack):
                                                    type=aws_apigateway.JsonSchemaType.OBJECT,
                                                    # The parameters properties like type and character length.
                                                    properties={
+                                                       # A day (YYYY-mm-dd) or a minute (YYYY-mm-ddTHH:MM).
                                                        'startDate': aws_apigateway.JsonSchema(
                                                            type=aws_apigateway.JsonSchemaType.STRING,
-                                                           min_length=1
+                                                           pattern=date_pattern,
                                                        ),
                                                        'endDate': aws_apigateway.JsonSchema(
                                                            type=aws_apigateway.JsonSchemaType.STRING,
-                                                           min_length=1
+                                                           pattern=date_pattern,
                                                        ),
+                                                       # Required by every metric but top_applications.
                                                        'application': aws_apigateway.JsonSchema(
                                                            type=aws_apigateway.JsonSchemaType.STRING,
                                                            min_length=1,
                                                        ),
+                                                       # Optional, counts events when left out.
+                                                       'metric': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.STRING,
+                                                           enum=[
+                                                               'events',
+                                                               'unique_sources',
+                                                               'media_time',
+                                                               'top_source_ips',
+                                                               'top_user_agents',
+                                                               'lateness',
+                                                               'top_applications',
+                                                               'sessions',
+                                                           ]
+                                                       ),
+                                                       # Optional, limits event counts and media time to one operation.
+                                                       'operation': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.STRING,
+                                                           min_length=1,
+                                                       ),
+                                                       # Optional, number of heavy hitters to return.
+                                                       'top': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.INTEGER,
+                                                           minimum=1,
+                                                           maximum=100,
+                                                       ),
+                                                       # Optional, samples event counts within a latency budget.
+                                                       'approximate': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.BOOLEAN,
+                                                       ),
+                                                       # Optional, IANA time zone of the days, like Asia/Kolkata.
+                                                       'timezone': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.STRING,
+                                                           min_length=1,
+                                                       ),
+                                                       # Optional, columnar returns the counts of every day in order.
+                                                       'format': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.STRING,
+                                                           enum=['json', 'columnar'],
+                                                       ),
+                                                       # Optional, writes the counts to S3 and returns a link.
+                                                       'export': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.BOOLEAN,
+                                                       ),
+                                                       # Optional, buckets of an export.
+                                                       'granularity': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.STRING,
+                                                           enum=['day', 'hour'],
+                                                       ),
+                                                       # Optional, named ranges whose event counts are compared with
+                                                       # the requested range, like last week.
+                                                       'compare': aws_apigateway.JsonSchema(
+                                                           type=aws_apigateway.JsonSchemaType.ARRAY,
+                                                           min_items=1,
+                                                           max_items=max_compared_ranges,
+                                                           items=aws_apigateway.JsonSchema(
+                                                               type=aws_apigateway.JsonSchemaType.OBJECT,
+                                                               properties={
+                                                                   'name': aws_apigateway.JsonSchema(
+                                                                       type=aws_apigateway.JsonSchemaType.STRING,
+                                                                       pattern=range_name_pattern,
+                                                                   ),
+                                                                   'startDate': aws_apigateway.JsonSchema(
+                                                                       type=aws_apigateway.JsonSchemaType.STRING,
+                                                                       pattern=date_pattern,
+                                                                   ),
+                                                                   'endDate': aws_apigateway.JsonSchema(
+                                                                       type=aws_apigateway.JsonSchemaType.STRING,
+                                                                       pattern=date_pattern,
+                                                                   ),
+                                                               },
+                                                               required=['name', 'startDate', 'endDate'],
+                                                               additional_properties=False,
+                                                           ),
+                                                       ),
                                                    },
                                                    # The parameters that are required to be submitted
                                                    required=[
                                                        'startDate',
                                                        'endDate',
-                                                       'application',
                                                    ]
                                                )
                                                )
@@ -566,7 +1148,10 @@ class ApplicationmetricsStack(core.Stack):
                                                     properties={
                                                         'counts': aws_apigateway.JsonSchema(
                                                             type=aws_apigateway.JsonSchemaType.OBJECT
-                                                        )
+                                                        ),
+                                                        'summary': aws_apigateway.JsonSchema(
+                                                            type=aws_apigateway.JsonSchemaType.OBJECT
+                                                        ),
                                                     }
                                                 )
                                                 )
@@ -598,6 +1183,8 @@ class ApplicationmetricsStack(core.Stack):
         # - Validates requests using a model.
 
         api_resource_applications.add_method('PUT', api_integration_put,
+                                             # Requests are throttled by the usage plan of their key.
+                                             api_key_required=True,
                                              # Only validates the body using the validator.
                                              request_validator=api_validator_request,
                                              request_models={
@@ -724,6 +1311,8 @@ class ApplicationmetricsStack(core.Stack):
         # - Validates requests using a model.
 
         api_resource_applications.add_method('POST', api_integration_post,
+                                             # Requests are throttled by the usage plan of their key.
+                                             api_key_required=True,
                                              # Only validates the body using the validator.
                                              request_validator=api_validator_request,
                                              request_models={
@@ -801,6 +1390,16 @@ class ApplicationmetricsStack(core.Stack):
             }
         )
 
+        # [ CloudWatch ] Metric:
+        #
+        # - Retrieves the metric filter for throttled requests.
+
+        metric_api_gateway_throttled = aws_cloudwatch.Metric(
+            namespace='ApiGateway',
+            metric_name='ThrottledRequests',
+            statistic='Sum',
+        )
+
         # [ CloudWatch ] Metric:
         #
         # - Retrieves the metric filter for Lambda function errors.
@@ -819,6 +1418,22 @@ class ApplicationmetricsStack(core.Stack):
             metric_name='LambdaMemory',
         )
 
+        # [ CloudWatch ] Metric:
+        #
+        # - Percentage of days read from the shared cache, from the metric filters.
+
+        metric_lambda_cache_hit_ratio = aws_cloudwatch.MathExpression(
+            expression='IF(hits + coalesced + misses > 0, 100 * (hits + coalesced) / (hits + coalesced + misses), 0)',
+            using_metrics={
+                'hits': aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheHits', statistic='Sum'),
+                'coalesced': aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheCoalesced',
+                                                   statistic='Sum'),
+                'misses': aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheMisses', statistic='Sum'),
+            },
+            label='Cache Hits (%)',
+            period=core.Duration.minutes(5),
+        )
+
         # [ CloudWatch ] Alarm:
         #
         # - Creates an alarm for errors reported by Lambda in logs.
@@ -841,7 +1456,7 @@ class ApplicationmetricsStack(core.Stack):
         alarm_lambda_log_memory = aws_cloudwatch.Alarm(self, 'LambdaLogMemory',
                                                        metric=metric_lambda_memory,
                                                        alarm_description='Reads memory usage in MB reported in logs and reports if too high.',
-                                                       threshold=110,
+                                                       threshold=int(memory_size * memory_alarm_ratio),
                                                        evaluation_periods=1,
                                                        comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
                                                        period=core.Duration.seconds(60),
@@ -857,7 +1472,7 @@ class ApplicationmetricsStack(core.Stack):
         alarm_lambda_duration = aws_cloudwatch.Alarm(self, 'LambdaDuration',
                                                      metric=function_post.metric_duration(),
                                                      alarm_description='Uses AWS metrics to graph duration for the Lambda function.',
-                                                     threshold=1000,
+                                                     threshold=int(timeout * 1000 * duration_alarm_ratio),
                                                      period=core.Duration.seconds(60),
                                                      evaluation_periods=1,
                                                      comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
@@ -882,6 +1497,22 @@ class ApplicationmetricsStack(core.Stack):
                                                   statistic='Maximum'
                                                   )
 
+        # [ CloudWatch ] Alarm:
+        #
+        # - Creates an alarm for stream function errors. Failed batches are retried, so aggregates lag behind.
+
+        alarm_lambda_stream_error = aws_cloudwatch.Alarm(self, 'LambdaStreamError',
+                                                         metric=function_stream.metric_errors(),
+                                                         alarm_description='Uses AWS metrics to count errors for the stream function.',
+                                                         threshold=0,
+                                                         period=core.Duration.seconds(60),
+                                                         evaluation_periods=1,
+                                                         comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                                         actions_enabled=True,
+                                                         treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+                                                         statistic='Maximum'
+                                                         )
+
         # [ CloudWatch ] Alarm:
         #
         # - Creates an alarm for Api Gateway 400 errors.
@@ -910,6 +1541,51 @@ class ApplicationmetricsStack(core.Stack):
                                                            treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING,
                                                            )
 
+        # [ CloudWatch ] Alarm:
+        #
+        # - Creates an alarm for requests throttled by usage plans and stage throttles.
+
+        alarm_api_gateway_throttled = aws_cloudwatch.Alarm(self, 'ApiGatewayThrottled',
+                                                           metric=metric_api_gateway_throttled,
+                                                           alarm_description='Counts requests refused with a 429 and reports if the limits look too low.',
+                                                           threshold=throttled_requests_threshold,
+                                                           period=core.Duration.seconds(60),
+                                                           evaluation_periods=1,
+                                                           comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                                           actions_enabled=True,
+                                                           treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+                                                           )
+
+        # [ CloudWatch ] Metric:
+        #
+        # - Percentage of accepted PUTs which were duplicates, from the metric filters.
+
+        metric_api_gateway_duplicate_rate = aws_cloudwatch.MathExpression(
+            expression='IF(accepted > 0, 100 * duplicates / accepted, 0)',
+            using_metrics={
+                'accepted': aws_cloudwatch.Metric(namespace='ApiGateway', metric_name='AcceptedEvents',
+                                                  statistic='Sum'),
+                'duplicates': aws_cloudwatch.Metric(namespace='ApiGateway', metric_name='DuplicateEvents',
+                                                    statistic='Sum'),
+            },
+            label='Duplicate Events (%)',
+            period=core.Duration.minutes(5),
+        )
+
+        # [ CloudWatch ] Alarm:
+        #
+        # - Creates an alarm for retry storms, many events sent again after they were stored.
+
+        alarm_api_gateway_duplicates = aws_cloudwatch.Alarm(self, 'ApiGatewayDuplicates',
+                                                            metric=metric_api_gateway_duplicate_rate,
+                                                            alarm_description='Percentage of PUTs which were duplicates of stored events, reports retry storms.',
+                                                            threshold=duplicate_events_threshold,
+                                                            evaluation_periods=1,
+                                                            comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                                            actions_enabled=True,
+                                                            treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+                                                            )
+
         # [ CloudWatch ] Dashboard: Api Gateway
         #
         # - An ApiGateway Dashboard containing all related metrics.
@@ -952,6 +1628,75 @@ class ApplicationmetricsStack(core.Stack):
             ),
         )
 
+        # [ CloudWatch ] Dashboard: Widgets
+        #
+        # - Graphs for throttled requests and the keys they came from.
+
+        dashboard_api.add_widgets(
+            aws_cloudwatch.GraphWidget(
+                title="Throttled Requests",
+                width=8,
+                left=[
+                    metric_api_gateway_throttled.with_(
+                        color="#ff8000",
+                    ),
+                ]
+            ),
+            aws_cloudwatch.LogQueryWidget(
+                title='Throttled Requests by Key',
+                width=8,
+                log_group_names=[api_access_log_group.log_group_name],
+                query_lines=[
+                    'fields apiKeyId, httpMethod',
+                    'filter errorResponseType = "THROTTLED"',
+                    'stats count(*) as throttled by apiKeyId, httpMethod',
+                    'sort throttled desc',
+                    'limit 20',
+                ]
+            ),
+            aws_cloudwatch.AlarmWidget(
+                title='ThrottledAlarms',
+                alarm=alarm_api_gateway_throttled,
+                width=8,
+            ),
+        )
+
+        # [ CloudWatch ] Dashboard: Widgets
+        #
+        # - Graphs for duplicate events, which go up with client retries.
+
+        dashboard_api.add_widgets(
+            aws_cloudwatch.GraphWidget(
+                title="Duplicate Events",
+                width=12,
+                left=[
+                    metric_api_gateway_duplicate_rate,
+                ]
+            ),
+            aws_cloudwatch.AlarmWidget(
+                title='DuplicateAlarms',
+                alarm=alarm_api_gateway_duplicates,
+                width=12,
+            ),
+        )
+
+        # [ CloudWatch ] Dashboard: Widgets
+        #
+        # - Graphs for queries refused by the request validator and by the Lambda function.
+
+        dashboard_api.add_widgets(
+            aws_cloudwatch.GraphWidget(
+                title="Rejected Queries",
+                width=24,
+                left=[
+                    aws_cloudwatch.Metric(namespace='ApiGateway', metric_name='RejectedQueries', statistic='Sum',
+                                          label='Request Validator', color='#ff8000'),
+                    aws_cloudwatch.Metric(namespace='Lambdas', metric_name='RejectedQueries', statistic='Sum',
+                                          label='Lambda', color='#ff4d4d'),
+                ]
+            ),
+        )
+
         # [ CloudWatch ] Dashboard: Lambda
         #
         # - A Lambda Dashboard containing all related metrics.
@@ -1058,6 +1803,32 @@ class ApplicationmetricsStack(core.Stack):
             ),
         )
 
+        # [ CloudWatch ] Dashboard: Widgets
+        #
+        # - Graphs for measuring the shared cache of daily counts.
+
+        dashboard_lambda.add_widgets(
+            aws_cloudwatch.GraphWidget(
+                title="CacheHitRatio",
+                width=12,
+                left=[
+                    metric_lambda_cache_hit_ratio,
+                ],
+            ),
+            aws_cloudwatch.GraphWidget(
+                title="CacheReads",
+                width=12,
+                left=[
+                    aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheHits', statistic='Sum',
+                                          label='Hits', color='#5cd65c'),
+                    aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheCoalesced', statistic='Sum',
+                                          label='Coalesced', color='#0052cc'),
+                    aws_cloudwatch.Metric(namespace='Lambdas', metric_name='CacheMisses', statistic='Sum',
+                                          label='Misses', color='#ff4d4d'),
+                ],
+            ),
+        )
+
         # [ CloudWatch ] Dashboard: Widgets
         #
         # - Graphs for measuring when alarms have been triggered.
@@ -1133,3 +1904,27 @@ class ApplicationmetricsStack(core.Stack):
         alarm_api_gateway_error_5xx.add_alarm_action(aws_cloudwatch_actions.SnsAction(
             topic=topic_errors
         ))
+
+        # [ CloudWatch ] Action:
+        #
+        # - Creates an action for the Api Gateway throttled requests alarm and attaches the SMS error topic.
+
+        alarm_api_gateway_throttled.add_alarm_action(aws_cloudwatch_actions.SnsAction(
+            topic=topic_errors
+        ))
+
+        # [ CloudWatch ] Action:
+        #
+        # - Creates an action for the duplicate events alarm and attaches the SMS error topic.
+
+        alarm_api_gateway_duplicates.add_alarm_action(aws_cloudwatch_actions.SnsAction(
+            topic=topic_errors
+        ))
+
+        # [ CloudWatch ] Action:
+        #
+        # - Creates an action for the stream function errors alarm and attaches the SMS error topic.
+
+        alarm_lambda_stream_error.add_alarm_action(aws_cloudwatch_actions.SnsAction(
+            topic=topic_errors
+        ))
@@ -0,0 +1,111 @@
+import argparse
+import json
+import logging
+import time
+
+import timestamps
+from benchmarks.generators import synthetic_events
+from local.emulator import Emulator
+
+
+class SlowTable(object):
+    # Adds the round trip of a DynamoDB query to an in-memory table.
+
+    def __init__(self, table, latency):
+        self.table = table
+        self.latency = latency
+
+    def query(self, **kwargs):
+        time.sleep(self.latency / 1000.0)
+        return self.table.query(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def exact_counts(table, application):
+    response = {}
+    for item in table.partitions.get(application, {}).values():
+        day = timestamps.day(timestamps.parse_created_at(item['created_at']))
+        response[day] = response.get(day, 0) + 1
+    return response
+
+
+def trial(function_post, application, start, end, exact):
+    started = time.time()
+    response, summary = function_post.approximate_events(application, start, end)
+    elapsed = (time.time() - started) * 1000
+    summary = summary['approximate']
+
+    total = sum(exact.values())
+    result = {
+        'elapsed': round(elapsed, 1),
+        'exact': summary['exact'],
+        'total': total,
+        'error': round((sum(response.values()) - total) / float(total), 4) if total else 0.0,
+    }
+    if not summary['exact']:
+        days = [day for day in exact if day in summary['intervals']]
+        covered = [day for day in days if summary['intervals'][day][0] <= exact[day] <= summary['intervals'][day][1]]
+        result.update({
+            'estimate': summary['total'],
+            'covered': summary['interval'][0] <= total <= summary['interval'][1],
+            'day_coverage': round(len(covered) / float(len(days)), 3) if days else 1.0,
+            'relative_error': summary['relative_error'],
+            'probes': summary['probes'],
+        })
+    return result
+
+
+def run(events, days, budget, latency, trials, seed=1):
+    # Exact and approximate counts of the busiest application over every day of the data set.
+    emulator = Emulator(stream=False)
+    emulator.table.load(synthetic_events(events, days, seed=seed))
+    function_post = emulator.function_post
+    function_post.planner.table = SlowTable(emulator.table, latency)
+    function_post.APPROXIMATE_BUDGET = budget
+
+    # The functions log every request at INFO when imported.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    application = max(emulator.table.partitions, key=lambda name: len(emulator.table.partitions[name]))
+    exact = exact_counts(emulator.table, application)
+    start = timestamps.parse_request_date(min(exact))
+    end = timestamps.parse_request_date(max(exact), end=True)
+    return [trial(function_post, application, start, end, exact) for _ in range(trials)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares approximate event counts with exact counts.')
+    parser.add_argument('--events', type=int, default=300000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--budget', type=int, default=200, help='ms')
+    parser.add_argument('--latency', type=float, default=5, help='ms per query')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--output', help='write the trials as JSON')
+    args = parser.parse_args()
+
+    results = run(args.events, args.days, args.budget, args.latency, args.trials)
+    sampled = [result for result in results if not result['exact']]
+
+    print('{} trials, {} events of the busiest application over {} days'.format(
+        len(results), results[0]['total'], args.days))
+    print('elapsed     p50 {:.1f} ms, max {:.1f} ms, budget {} ms'.format(
+        sorted(result['elapsed'] for result in results)[len(results) // 2],
+        max(result['elapsed'] for result in results), args.budget))
+    print('total error mean {:.2%}, max {:.2%}'.format(
+        sum(abs(result['error']) for result in results) / len(results), max(abs(result['error']) for result in results)))
+    if sampled:
+        print('probes      mean {:.0f}'.format(sum(result['probes'] for result in sampled) / float(len(sampled))))
+        print('interval    mean ±{:.2%}, total covered {:.0%}, days covered {:.1%}'.format(
+            sum(result['relative_error'] for result in sampled) / len(sampled),
+            sum(1 for result in sampled if result['covered']) / float(len(sampled)),
+            sum(result['day_coverage'] for result in sampled) / len(sampled)))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
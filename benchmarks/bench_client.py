@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+from client import Client
+from local.emulator import Emulator, serve
+
+
+def start(stream, latency):
+    # The emulator on a free port in a background thread. Every PUT takes at least the latency in ms, the round trip
+    # of API Gateway and DynamoDB, which the emulator has none of.
+    emulator = Emulator(stream=stream)
+    logging.getLogger().setLevel(logging.WARNING)
+    put = emulator.put
+
+    def slow_put(*args, **kwargs):
+        time.sleep(latency / 1000.0)
+        return put(*args, **kwargs)
+
+    emulator.put = slow_put
+    server = serve(emulator, '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return emulator, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def events(count, now):
+    # One second apart going back from now, within the lateness window.
+    for index in range(count):
+        yield 'application-1', ['play', 'pause', 'seek', 'complete'][index % 4], float(index % 3600), \
+              now - index * 1000
+
+
+def one_by_one(url, count, now):
+    # What clients do without the library: a request per event, each on a new connection.
+    for application, operation, current_media_time, event_time in events(count, now):
+        request = urllib.request.Request(url + '/applications', method='PUT', data=json.dumps({
+            'application': application,
+            'operation': operation,
+            'currentMediaTime': current_media_time,
+            'eventTime': event_time,
+        }).encode('utf-8'), headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request).read()
+    return {'sent': count}
+
+
+async def batched(url, count, now, batch_size, connections):
+    async with Client(url, batch_size=batch_size, connections=connections, max_buffer=count) as client:
+        for application, operation, current_media_time, event_time in events(count, now):
+            client.track(application, operation, current_media_time, event_time)
+            # Yield now and then, like an application doing other work between events.
+            if client.stats['tracked'] % batch_size == 0:
+                await asyncio.sleep(0)
+    return client.stats
+
+
+def run(count, batch_sizes, connections, latency, stream=False):
+    emulator, url = start(stream, latency)
+    now = int(time.time() * 1000)
+    results = []
+
+    for name, send in [('one by one', lambda: one_by_one(url, count, now))] + [
+            ('batch {}'.format(size), lambda size=size: asyncio.get_event_loop().run_until_complete(
+                batched(url, count, now, size, connections))) for size in batch_sizes]:
+        emulator.table.clear()
+        started = time.perf_counter()
+        stats = send()
+        elapsed = time.perf_counter() - started
+        results.append({
+            'client': name,
+            'events': count,
+            'sent': stats['sent'],
+            'stored': emulator.table.count(),
+            'seconds': round(elapsed, 3),
+            'throughput': round(count / elapsed, 1),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the throughput of the batching client with sending '
+                                                 'events one by one against the local emulator.')
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=20, help='ms per PUT')
+    # In AWS the stream function runs after the request returned, in the emulator it runs in the request.
+    parser.add_argument('--stream', action='store_true', help='update the aggregates on PUT')
+    args = parser.parse_args()
+
+    print('{:<12} {:>8} {:>8} {:>8} {:>9} {:>12}'.format('client', 'events', 'sent', 'stored', 'seconds',
+                                                         'events/s'))
+    for result in run(args.events, args.batch_sizes, args.connections, args.latency,
+                      stream=args.stream):
+        print('{client:<12} {events:>8} {sent:>8} {stored:>8} {seconds:>9.3f} {throughput:>12.1f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
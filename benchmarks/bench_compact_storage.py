@@ -0,0 +1,69 @@
+import math
+import random
+
+from dictionary import user_agent_id
+from local.table import item_size, READ_UNIT, WRITE_UNIT
+
+# Events read by one query.
+EVENTS = 10000
+
+BROWSERS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{}.0.{}.{} Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_{}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.{}.{} Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 13_{} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.{} Mobile/15E{} Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 10; SM-G9{}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{}.0.4103.{} Mobile Safari/537.36',
+]
+
+
+def synthetic_events(count, seed):
+    # A few hundred distinct user agents, a handful of them make up most of the traffic.
+    generator = random.Random(seed)
+    user_agents = [
+        generator.choice(BROWSERS).format(generator.randint(70, 85), generator.randint(1, 9), generator.randint(10, 99))
+        for _ in range(300)
+    ]
+    return [
+        {
+            'application': 'application-{}'.format(generator.randint(1, 5)),
+            'created_at': '{:02d}/Mar/2020:{:02d}:{:02d}:{:02d} +0000'.format(generator.randint(1, 28),
+                                                                             generator.randint(0, 23),
+                                                                             generator.randint(0, 59),
+                                                                             generator.randint(0, 59)),
+            'operation': generator.choice(['play', 'pause', 'seek', 'complete']),
+            'current_media_time': round(generator.uniform(0, 3600), 3),
+            'source_ip': '{}.{}.{}.{}'.format(*(generator.randint(1, 254) for _ in range(4))),
+            'user_agent': user_agents[min(int(generator.paretovariate(1.0)) - 1, len(user_agents) - 1)],
+        }
+        for _ in range(count)
+    ]
+
+
+def compact(item):
+    compacted = dict(item)
+    compacted['user_agent_id'] = user_agent_id(compacted.pop('user_agent'))
+    return compacted
+
+
+def report(name, items, writes_per_event):
+    sizes = [item_size(item) for item in items]
+    total = sum(sizes)
+    # Queries are eventually consistent, half a unit per 4 KB of items read.
+    read_units = math.ceil(total / float(READ_UNIT)) * 0.5
+    write_units = sum(math.ceil(size / float(WRITE_UNIT)) for size in sizes) * writes_per_event / float(len(items))
+    print('{:<10} {:>10.1f} {:>12,.1f} {:>14.2f}'.format(name, total / float(len(items)), read_units, write_units))
+
+
+if __name__ == '__main__':
+    events = synthetic_events(EVENTS, seed=1)
+    distinct = len(set(event['user_agent'] for event in events))
+
+    print('{} events, {} distinct user agents'.format(EVENTS, distinct))
+    print('{:<10} {:>10} {:>12} {:>14}'.format('storage', 'bytes/item', 'RCU/query', 'WCU/event'))
+    report('full', events, writes_per_event=1)
+    # Compacted events are written twice, once by the integration and once by the stream function.
+    report('compact', [compact(event) for event in events], writes_per_event=2)
+
+    # The projection only returns created_at to the Lambda, whatever the storage.
+    print('payload without projection: {:,} bytes per query'.format(sum(item_size(event) for event in events)))
+    print('payload with projection:    {:,} bytes per query'.format(
+        sum(item_size({'created_at': event['created_at']}) for event in events)))
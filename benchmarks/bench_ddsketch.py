@@ -0,0 +1,79 @@
+import random
+import time
+
+from ddsketch import DDSketch
+
+# Number of values added per distribution.
+SIZE = 200000
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+# Media time distributions in seconds, from short clips to long films where most people drop off early.
+def distributions(generator):
+    return {
+        'uniform': lambda: generator.uniform(0, 3600),
+        'exponential': lambda: generator.expovariate(1 / 300.0),
+        'lognormal': lambda: generator.lognormvariate(5, 1.5),
+        'bimodal': lambda: generator.gauss(30, 10) if generator.random() < 0.7 else generator.gauss(5400, 600),
+    }
+
+
+def exact_quantile(values, q):
+    # Same rank as the sketch.
+    return values[int(q * (len(values) - 1))]
+
+
+def accuracy():
+    generator = random.Random(42)
+    print('{:<12} {:>6} {:>14} {:>14} {:>10}'.format('distribution', 'q', 'exact', 'sketch', 'error'))
+
+    for name, draw in distributions(generator).items():
+        values = [max(draw(), 0.0) for _ in range(SIZE)]
+        sketch = DDSketch()
+        sketch.update(values)
+        values.sort()
+
+        for q in QUANTILES:
+            exact = exact_quantile(values, q)
+            estimate = sketch.quantile(q)
+            error = abs(estimate - exact) / exact if exact else 0.0
+            print('{:<12} {:>6} {:>14.3f} {:>14.3f} {:>9.3%}'.format(name, q, exact, estimate, error))
+
+
+def throughput():
+    generator = random.Random(7)
+    values = [generator.lognormvariate(5, 1.5) for _ in range(SIZE)]
+
+    sketch = DDSketch()
+    started = time.perf_counter()
+    sketch.update(values)
+    elapsed = time.perf_counter() - started
+    print('add:         {:>12,.0f} values/s'.format(SIZE / elapsed))
+
+    # A year of daily sketches, like a read of a long range.
+    days = []
+    for day in range(365):
+        daily = DDSketch()
+        daily.update(values[day * 500:(day + 1) * 500])
+        days.append(daily.to_bytes())
+
+    started = time.perf_counter()
+    merged = DDSketch()
+    for data in days:
+        merged.merge(DDSketch.from_bytes(data))
+    elapsed = time.perf_counter() - started
+    print('merge:       {:>12,.0f} sketches/s ({:.1f} ms for a year)'.format(len(days) / elapsed, elapsed * 1000))
+
+    started = time.perf_counter()
+    for _ in range(100):
+        merged.quantile(0.99)
+    elapsed = time.perf_counter() - started
+    print('quantile:    {:>12,.0f} queries/s'.format(100 / elapsed))
+    print('size:        {:>12,} bytes per daily sketch (average)'.format(sum(map(len, days)) // len(days)))
+
+
+if __name__ == '__main__':
+    accuracy()
+    print()
+    throughput()
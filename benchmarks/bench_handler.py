@@ -0,0 +1,156 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import timestamps
+from benchmarks.generators import synthetic_events
+from local.emulator import Emulator
+from planner import DAILY_PREFIX, TOTAL_KEY
+
+# Number of events loaded for each run.
+SIZES = [1000, 10000, 100000]
+
+# Days the events are spread over, the request covers all of them.
+DAYS = 30
+
+RESULTS = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def timed(function, repeat):
+    # Median wall time in ms, with the result of the last call.
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3), result
+
+
+def run(size, repeat, with_rollups=True):
+    emulator = Emulator(stream=False)
+    events = synthetic_events(size, DAYS)
+    emulator.table.load(events)
+    if with_rollups:
+        # Stored events only, events of the same application and second overwrite each other.
+        stored = [item for partition in emulator.table.partitions.values() for item in partition.values()]
+        emulator.table_aggregates.load(rollups(stored, since='2020-02-29'))
+    function_post = emulator.function_post
+
+    # The functions log every request at INFO when imported, which would be timed too.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # The busiest application, over the whole range.
+    application = max(set(event['application'] for event in events),
+                      key=lambda name: sum(1 for event in events if event['application'] == name))
+    event = {
+        'application': application,
+        'start_date': '2020-03-01',
+        'end_date': '2020-03-{:02d}'.format(DAYS),
+        'metric': '',
+        'operation': '',
+        'top': '',
+    }
+
+    stages = {}
+    stages['parse'], request = timed(lambda: function_post.parse_request(event), repeat)
+    stages['plan'], plan = timed(
+        lambda: function_post.planner.plan(request['application'], request['start'], request['end']), repeat)
+    stages['execute'], response = timed(lambda: function_post.planner.execute(plan), repeat)
+    stages['serialize'], _ = timed(lambda: function_post.serialize({'counts': response, 'summary': {}}), repeat)
+    stages['handler'], _ = timed(lambda: function_post.handler(event, None), repeat)
+
+    # Memory allocated by one more call at most, on top of what the runtime and the tables hold.
+    tracemalloc.start()
+    function_post.handler(event, None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'events': size,
+        'stored': emulator.table.count(),
+        'items': sum(response.values()),
+        'strategy': plan['strategy'],
+        'predicted': plan['predicted'],
+        'actual': plan['actual'],
+        'ms': stages,
+        'peak_kb': round(peak / 1024.0, 1),
+    }
+
+
+def rollups(events, since):
+    # The daily counts and totals the stream function would have written for the stored events.
+    counts = {}
+    for event in events:
+        key = (event['application'], timestamps.day(timestamps.parse_created_at(event['created_at'])))
+        counts[key] = counts.get(key, 0) + 1
+    totals = {}
+    for (application, day), count in counts.items():
+        totals[application] = totals.get(application, 0) + count
+    return [{'pk': application, 'sk': DAILY_PREFIX + day, 'count': count}
+            for (application, day), count in counts.items()] + \
+           [{'pk': application, 'sk': TOTAL_KEY, 'count': count, 'since': since}
+            for application, count in totals.items()]
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL) \
+            .decode('ascii').strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(results, baseline):
+    print('{:>8} {:<10} {:>10} {:>10} {:>8}'.format('events', 'stage', 'baseline', 'current', 'change'))
+    for size, current in sorted(results['sizes'].items(), key=lambda pair: int(pair[0])):
+        previous = baseline['sizes'].get(size)
+        if previous is None:
+            continue
+        for stage, ms in current['ms'].items():
+            before = previous['ms'].get(stage)
+            if before:
+                print('{:>8} {:<10} {:>10.3f} {:>10.3f} {:>+7.1f}%'.format(size, stage, before, ms,
+                                                                          (ms / before - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times each stage of the read handler against in-memory tables.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-rollups', action='store_true', help='leave the daily counts out, as before the stream '
+                                                                  'function saw the events')
+    parser.add_argument('--output', help='where to write the results, benchmarks/results/<commit>.json by default')
+    parser.add_argument('--compare', help='results of an earlier commit to compare with')
+    args = parser.parse_args()
+
+    results = {'commit': commit(), 'days': DAYS, 'rollups': not args.no_rollups, 'sizes': {}}
+    print('{:>8} {:>8} {:>8} {:<8} {:>15} {:>15} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'events', 'stored', 'items', 'strategy', 'predicted', 'actual', 'parse', 'plan', 'execute', 'serialize',
+        'handler'))
+    for size in args.sizes:
+        result = run(size, args.repeat, with_rollups=not args.no_rollups)
+        results['sizes'][str(size)] = result
+        print('{:>8} {:>8} {:>8} {:<8} {:>15} {:>15} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+            result['events'], result['stored'], result['items'], result['strategy'],
+            '{requests} req {read_units:g} RCU'.format(**result['predicted']),
+            '{requests} req {read_units:g} RCU'.format(**result['actual']),
+            *[result['ms'][stage] for stage in ['parse', 'plan', 'execute', 'serialize', 'handler']]))
+
+    output = args.output or os.path.join(RESULTS, '{}.json'.format(results['commit']))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+    print('results written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == '__main__':
+    main()
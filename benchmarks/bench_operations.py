@@ -0,0 +1,95 @@
+import argparse
+import datetime
+import json
+import logging
+import time
+
+import timestamps
+from benchmarks.bench_approximate import SlowTable
+from benchmarks.generators import OPERATIONS, synthetic_events
+from local.emulator import Emulator
+from planner import TOTAL_KEY
+
+
+def load(emulator, events, days, exponent, seed):
+    # Events and the totals the stream function keeps, the busiest application is counted.
+    emulator.table.clear()
+    emulator.table.load(synthetic_events(events, days, seed=seed, operation_exponent=exponent))
+    application = max(emulator.table.partitions, key=lambda name: len(emulator.table.partitions[name]))
+    items = emulator.table.partitions[application].values()
+    since = min(timestamps.day(timestamps.parse_created_at(item['created_at'])) for item in items)
+    # Every generated event has the key of the operation index.
+    emulator.table_aggregates.put_item(Item={'pk': application, 'sk': TOTAL_KEY, 'count': len(items),
+                                             'since': since, 'index_since': since})
+
+    shares = {}
+    for item in items:
+        shares[item['operation']] = shares.get(item['operation'], 0) + 1
+    return application, {operation: count / float(len(items)) for operation, count in shares.items()}
+
+
+def trial(planner, application, operation, start, end):
+    # Every candidate is executed, the planner would only run the first.
+    results = []
+    for index, plan in enumerate(planner.plans(application, start, end, operation)):
+        started = time.time()
+        response = planner.execute(plan)
+        results.append({
+            'operation': operation,
+            'strategy': plan['strategy'],
+            'chosen': index == 0,
+            'events': sum(response.values()),
+            'elapsed': round((time.time() - started) * 1000, 1),
+            'predicted': plan['predicted'],
+            'actual': plan['actual'],
+        })
+    return results
+
+
+def run(events, days, exponents, latency, seed=1):
+    emulator = Emulator(stream=False)
+    planner = emulator.function_post.planner
+    planner.table = SlowTable(emulator.table, latency)
+
+    # The functions log every request at INFO when imported.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for exponent in exponents:
+        application, shares = load(emulator, events, days, exponent, seed)
+        start = timestamps.parse_request_date('2020-03-01')
+        end = timestamps.parse_request_date(timestamps.day(start + datetime.timedelta(days=days - 1)), end=True)
+        for operation in OPERATIONS:
+            for result in trial(planner, application, operation, start, end):
+                result.update({'exponent': exponent, 'share': round(shares.get(operation, 0.0), 4)})
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares counting the events of one operation on the operation '
+                                                 'index with filtering every event of the application.')
+    parser.add_argument('--events', type=int, default=300000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--exponents', type=float, nargs='+', default=[0.5, 1.5, 3.0],
+                        help='Zipf exponents of the operation mix, higher is more skewed')
+    parser.add_argument('--latency', type=float, default=5, help='ms per query')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.events, args.days, args.exponents, args.latency)
+
+    print('{:>8} {:<12} {:>7} {:<8} {:>8} {:>9} {:>10} {:>10}'.format(
+        'exponent', 'operation', 'share', 'strategy', 'events', 'ms', 'requests', 'RCU'))
+    for result in results:
+        print('{exponent:>8} {operation:<12} {share:>7.2%} {strategy:<8} {events:>8} {elapsed:>9.1f} '
+              '{requests:>10} {read_units:>10.1f}{chosen}'.format(
+                  **dict(result, chosen=' *' if result['chosen'] else '', **result['actual'])))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
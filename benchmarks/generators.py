@@ -0,0 +1,57 @@
+import bisect
+import datetime
+import itertools
+import random
+
+import timestamps
+
+# Relative traffic per hour of the day (UTC), quiet at night with an evening peak.
+DIURNAL = [3, 2, 1, 1, 1, 2, 4, 6, 8, 9, 9, 10, 11, 10, 10, 11, 12, 14, 17, 20, 19, 15, 9, 5]
+
+# Operations in order of frequency, a couple of them make up most of the events.
+OPERATIONS = ['play', 'pause', 'seek', 'complete', 'buffer', 'resume', 'stop', 'error', 'quality', 'volume',
+              'fullscreen', 'subtitles']
+
+
+def zipf_weights(count, exponent):
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def chooser(generator, values, weights):
+    # Draws a value with the given weights in O(log n).
+    cumulative = list(itertools.accumulate(weights))
+    total = cumulative[-1]
+    return lambda: values[min(bisect.bisect(cumulative, generator.random() * total), len(values) - 1)]
+
+
+def synthetic_events(count, days, applications=50, seed=1, start=datetime.datetime(2020, 3, 1),
+                     burst_ratio=0.2, operation_exponent=1.5):
+    # Events in item format, the same values always come out of the same seed. Applications and operations follow
+    # a Zipf law, hours a diurnal pattern and a share of the events arrive in bursts within a single second.
+    generator = random.Random(seed)
+    application = chooser(generator, ['application-{}'.format(index) for index in range(1, applications + 1)],
+                          zipf_weights(applications, 1.1))
+    hour = chooser(generator, list(range(24)), DIURNAL)
+    operation = chooser(generator, OPERATIONS, zipf_weights(len(OPERATIONS), operation_exponent))
+
+    events = []
+    # Bursts are heavy tailed, but a single one is kept below a hundred events.
+    while len(events) < count:
+        created_at = start + datetime.timedelta(days=generator.randrange(days), hours=hour(),
+                                                minutes=generator.randrange(60), seconds=generator.randrange(60))
+        burst = min(100, int(generator.paretovariate(1.0))) if generator.random() < burst_ratio else 1
+        name = application()
+        for _ in range(min(burst, count - len(events))):
+            operation_name = operation()
+            events.append({
+                'application': name,
+                'created_at': timestamps.format_created_at(created_at),
+                'operation': operation_name,
+                'application_operation': '{}#{}'.format(name, operation_name),
+                'current_media_time': round(generator.uniform(0, 3600), 3),
+                'source_ip': '10.{}.{}.{}'.format(generator.randrange(256), generator.randrange(256),
+                                                  generator.randrange(1, 255)),
+                'user_agent': 'Mozilla/5.0 (compatible; player/{}.{})'.format(generator.randrange(20),
+                                                                              generator.randrange(10)),
+            })
+    return events
@@ -0,0 +1,84 @@
+import math
+
+
+class LatencyHistogram(object):
+    # High dynamic range histogram of latencies in microseconds. Values are kept to a fixed number of significant
+    # digits, so memory depends on the range of values and not on how many were recorded.
+
+    def __init__(self, significant_digits=3):
+        self.significant_digits = significant_digits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        digits = len(str(value))
+        if digits <= self.significant_digits:
+            return value
+        magnitude = 10 ** (digits - self.significant_digits)
+        return value // magnitude * magnitude
+
+    def record(self, seconds):
+        value = max(int(round(seconds * 1000000)), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percent):
+        # Value in milliseconds below which the given percent of values fall.
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket, self.max) / 1000.0
+        return self.max / 1000.0
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'min': self.min / 1000.0,
+            'mean': round(self.total / float(self.count) / 1000.0, 3),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max / 1000.0,
+        }
+
+    def to_dict(self):
+        return {
+            'significant_digits': self.significant_digits,
+            'counts': {str(bucket): count for bucket, count in sorted(self.counts.items())},
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        histogram = cls(significant_digits=values['significant_digits'])
+        histogram.counts = {int(bucket): count for bucket, count in values['counts'].items()}
+        histogram.count = sum(histogram.counts.values())
+        histogram.total = values['total']
+        histogram.min = values['min']
+        histogram.max = values['max']
+        return histogram
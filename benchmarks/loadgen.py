@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+
+from benchmarks.histogram import LatencyHistogram
+from client.pool import ConnectionPool
+
+# Percentiles compared with the baseline.
+REGRESSION_PERCENTILES = ['p50', 'p99', 'p999']
+
+OPERATIONS = ['play', 'pause', 'seek', 'complete']
+
+
+def synthetic_trace(rate, duration, put_ratio, applications, seed):
+    # Poisson arrivals at the target rate. Most writes go to a few applications, reads ask for recent days.
+    generator = random.Random(seed)
+    today = datetime.date.today()
+    offset = 0.0
+    while True:
+        offset += generator.expovariate(rate)
+        if offset >= duration:
+            return
+        application = 'application-{}'.format(min(int(generator.paretovariate(1.2)), applications))
+        if generator.random() < put_ratio:
+            yield offset, 'PUT', {
+                'application': application,
+                'operation': generator.choice(OPERATIONS),
+                'currentMediaTime': round(generator.uniform(0, 3600), 3),
+            }
+        else:
+            days = generator.choice([1, 7, 30])
+            yield offset, 'POST', {
+                'application': application,
+                'startDate': (today - datetime.timedelta(days=days - 1)).isoformat(),
+                'endDate': today.isoformat(),
+            }
+
+
+def recorded_trace(path, speed):
+    # One request per line: {"offset": seconds, "method": "PUT", "body": {...}}.
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                record = json.loads(line)
+                yield record['offset'] / speed, record['method'], record['body']
+
+
+class Run(object):
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, method, status, latency):
+        for key in [method, 'all']:
+            self.latencies.setdefault(key, LatencyHistogram()).record(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def report(self, target_rate):
+        elapsed = self.finished - self.started
+        completed = sum(self.statuses.values())
+        return {
+            'target_rate': target_rate,
+            'throughput': round(completed / elapsed, 2) if elapsed else 0,
+            'duration': round(elapsed, 3),
+            'requests': completed,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': self.errors,
+            'latency': {method: histogram.summary() for method, histogram in sorted(self.latencies.items())},
+            'histograms': {method: histogram.to_dict() for method, histogram in sorted(self.latencies.items())},
+        }
+
+
+async def issue(pool, run, method, body, intended):
+    # Latency is measured from the intended start, so a slow server cannot hide queueing (coordinated omission).
+    try:
+        status = await pool.request(method, '/applications', body)
+    except Exception as e:
+        status = 0
+        name = type(e).__name__
+        run.errors[name] = run.errors.get(name, 0) + 1
+    run.record(method, status, time.perf_counter() - intended)
+
+
+async def generate(url, trace, connections, api_key=None):
+    # Open loop: requests are sent on schedule whether or not earlier ones have finished.
+    pool = ConnectionPool(url, connections, user_agent='applicationmetrics-loadgen', api_key=api_key)
+    run = Run()
+    tasks = []
+    run.started = time.perf_counter()
+    for offset, method, body in trace:
+        intended = run.started + offset
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(issue(pool, run, method, body, intended)))
+    if tasks:
+        await asyncio.wait(tasks)
+    run.finished = time.perf_counter()
+    pool.close()
+    return run
+
+
+def regressions(report, baseline, tolerance):
+    # Percentiles slower than the baseline by more than the tolerance.
+    found = []
+    for method, summary in baseline['latency'].items():
+        current = report['latency'].get(method)
+        if not current:
+            continue
+        for percentile in REGRESSION_PERCENTILES:
+            if percentile in summary and current.get(percentile) > summary[percentile] * (1 + tolerance):
+                found.append('{} {} {:.3f} ms > {:.3f} ms'.format(method, percentile, current[percentile],
+                                                                  summary[percentile]))
+    return found
+
+
+def start_local():
+    # Runs the emulator on a free port in a background thread.
+    from local.emulator import Emulator, serve
+    import logging
+
+    emulator = Emulator()
+    logging.getLogger().setLevel(logging.WARNING)
+    server = serve(emulator, '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def print_report(report):
+    print('requests:   {} in {:.1f} s, {:.1f}/s (target {}/s)'.format(report['requests'], report['duration'],
+                                                                    report['throughput'], report['target_rate']))
+    print('statuses:   {}'.format(', '.join('{}: {}'.format(*pair) for pair in report['statuses'].items())))
+    if report['errors']:
+        print('errors:     {}'.format(', '.join('{}: {}'.format(*pair) for pair in report['errors'].items())))
+    print('{:<8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('', 'count', 'p50', 'p90', 'p99', 'p999', 'max'))
+    for method, summary in report['latency'].items():
+        print('{:<8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            method, summary['count'], summary['p50'], summary['p90'], summary['p99'], summary['p999'], summary['max']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Puts open-loop load on the API and reports latency.')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='base URL of a deployed stage, like https://{id}.execute-api.{region}.amazonaws.com/prod')
+    target.add_argument('--local', action='store_true', help='run against the local emulator')
+    parser.add_argument('--rate', type=float, default=50, help='requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--put-ratio', type=float, default=0.9)
+    parser.add_argument('--applications', type=int, default=20)
+    parser.add_argument('--trace', help='replay a recorded trace instead of synthesizing one')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed of the trace')
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--api-key', help='sent as x-api-key, deployed stages require one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--baseline', help='fail when latency regresses against this report')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='allowed slowdown against the baseline')
+    arguments = parser.parse_args()
+
+    url = start_local() if arguments.local else arguments.url
+    if arguments.trace:
+        trace = recorded_trace(arguments.trace, arguments.speed)
+    else:
+        trace = synthetic_trace(arguments.rate, arguments.duration, arguments.put_ratio, arguments.applications,
+                                arguments.seed)
+
+    loop = asyncio.get_event_loop()
+    run = loop.run_until_complete(generate(url, trace, arguments.connections, arguments.api_key))
+    report = run.report(arguments.rate)
+    print_report(report)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as fp:
+            found = regressions(report, json.load(fp), arguments.max_regression)
+        for regression in found:
+            print('regression: {}'.format(regression))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import json
+import logging
+import math
+
+from approximate import REQUEST_MS
+from benchmarks.bench_handler import SIZES, run
+
+# Memory settings of the function in MB. Lambda gives a whole vCPU at VCPU_MB and a share of one in proportion to
+# memory below it, the benchmark is taken to run on a whole core.
+TIERS = [128, 256, 512, 1024, 1769, 3008]
+VCPU_MB = 1769
+
+# Lambda prices (us-east-1, x86) per GB-second of billed duration and per request.
+GB_SECOND = 0.0000166667
+REQUEST = 0.0000002
+
+# MB used by the runtime with boto3 loaded before the first request, from the REPORT line of a cold start. The peak
+# measured by the benchmark is added to it.
+RUNTIME_MB = 70
+
+# Memory kept free over the modelled use, and the timeout as a multiple of the slowest modelled invocation.
+MEMORY_HEADROOM = 1.25
+TIMEOUT_FACTOR = 3
+
+# Lambda default and smallest timeout considered, in seconds.
+MIN_TIMEOUT = 3
+
+# Concurrent executions the throughput is modelled for.
+CONCURRENCY = [1, 10, 100]
+
+
+def model(result, memory, request_ms=REQUEST_MS):
+    # Latency, cost and memory of an invocation at a memory setting. CPU time stretches as the share of a vCPU
+    # shrinks, the DynamoDB round trips of the plan do not.
+    cpu_ms = result['ms']['handler'] * max(1.0, VCPU_MB / float(memory))
+    latency = cpu_ms + result['actual']['requests'] * request_ms
+    used = RUNTIME_MB + result['peak_kb'] / 1024.0
+    return {
+        'memory': memory,
+        'latency_ms': round(latency, 3),
+        'cost_per_million': round(1e6 * (GB_SECOND * memory / 1024.0 * math.ceil(latency) / 1000.0 + REQUEST), 4),
+        'used_mb': round(used, 1),
+        'fits': used * MEMORY_HEADROOM <= memory,
+    }
+
+
+def throughput(latency_ms, concurrency):
+    # Requests per second the executions can serve back to back.
+    return round(concurrency * 1000.0 / latency_ms, 1) if latency_ms else float('inf')
+
+
+def recommend(results, tiers=TIERS, target_ms=1000, rate=10, request_ms=REQUEST_MS):
+    # The cheapest memory setting in which every size fits and takes at most target_ms, or the fastest that fits.
+    # The timeout leaves room for the slowest invocation, the concurrency is what rate requests per second need.
+    candidates = []
+    for memory in tiers:
+        models = [model(result, memory, request_ms) for result in results]
+        if all(modelled['fits'] for modelled in models):
+            worst = max(modelled['latency_ms'] for modelled in models)
+            cost = sum(modelled['cost_per_million'] for modelled in models) / len(models)
+            candidates.append((worst <= target_ms, worst, cost, memory))
+    if not candidates:
+        return None
+
+    meeting = [candidate for candidate in candidates if candidate[0]]
+    if meeting:
+        _, worst, cost, memory = min(meeting, key=lambda candidate: (candidate[2], candidate[3]))
+    else:
+        _, worst, cost, memory = min(candidates, key=lambda candidate: (candidate[1], candidate[3]))
+    return {
+        'memory_size': memory,
+        'timeout': max(MIN_TIMEOUT, int(math.ceil(worst * TIMEOUT_FACTOR / 1000.0))),
+        'latency_ms': worst,
+        'cost_per_million': round(cost, 4),
+        'concurrency': int(math.ceil(rate * worst / 1000.0)),
+        'meets_target': bool(meeting),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the handler benchmark over data sizes, models latency, cost '
+                                                 'and throughput per memory setting and recommends one.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tiers', type=int, nargs='+', default=TIERS, help='memory settings in MB')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY)
+    parser.add_argument('--request-ms', type=float, default=REQUEST_MS, help='round trip of a DynamoDB request')
+    parser.add_argument('--target-ms', type=float, default=1000, help='slowest acceptable invocation')
+    parser.add_argument('--rate', type=float, default=10, help='requests per second to size concurrency for')
+    parser.add_argument('--output', help='where to write the measurements and the recommendation')
+    args = parser.parse_args()
+
+    results = [run(size, args.repeat) for size in args.sizes]
+    # The functions set the root logger to INFO when imported.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print('{:>8} {:>8} {:>8} {:>11} {:>9} {:>6} {:>13}  {}'.format(
+        'events', 'memory', 'used MB', 'latency ms', '$/M req', 'fits', 'handler ms', ' '.join(
+            '{:>9}'.format('rps@{}'.format(concurrency)) for concurrency in args.concurrency)))
+    for result in results:
+        for memory in args.tiers:
+            modelled = model(result, memory, args.request_ms)
+            print('{:>8} {:>8} {:>8.1f} {:>11.1f} {:>9.4f} {:>6} {:>13.3f}  {}'.format(
+                result['events'], memory, modelled['used_mb'], modelled['latency_ms'],
+                modelled['cost_per_million'], 'yes' if modelled['fits'] else 'no', result['ms']['handler'],
+                ' '.join('{:>9.1f}'.format(throughput(modelled['latency_ms'], concurrency))
+                         for concurrency in args.concurrency)))
+
+    recommendation = recommend(results, args.tiers, args.target_ms, args.rate, args.request_ms)
+    if recommendation is None:
+        print('no memory setting fits')
+    else:
+        print('recommended: ApplicationmetricsStack(..., memory_size={memory_size}, timeout={timeout}), '
+              '{latency_ms:.1f} ms at worst, ${cost_per_million:.4f} per million requests, {concurrency} concurrent '
+              'executions for {rate:g} requests per second{note}'.format(
+                  rate=args.rate, note='' if recommendation['meets_target'] else ' (slower than the target)',
+                  **recommendation))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'results': results, 'recommendation': recommendation}, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+from client.ingest import Client, DROP_NEWEST, DROP_OLDEST
+from client.pool import ConnectionPool
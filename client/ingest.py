@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import random
+import time
+import uuid
+
+from client.pool import ConnectionPool
+
+# What happens to a new event when the buffer is full, the backend is down or slower than the events come in.
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+# Statuses the PUT integration maps from DynamoDB that are worth sending again, throttling and server errors.
+# Every other status means the event itself was rejected.
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class Client(object):
+    # Sends events to the PUT /applications endpoint of a stage. Events are buffered in memory and flushed in
+    # batches once batch_size are waiting or every flush_interval seconds. The API takes one event per request, the
+    # events of a batch are sent concurrently over a pool of keep-alive connections. Throttled and failed requests
+    # are retried with exponential backoff and full jitter.
+    #
+    # Memory is bounded by max_buffer events waiting and max_batches batches in flight. When the buffer is full the
+    # oldest or newest event is dropped, following drop_policy. Every event carries the time it was tracked as
+    # eventTime, so events sent late still count on the day they happened, and an eventId, so an event retried after
+    # it was stored is not counted twice.
+    #
+    # track() must be called from the event loop the client was started on.
+    #
+    #   async with Client('https://{id}.execute-api.{region}.amazonaws.com/prod', api_key='...') as client:
+    #       client.track('application-1', 'play', 12.5)
+
+    def __init__(self, url, batch_size=100, flush_interval=1.0, connections=16, max_buffer=10000, max_batches=4,
+                 drop_policy=DROP_OLDEST, max_attempts=5, backoff_base=0.1, backoff_cap=5.0,
+                 user_agent='applicationmetrics-client', api_key=None, seed=None):
+        if drop_policy not in [DROP_OLDEST, DROP_NEWEST]:
+            raise ValueError('drop_policy must be {!r} or {!r}.'.format(DROP_OLDEST, DROP_NEWEST))
+        self.pool = ConnectionPool(url, connections, user_agent=user_agent, api_key=api_key)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_batches = max_batches
+        self.drop_policy = drop_policy
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.generator = random.Random(seed)
+
+        self.buffer = collections.deque()
+        self.batches = set()
+        self.timer = None
+        self.stats = {'tracked': 0, 'sent': 0, 'rejected': 0, 'failed': 0, 'dropped': 0, 'retries': 0}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        if self.timer is None:
+            self.timer = asyncio.ensure_future(self._flush_periodically())
+
+    def track(self, application, operation, current_media_time, event_time=None):
+        # Buffers an event, event_time in epoch ms defaults to now. Returns False when the event was dropped.
+        self.stats['tracked'] += 1
+        if len(self.buffer) >= self.max_buffer:
+            self.stats['dropped'] += 1
+            if self.drop_policy == DROP_NEWEST:
+                return False
+            self.buffer.popleft()
+
+        self.buffer.append({
+            'application': application,
+            'operation': operation,
+            'currentMediaTime': current_media_time,
+            'eventTime': int(time.time() * 1000) if event_time is None else int(event_time),
+            'eventId': uuid.uuid4().hex,
+        })
+        if len(self.buffer) >= self.batch_size:
+            self._dispatch(full_only=True)
+        return True
+
+    async def flush(self):
+        # Sends everything buffered and waits for every batch in flight.
+        while self.buffer or self.batches:
+            self._dispatch()
+            if self.batches:
+                await asyncio.wait(list(self.batches))
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        try:
+            await self.flush()
+        finally:
+            self.pool.close()
+
+    def _dispatch(self, full_only=False):
+        # Starts batches while there are events and room in flight. Events left waiting stay in the bounded buffer.
+        while self.buffer and len(self.batches) < self.max_batches:
+            if full_only and len(self.buffer) < self.batch_size:
+                return
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self.batches.discard(task)
+        # A batch finishing makes room for events that could not be sent before.
+        if len(self.buffer) >= self.batch_size:
+            self._dispatch(full_only=True)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self._dispatch()
+
+    async def _send_batch(self, batch):
+        await asyncio.gather(*[self._send(event) for event in batch])
+
+    async def _send(self, event):
+        for attempt in range(self.max_attempts):
+            try:
+                status = await self.pool.request('PUT', '/applications', event)
+            except (OSError, asyncio.IncompleteReadError):
+                status = None
+
+            if status == 200:
+                self.stats['sent'] += 1
+                return
+            if status is not None and status not in RETRY_STATUSES:
+                self.stats['rejected'] += 1
+                return
+            if attempt + 1 < self.max_attempts:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self.backoff(attempt))
+        self.stats['failed'] += 1
+
+    def backoff(self, attempt):
+        # Full jitter, clients throttled together spread their retries instead of coming back at once.
+        return self.generator.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
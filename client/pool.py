@@ -0,0 +1,88 @@
+import asyncio
+import json
+import ssl
+from urllib.parse import urlparse
+
+
+class ConnectionPool(object):
+    # Keep-alive HTTP/1.1 connections to one host. Requests wait for a free connection when all are busy.
+
+    def __init__(self, url, size, user_agent='applicationmetrics-client', api_key=None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.secure = parsed.scheme == 'https'
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.path = parsed.path.rstrip('/')
+        self.user_agent = user_agent
+        self.api_key = api_key
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        return await asyncio.open_connection(self.host, self.port,
+                                             ssl=ssl.create_default_context() if self.secure else None)
+
+    async def request(self, method, path, body):
+        await self.slots.acquire()
+        try:
+            reused = bool(self.idle)
+            connection = self.idle.pop() if reused else await self._connect()
+            try:
+                status, keep_alive = await self._send(connection, method, path, body)
+            except ConnectionError:
+                # The server may have closed an idle connection, try once more on a new one.
+                connection[1].close()
+                if not reused:
+                    raise
+                connection = await self._connect()
+                status, keep_alive = await self._send(connection, method, path, body)
+            except Exception:
+                connection[1].close()
+                raise
+            if keep_alive:
+                self.idle.append(connection)
+            else:
+                connection[1].close()
+            return status
+        finally:
+            self.slots.release()
+
+    async def _send(self, connection, method, path, body):
+        reader, writer = connection
+        data = json.dumps(body).encode('utf-8')
+        headers = 'X-Api-Key: {}\r\n'.format(self.api_key) if self.api_key else ''
+        writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'User-Agent: {}\r\n{}Connection: keep-alive\r\n\r\n'
+                     .format(method, self.path + path, self.host, len(data), self.user_agent, headers)
+                     .encode('ascii') + data)
+        await writer.drain()
+
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('The connection was closed by the server.')
+        version, status = line.split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await reader.readexactly(int(headers.get('content-length', 0)))
+
+        if version == b'HTTP/1.0':
+            return status, headers.get('connection', '').lower() == 'keep-alive'
+        return status, headers.get('connection', '').lower() != 'close'
+
+    def close(self):
+        for reader, writer in self.idle:
+            writer.close()
@@ -0,0 +1,152 @@
+import json
+import logging
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+# Attempts at a read-modify-write before giving up on a contended item.
+MERGE_ATTEMPTS = 5
+
+# Digits of a stream sequence number. They are stored zero padded, so conditions compare them as strings.
+SEQUENCE_DIGITS = 40
+
+
+def sequence_value(sequence):
+    return str(sequence).zfill(SEQUENCE_DIGITS)
+
+
+def merge_sketch(table, pk, sk, cls, records):
+    # Stream records, (sequence number, value) pairs, are added to a stored sketch once. The item keeps the
+    # sequence number of the last record merged into it and records at or below it, from a retried or split batch,
+    # are skipped. Records of an application come in order from one shard, so the number only grows. Records
+    # without a sequence number are always merged.
+    # Sketches are merged with optimistic locking. The version is bumped on every write so concurrent writers
+    # re-read and merge again instead of overwriting each other.
+    for attempt in range(MERGE_ATTEMPTS):
+        item = table.get_item(Key={'pk': pk, 'sk': sk}, ConsistentRead=True).get('Item')
+        # Sequence numbers have up to 40 digits, more than a DynamoDB number holds.
+        merged_sequence = int(item.get('sequence', '0')) if item else 0
+        fresh = [(sequence, value) for sequence, value in records if sequence is None or sequence > merged_sequence]
+        if not fresh:
+            return None
+
+        sketch = cls()
+        for sequence, value in fresh:
+            sketch.add(value)
+        sequence = max([merged_sequence] + [sequence for sequence, value in fresh if sequence is not None])
+
+        if item:
+            merged = cls.from_bytes(item['sketch'].value)
+            merged.merge(sketch)
+            condition = Attr('version').eq(item['version'])
+            version = item['version'] + 1
+        else:
+            merged = sketch
+            condition = Attr('sk').not_exists()
+            version = 1
+
+        try:
+            table.put_item(
+                Item={
+                    'pk': pk,
+                    'sk': sk,
+                    'sketch': merged.to_bytes(),
+                    'version': version,
+                    'sequence': sequence_value(sequence),
+                },
+                ConditionExpression=condition
+            )
+            return merged
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logging.info('conflict: {}'.format(json.dumps({'pk': pk, 'sk': sk, 'attempt': attempt})))
+
+    raise Exception('Too many conflicting writes for {} {}.'.format(pk, sk))
+
+
+def add_counts(table, key, records, update=None, values=None):
+    # Stream records, (sequence number, counters) pairs, are added to the counters of an item once, like sketches
+    # are merged. The item keeps the sequence number of the last record added and the update is conditional on it,
+    # so records at or below it, from a retried or split batch, are skipped. Records without a sequence number are
+    # always added. update is a SET clause with its values written along, it must not count anything itself.
+    merged_sequence = None
+    for attempt in range(MERGE_ATTEMPTS):
+        fresh = [(sequence, counters) for sequence, counters in records
+                 if sequence is None or merged_sequence is None or sequence > merged_sequence]
+        if not fresh:
+            return
+
+        totals = {}
+        for sequence, counters in fresh:
+            for name, count in counters.items():
+                if count:
+                    totals[name] = totals.get(name, 0) + count
+        sequences = [sequence for sequence, counters in fresh if sequence is not None]
+
+        assignments = [update] if update else []
+        names = {'#' + name: name for name in totals}
+        expression_values = dict(values or {}, **{':' + name: count for name, count in totals.items()})
+        kwargs = {}
+        if sequences:
+            assignments.append('#sequence = :sequence')
+            names['#sequence'] = 'sequence'
+            expression_values[':sequence'] = sequence_value(max(sequences))
+            # The first attempt expects every record to be new, a later one the sequence number it read.
+            if merged_sequence is None:
+                kwargs['ConditionExpression'] = Attr('sequence').not_exists() | \
+                    Attr('sequence').lt(sequence_value(min(sequences)))
+            else:
+                kwargs['ConditionExpression'] = Attr('sequence').eq(sequence_value(merged_sequence))
+        expression = ' '.join(
+            (['SET ' + ', '.join(assignments)] if assignments else []) +
+            (['ADD ' + ', '.join('#{0} :{0}'.format(name) for name in sorted(totals))] if totals else []))
+        if not expression:
+            return
+
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        if expression_values:
+            kwargs['ExpressionAttributeValues'] = expression_values
+
+        try:
+            table.update_item(Key=key, UpdateExpression=expression, **kwargs)
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        # Some records were added before, the ones after the stored sequence number are added on the next attempt.
+        item = table.get_item(Key=key, ConsistentRead=True).get('Item') or {}
+        merged_sequence = int(item.get('sequence', '0'))
+        logging.info('retried: {}'.format(json.dumps(dict(key, attempt=attempt))))
+
+    raise Exception('Too many conflicting writes for {}.'.format(json.dumps(key)))
+
+
+def query_range(table, pk, sk_start, sk_end):
+    # All items of a partition between two sort keys, following pagination.
+    return query_all(table, {
+        'KeyConditionExpression': Key('pk').eq(pk) & Key('sk').between(sk_start, sk_end)
+    })
+
+
+def query_partition(table, pk):
+    # All items of a partition, following pagination.
+    return query_all(table, {
+        'KeyConditionExpression': Key('pk').eq(pk)
+    })
+
+
+def query_all(table, kwargs):
+    items = []
+    while True:
+        data = table.query(**kwargs)
+        items.extend(data['Items'])
+        if 'LastEvaluatedKey' not in data:
+            return items
+        kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+
+def query_sketches(table, pk, sk_start, sk_end, cls):
+    # Sketches keyed by their sort key.
+    return {item['sk']: cls.from_bytes(item['sketch'].value) for item in query_range(table, pk, sk_start, sk_end)}
@@ -0,0 +1,242 @@
+import collections
+import datetime
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import timestamps
+
+# Normal quantile of the two sided 95% confidence intervals.
+Z = 1.96
+
+# Events a probe should count on average, the window width follows from the density of the application. A count
+# query reads about five thousand events per page, the latency of a probe barely grows with its width.
+TARGET_WINDOW_EVENTS = 1000
+
+# Bounds of the window width in seconds. created_at only has seconds, a day is split into whole windows.
+MIN_WINDOW = 1
+MAX_WINDOW = 86400
+
+# Latency of one query, exact counts are returned when the whole plan fits in the budget.
+REQUEST_MS = 10
+
+# Probes in flight at once.
+CONCURRENCY = 16
+
+
+def window_width(density):
+    # Seconds per window for an application with density events per day.
+    if density <= 0:
+        return MAX_WINDOW
+    width = int(TARGET_WINDOW_EVENTS * 86400 / float(density))
+    return max(MIN_WINDOW, min(MAX_WINDOW, width))
+
+
+class Bucket(object):
+    # A day, or part of one, split into windows of the same width give or take a second. Windows are probed in
+    # random order without replacement and the count of the bucket is extrapolated from their mean.
+
+    def __init__(self, start, end, width, generator):
+        self.start = start
+        self.end = end
+        self.seconds = int((end - start).total_seconds()) + 1
+        self.windows = int(math.ceil(self.seconds / float(width)))
+        self.generator = generator
+        self.probed = set()
+        # Events of each probed window.
+        self.samples = []
+        self.cached = None
+        self.cached_relative_variance = False
+
+    @property
+    def complete(self):
+        return len(self.probed) == self.windows
+
+    def next_window(self, index=None):
+        # The given window, or one picked at random when there is none or it was probed already. Windows are
+        # returned once, as (start, end) both inclusive to the second.
+        if index in self.probed:
+            index = None
+        if index is None:
+            if len(self.probed) * 2 < self.windows:
+                index = self.generator.randrange(self.windows)
+                while index in self.probed:
+                    index = self.generator.randrange(self.windows)
+            else:
+                index = self.generator.choice([index for index in range(self.windows) if index not in self.probed])
+        self.probed.add(index)
+        start = self.start + datetime.timedelta(seconds=index * self.seconds // self.windows)
+        end = self.start + datetime.timedelta(seconds=(index + 1) * self.seconds // self.windows - 1)
+        return start, min(end, self.end)
+
+    def add(self, events):
+        self.samples.append(events)
+        self.cached = None
+        self.cached_relative_variance = False
+
+    def rate(self):
+        # Events per second.
+        return self.mean() * self.windows / float(self.seconds)
+
+    def mean(self):
+        return sum(self.samples) / float(len(self.samples)) if self.samples else 0.0
+
+    def relative_variance(self):
+        if self.cached_relative_variance is False:
+            self.cached_relative_variance = self._relative_variance()
+        return self.cached_relative_variance
+
+    def _relative_variance(self):
+        # Squared coefficient of variation of window counts, None with less than two windows.
+        if len(self.samples) < 2:
+            return None
+        mean = self.mean()
+        if not mean:
+            return 0.0
+        return sum((events - mean) ** 2 for events in self.samples) / (len(self.samples) - 1) / mean ** 2
+
+    def estimate(self, pooled_relative_variance):
+        # Estimated events and the variance of the estimate, kept until the next window is added.
+        if self.cached is None or self.cached[0] != pooled_relative_variance:
+            self.cached = (pooled_relative_variance, self._estimate(pooled_relative_variance))
+        return self.cached[1]
+
+    def _estimate(self, pooled_relative_variance):
+        observed = sum(self.samples)
+        if self.complete:
+            return observed, 0.0
+        estimate = self.mean() * self.windows
+        relative_variance = self.relative_variance()
+        if relative_variance is None:
+            relative_variance = pooled_relative_variance
+        n = len(self.samples)
+        variance = estimate ** 2 * relative_variance * (1 - n / float(self.windows)) / n
+        return max(estimate, observed), variance
+
+
+def unsampled(buckets):
+    # Buckets never probed are extrapolated from the mean rate of the others. Returns the mean rate, the variance
+    # of rates between buckets and the variance of the mean, which is shared by every bucket never probed.
+    rates = [bucket.rate() for bucket in buckets if bucket.samples]
+    if not rates:
+        return 0.0, 0.0, 0.0
+    mean = sum(rates) / len(rates)
+    spread = sum((rate - mean) ** 2 for rate in rates) / (len(rates) - 1) if len(rates) > 1 else mean ** 2
+    return mean, spread, spread / len(rates)
+
+
+def sample(count, ranges, density, budget, seed=None):
+    # Probes windows of each range until the budget in ms runs out. count(start, end) returns (events, cost).
+    # Every range is probed once before any is probed twice, then the ranges with the widest intervals are
+    # probed first. The first probes rotate through the windows of a day, so every time of day is sampled as often
+    # over the range and daily patterns cancel out of the total.
+    generator = random.Random(seed)
+    width = window_width(density)
+    buckets = [Bucket(start, end, width, generator) for start, end in ranges]
+    order = list(buckets)
+    generator.shuffle(order)
+    unprobed = collections.deque(order)
+    offset = generator.randrange(max(bucket.windows for bucket in buckets)) if buckets else 0
+
+    deadline = time.time() + budget / 1000.0
+    cost = {'requests': 0, 'read_units': 0.0}
+    probes = 0
+    executor = ThreadPoolExecutor(max_workers=CONCURRENCY)
+    pending = {}
+
+    def collect(future, bucket):
+        events, probe_cost = future.result()
+        bucket.add(events)
+        cost['requests'] += probe_cost['requests']
+        cost['read_units'] += probe_cost['read_units']
+
+    try:
+        while time.time() < deadline:
+            # Keep every worker busy with the next window.
+            pooled = pooled_relative_variance(buckets)
+            while len(pending) < CONCURRENCY:
+                if unprobed:
+                    bucket = unprobed.popleft()
+                    start, end = bucket.next_window((offset + len(order) - len(unprobed)) % bucket.windows)
+                else:
+                    bucket = next_bucket(buckets, pooled)
+                    if bucket is None:
+                        break
+                    start, end = bucket.next_window()
+                pending[executor.submit(count, start, end)] = bucket
+            if not pending:
+                break
+
+            done, _ = wait(list(pending), timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future, pending.pop(future))
+                probes += 1
+    finally:
+        # Nothing is submitted past the budget. Probes not started are cancelled and those in flight waited for, a
+        # probe left running would keep reading into the next invocation of a warm container.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    # The probes waited for are read and paid for like any other.
+    for future, bucket in pending.items():
+        if not future.cancelled():
+            collect(future, bucket)
+            probes += 1
+
+    return buckets, {'probes': probes, 'window': width, 'cost': cost}
+
+
+def next_bucket(buckets, pooled):
+    # The bucket whose interval is widest, preferring those without probes in flight.
+    candidates = [bucket for bucket in buckets if not bucket.complete and len(bucket.probed) == len(bucket.samples)]
+    if not candidates:
+        candidates = [bucket for bucket in buckets if not bucket.complete]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda bucket: bucket.estimate(pooled)[1] if bucket.samples else 0)
+
+
+def pooled_relative_variance(buckets):
+    # Average over the buckets with at least two windows, every window counted as Poisson without any.
+    values = [bucket.relative_variance() for bucket in buckets]
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else 1.0
+
+
+def summarize(buckets):
+    # Estimated events per day with 95% confidence intervals, and the same for the whole range.
+    pooled = pooled_relative_variance(buckets)
+    rate, spread, mean_variance = unsampled(buckets)
+    response = {}
+    intervals = {}
+    total = 0.0
+    total_variance = 0.0
+    observed = 0
+    extrapolated = 0
+    for bucket in buckets:
+        if bucket.samples:
+            estimate, variance = bucket.estimate(pooled)
+        else:
+            estimate, variance = rate * bucket.seconds, (spread + mean_variance) * bucket.seconds ** 2
+            # The error of the mean rate adds up over the extrapolated buckets, it is added to the total once.
+            total_variance -= mean_variance * bucket.seconds ** 2
+            extrapolated += bucket.seconds
+        seen = sum(bucket.samples)
+        margin = Z * math.sqrt(variance)
+        day = timestamps.day(bucket.start)
+        if estimate or margin:
+            response[day] = int(round(estimate))
+            intervals[day] = [int(max(seen, math.floor(estimate - margin))), int(math.ceil(estimate + margin))]
+        total += estimate
+        total_variance += variance
+        observed += seen
+
+    total_variance += mean_variance * extrapolated ** 2
+    margin = Z * math.sqrt(total_variance)
+    return response, intervals, {
+        'total': int(round(total)),
+        'interval': [int(max(observed, math.floor(total - margin))), int(math.ceil(total + margin))],
+        'relative_error': round(margin / total, 4) if total else 0.0
+    }
@@ -0,0 +1,240 @@
+import logging
+import socket
+import threading
+import time
+import uuid
+
+# Prefix of the lock a container holds while it reads a missing key from the table.
+LOCK_PREFIX = 'lock#'
+
+# Seconds between looks at keys another container is reading, and how long to wait for them before reading them too.
+POLL_INTERVAL = 0.01
+WAIT = 0.5
+
+# Milliseconds a lock is held at most, a container dying with it only delays the others that long.
+LOCK_TTL = 2000
+
+# Seconds to wait on the server, a slow cache must not be slower than the table.
+TIMEOUT = 0.05
+
+# Deletes the locks of KEYS still holding the token ARGV[1], a lock which expired and was taken by another container
+# is left to it.
+RELEASE_SCRIPT = """
+local deleted = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        deleted = deleted + redis.call('DEL', key)
+    end
+end
+return deleted
+"""
+
+
+class CacheError(Exception):
+    pass
+
+
+class RedisBackend(object):
+    # The few commands the cache needs over the Redis protocol (RESP2), without a client library. The connection is
+    # kept between invocations and opened again after an error. Threads take turns on it, a reply is read by the
+    # thread which sent the command.
+
+    def __init__(self, host, port=6379, timeout=TIMEOUT):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.connection = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = socket.create_connection(self.address, timeout=self.timeout)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.reader = self.connection.makefile('rb')
+
+    def close(self):
+        if self.connection is not None:
+            self.reader.close()
+            self.connection.close()
+        self.connection = None
+        self.reader = None
+
+    def command(self, *args):
+        with self.lock:
+            try:
+                self._connect()
+                self.connection.sendall(encode(args))
+                return self._reply()
+            except (OSError, ValueError) as e:
+                self.close()
+                raise CacheError(str(e))
+
+    def _reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ValueError('Connection closed.')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode('utf-8')
+        if kind == b'-':
+            raise CacheError(body.decode('utf-8'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(body)
+            return None if length < 0 else [self._reply() for _ in range(length)]
+        raise ValueError('Unknown reply {!r}.'.format(line))
+
+    def mget(self, keys):
+        return self.command('MGET', *keys) if keys else []
+
+    def set(self, key, value, ttl_ms, only_new=False):
+        # True when the value was set, always unless only_new and the key exists.
+        args = ['SET', key, value, 'PX', int(ttl_ms)] + (['NX'] if only_new else [])
+        return self.command(*args) == 'OK'
+
+    def delete(self, keys):
+        return self.command('DEL', *keys) if keys else 0
+
+    def delete_if(self, keys, value):
+        # Deletes the keys still set to value, in one script so no other container sets them in between.
+        return self.command('EVAL', RELEASE_SCRIPT, len(keys), *(list(keys) + [value])) if keys else 0
+
+
+def encode(args):
+    # A command is an array of bulk strings.
+    parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        parts.append(b'$' + str(len(data)).encode('ascii') + b'\r\n' + data + b'\r\n')
+    return b''.join(parts)
+
+
+class MemoryBackend(object):
+    # The same calls in the memory of one process, for running without a server. Nothing is shared between
+    # containers.
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, now):
+        value, expires = self.values.get(key, (None, 0))
+        return value if expires > now else None
+
+    def mget(self, keys):
+        now = time.time()
+        with self.lock:
+            return [self._get(key, now) for key in keys]
+
+    def set(self, key, value, ttl_ms, only_new=False):
+        now = time.time()
+        with self.lock:
+            if only_new and self._get(key, now) is not None:
+                return False
+            self.values[key] = (str(value), now + ttl_ms / 1000.0)
+            return True
+
+    def delete(self, keys):
+        with self.lock:
+            return sum(1 for key in keys if self.values.pop(key, None) is not None)
+
+    def delete_if(self, keys, value):
+        now = time.time()
+        with self.lock:
+            keys = [key for key in keys if self._get(key, now) == str(value)]
+            for key in keys:
+                del self.values[key]
+            return len(keys)
+
+
+def from_url(url):
+    # redis://host:port, memory:// or nothing for no cache.
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith('redis://'):
+        host, _, port = url[len('redis://'):].rstrip('/').partition(':')
+        return RedisBackend(host, int(port or 6379))
+    raise ValueError(url)
+
+
+class ReadThroughCache(object):
+    # Integer values shared by every container. Keys missing from the cache are locked before they are read from the
+    # table, so when several containers miss the same key at once only one reads it and the others wait for its
+    # value. A cache which is down or slow is skipped, reads never fail because of it.
+
+    def __init__(self, backend, wait=WAIT, lock_ttl=LOCK_TTL):
+        self.backend = backend
+        self.wait = wait
+        self.lock_ttl = lock_ttl
+
+    def get_many(self, keys, load, ttl):
+        # Values of keys, load(keys) returns a dict of the missing ones and ttl(key) their seconds to live. Returns
+        # the values and counts of hits, misses read here, misses read by another container and cache errors.
+        stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+        values = {}
+        try:
+            for key, value in zip(keys, self.backend.mget(keys)):
+                if value is not None:
+                    values[key] = int(value)
+            missing = [key for key in keys if key not in values]
+            stats['hits'] = len(values)
+
+            token = uuid.uuid4().hex
+            mine = [key for key in missing if self.backend.set(LOCK_PREFIX + key, token, self.lock_ttl, only_new=True)]
+        except CacheError as e:
+            logging.warning('cache: {}'.format(e))
+            stats['errors'] += 1
+            values = load(keys)
+            stats['misses'] = len(keys)
+            return values, stats
+
+        # Read the keys this container holds the lock of first, others are likely doing the same with theirs.
+        waiting = [key for key in missing if key not in mine]
+        if mine:
+            loaded = load(mine)
+            values.update(loaded)
+            stats['misses'] += len(mine)
+            self._store(mine, loaded, ttl, stats, token)
+
+        deadline = time.time() + self.wait
+        while waiting and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            try:
+                found = self.backend.mget(waiting)
+            except CacheError:
+                stats['errors'] += 1
+                break
+            for key, value in zip(list(waiting), found):
+                if value is not None:
+                    values[key] = int(value)
+                    waiting.remove(key)
+                    stats['coalesced'] += 1
+
+        # Whoever held the lock took too long or went away.
+        if waiting:
+            loaded = load(waiting)
+            values.update(loaded)
+            stats['misses'] += len(waiting)
+            self._store(waiting, loaded, ttl, stats)
+        return values, stats
+
+    def _store(self, keys, loaded, ttl, stats, token=None):
+        # The locks are released when given their token. A lock held longer than lock_ttl may belong to another
+        # container by now, only those still holding the token are deleted.
+        try:
+            for key in keys:
+                self.backend.set(key, loaded[key], ttl(key) * 1000)
+            if token is not None:
+                self.backend.delete_if([LOCK_PREFIX + key for key in keys], token)
+        except CacheError as e:
+            logging.warning('cache: {}'.format(e))
+            stats['errors'] += 1
@@ -0,0 +1,139 @@
+import math
+import struct
+import zlib
+
+# Quantiles are returned within 1% of the exact value.
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# Upper bound on the number of bins. 2048 bins at 1% cover values from 1 to about 10^17, so collapsing only
+# happens for very small values.
+DEFAULT_MAX_BINS = 2048
+
+# Values at or below this are counted in the zero bucket.
+MIN_VALUE = 1e-9
+
+# Header: relative accuracy, max bins, count, zero count, min, max and sum. Followed by (index, count) pairs.
+HEADER = struct.Struct('<dIQQddd')
+BIN = struct.Struct('<iQ')
+
+
+class DDSketch(object):
+    # Logarithmically bucketed quantile sketch (Masson et al. 2019). Sketches with the same accuracy merge exactly.
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy must be between 0 and 1.')
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.bins = {}
+        self.count = 0
+        self.zero_count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.sum = 0.0
+
+    def add(self, value, count=1):
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            self.bins[index] = self.bins.get(index, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged.')
+
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self):
+        # Fold the lowest bins into one, the upper quantiles we care about keep their accuracy.
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins + 1
+        lowest = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[lowest] += self.bins.pop(index)
+
+    def _value(self, index):
+        # The bin midpoint, within the relative accuracy of every value in the bin.
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError('The quantile must be between 0 and 1.')
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Never report outside of the observed range.
+                return min(max(self._value(index), self.min), self.max)
+
+        return self.max
+
+    def histogram(self, bins):
+        # Equal width bins from zero to the largest value, counts are assigned by bin midpoint.
+        if not self.count:
+            return []
+
+        width = self.max / bins if self.max > 0 else 1.0
+        counts = [0] * bins
+        counts[0] = self.zero_count
+        for index, count in self.bins.items():
+            counts[min(int(self._value(index) / width), bins - 1)] += count
+
+        return [
+            {'start': round(width * position, 3), 'end': round(width * (position + 1), 3), 'count': count}
+            for position, count in enumerate(counts)
+        ]
+
+    def to_bytes(self):
+        data = HEADER.pack(self.relative_accuracy, self.max_bins, self.count, self.zero_count,
+                           self.min, self.max, self.sum)
+        data += b''.join(BIN.pack(index, count) for index, count in sorted(self.bins.items()))
+        return zlib.compress(data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(bytes(data))
+        relative_accuracy, max_bins, count, zero_count, minimum, maximum, total = HEADER.unpack_from(data)
+
+        sketch = cls(relative_accuracy=relative_accuracy, max_bins=max_bins)
+        sketch.count = count
+        sketch.zero_count = zero_count
+        sketch.min = minimum
+        sketch.max = maximum
+        sketch.sum = total
+        sketch.bins = dict(BIN.iter_unpack(data[HEADER.size:]))
+        return sketch
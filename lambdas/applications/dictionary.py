@@ -0,0 +1,83 @@
+import base64
+import collections
+import hashlib
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+# Partition of the aggregates table holding the user agent lookup table (id -> user agent).
+USER_AGENT_PARTITION = 'dictionary#user_agent'
+
+# Prefix telling interned ids apart from full user agents.
+USER_AGENT_PREFIX = 'ua:'
+
+# Decoded user agents kept warm per container.
+CACHE_SIZE = 10000
+
+# Maximum number of keys in one BatchGetItem request.
+BATCH_SIZE = 100
+
+
+def user_agent_id(user_agent):
+    # A 72 bit hash in 12 characters, collisions are negligible for any realistic number of user agents.
+    digest = hashlib.blake2b(user_agent.encode('utf-8'), digest_size=9).digest()
+    return USER_AGENT_PREFIX + base64.urlsafe_b64encode(digest).decode('ascii')
+
+
+class UserAgentDictionary(object):
+
+    def __init__(self, dynamodb, table):
+        self.dynamodb = dynamodb
+        self.table = table
+        self.cache = collections.OrderedDict()
+
+    def _remember(self, identifier, user_agent):
+        # Least recently used user agents are dropped first.
+        self.cache[identifier] = user_agent
+        self.cache.move_to_end(identifier)
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def intern(self, user_agent):
+        identifier = user_agent_id(user_agent)
+
+        # Known user agents were written before, by this container or another one.
+        if identifier not in self.cache:
+            try:
+                self.table.put_item(
+                    Item={
+                        'pk': USER_AGENT_PARTITION,
+                        'sk': identifier,
+                        'user_agent': user_agent,
+                    },
+                    ConditionExpression=Attr('sk').not_exists()
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+        self._remember(identifier, user_agent)
+        return identifier
+
+    def decode(self, values):
+        # Maps interned ids to user agents, anything else is returned as it is.
+        missing = list(set(value for value in values if value.startswith(USER_AGENT_PREFIX) and value not in self.cache))
+
+        for offset in range(0, len(missing), BATCH_SIZE):
+            request = {
+                self.table.name: {
+                    'Keys': [{'pk': USER_AGENT_PARTITION, 'sk': identifier} for identifier in missing[offset:offset + BATCH_SIZE]]
+                }
+            }
+            while request:
+                data = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in data['Responses'].get(self.table.name, []):
+                    self._remember(item['sk'], item['user_agent'])
+                request = data.get('UnprocessedKeys')
+
+        decoded = {}
+        for value in values:
+            if value in self.cache:
+                self.cache.move_to_end(value)
+            decoded[value] = self.cache.get(value, value)
+        return decoded
@@ -0,0 +1,77 @@
+import json
+
+# Parts of a multipart upload are at least 5 MB, but the last. A part is uploaded as soon as it is full, so memory
+# stays under a part whatever the size of the export.
+PART_SIZE = 5 * 1024 * 1024
+
+# Seconds the link to an export stays valid.
+URL_EXPIRES = 3600
+
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+class MultipartWriter(object):
+    # Writes an object to S3 in parts. Exports smaller than a part are written with a single PutObject.
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.buffer = []
+        self.buffered = 0
+        self.size = 0
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.size += len(data)
+        if self.buffered >= PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                             ContentType=CONTENT_TYPE)['UploadId']
+        number = len(self.parts) + 1
+        data = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number,
+                                   Body=b''.join(self.buffer))
+        self.parts.append({'ETag': data['ETag'], 'PartNumber': number})
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=b''.join(self.buffer), ContentType=CONTENT_TYPE)
+            return
+        if self.buffer:
+            self._upload_part()
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                          MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        # Parts of an unfinished upload are billed until it is aborted.
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def ndjson(buckets, s3, bucket, key):
+    # Writes (name, count) pairs as one JSON object per line, in the order they come. Returns what was written.
+    writer = MultipartWriter(s3, bucket, key)
+    lines = 0
+    try:
+        for name, count in buckets:
+            writer.write((json.dumps({'bucket': name, 'count': count}, separators=(',', ':')) + '\n')
+                         .encode('utf-8'))
+            lines += 1
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    return {
+        'buckets': lines,
+        'bytes': writer.size,
+        'parts': max(1, len(writer.parts))
+    }
@@ -1,9 +1,29 @@
 import boto3
-import os
 import datetime
+import decimal
+import heapq
+import os
 import logging
 import json
-from boto3.dynamodb.conditions import Key
+import queue
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aggregates
+import approximate
+import cache
+import export
+import profiling
+import sessions
+import snapshots
+import timestamps
+from ddsketch import DDSketch
+from dictionary import UserAgentDictionary
+from hyperloglog import HyperLogLog
+from planner import LEADERBOARD_PREFIX, Planner, summary as planner_summary, whole_day
+from topk import SpaceSaving, DEFAULT_CAPACITY
 
 # Get the service resource.
 dynamodb = boto3.resource('dynamodb')
@@ -15,89 +35,767 @@ dynamodb = boto3.resource('dynamodb')
 # on the table resource are accessed or its load() method is called.
 table = dynamodb.Table(os.environ['TABLE_NAME'])
 
+# The table holding pre-computed aggregates of the events table.
+table_aggregates = dynamodb.Table(os.environ['AGGREGATES_TABLE_NAME'])
+
+# The user agent lookup table for compact storage, warm between invocations.
+dictionary = UserAgentDictionary(dynamodb, table_aggregates)
+
+# Plans event count queries, keeps the totals of applications warm between invocations.
+planner = Planner(table, table_aggregates)
+
+# Planners of the threads counting the spans of a comparison, kept warm between invocations. boto3 resources are not
+# thread safe, each planner reads through tables of a resource of its own and shares the totals of the one above.
+span_planners = queue.LifoQueue()
+
+# Daily counts shared by every container, set with CACHE_URL (redis://host:port). Without one each container reads
+# the tables itself.
+counts_cache = cache.ReadThroughCache(cache.from_url(os.environ['CACHE_URL'])) if os.environ.get('CACHE_URL') else None
+
+# Seconds a cached day is kept while events can still be added to it and once they cannot. Days are closed when
+# they ended longer ago than the lateness accepted by the API.
+CACHE_OPEN_TTL = int(os.environ.get('CACHE_OPEN_TTL_S', '10'))
+CACHE_CLOSED_TTL = int(os.environ.get('CACHE_CLOSED_TTL_S', '3600'))
+MAX_EVENT_LATENESS = int(os.environ.get('MAX_EVENT_LATENESS_S', str(7 * 24 * 3600)))
+
+# Windows of whole days ending today are served from snapshots computed on a schedule, when one is recent enough.
+# The windows requested are counted so the most requested get snapshots.
+SNAPSHOT_MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE_S', snapshots.MAX_AGE))
+window_counter = snapshots.WindowCounter()
+
+# Exports are written to this bucket, exporting is refused without one.
+s3 = boto3.client('s3')
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET_NAME')
+
+# Profiles a share of the invocations (PROFILE_RATE), and those asked for with an X-Profile: true header when
+# PROFILE_ON_REQUEST is true, to logs or next to the exports (PROFILE_OUTPUT=s3). Off by default.
+profiler = profiling.from_environment(s3, EXPORT_BUCKET)
+
+# Metrics which can be requested, counting events is the default.
+METRICS = ['events', 'unique_sources', 'media_time', 'top_source_ips', 'top_user_agents', 'lateness',
+           'top_applications', 'sessions']
+
+# Days of the leaderboard read at once.
+LEADERBOARD_CONCURRENCY = 8
+
+# Number of heavy hitters returned when not requested.
+DEFAULT_TOP = 10
+
+# Quantiles of media time returned for each operation, and of lateness.
+QUANTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]
+
+# Number of equal width bins in media time histograms.
+HISTOGRAM_BINS = 10
+
+# Milliseconds an approximate count of events may take, whatever the range.
+APPROXIMATE_BUDGET = int(os.environ.get('APPROXIMATE_BUDGET_MS', '200'))
+
+# Shapes of the response body. json has the count of each day with events by name, columnar the counts of every
+# day of the range in order from the first.
+FORMATS = ['json', 'columnar']
+
+# Seconds in a day, the width of the buckets of a columnar response.
+DAY_SECONDS = 86400
+
+# Buckets of an export, hours are only counted when exporting.
+GRANULARITIES = ['day', 'hour']
+
+# Longest range in days, and most day buckets in a response. Longer queries are refused before any table is read.
+# Exports are written to S3 as they are counted and are only bound by the range.
+MAX_RANGE_DAYS = int(os.environ.get('MAX_RANGE_DAYS', '731'))
+MAX_BUCKETS = int(os.environ.get('MAX_BUCKETS', '400'))
+
+# Ranges compared with the requested one at most, like last week or the same month last year, and the name of the
+# requested range in the response. Their spans are counted at once.
+MAX_COMPARED_RANGES = 4
+CURRENT_RANGE = 'current'
+RANGE_NAME_PATTERN = re.compile('^[A-Za-z0-9_-]{1,32}$')
+COMPARE_CONCURRENCY = 8
+
+
+def decimal_default(value):
+    # Numbers read from DynamoDB are Decimals, whole ones are encoded as integers.
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+# Encodes the body once without spaces. Built once, json.dumps makes a new encoder for every call with a default.
+encoder = json.JSONEncoder(separators=(',', ':'), check_circular=False, default=decimal_default)
+
 # Set logger level.
 logging.getLogger().setLevel(logging.INFO)
 
 
-def handler(event, context):
-    # Print event to logs.
-    logging.info('request: {}'.format(json.dumps(event)))
+def exception(error_type, message):
+    # Format error message as json, the integration responses select on the type.
+    error_json = json.dumps({
+        'type': error_type,
+        'message': message
+    })
+    if error_type == 'ValidationException':
+        # The runtime logs the raised exception again, the prefix tells the rejection apart for the metric filter.
+        logging.warning('rejected: {}'.format(error_json))
+    else:
+        logging.error(error_json)
+    return Exception(error_json)
+
 
+def parse_request(event):
+    # Everything is checked before any client is called, refused requests only cost the invocation.
     # Formatted dates to Common Log Format (dd/MMM/yyyy:HH:mm:ss +-hhmm)
     # https://httpd.apache.org/docs/1.3/logs.html#common
     try:
-        start_date = datetime.datetime.strptime(event['start_date'], '%Y-%m-%d').strftime(
-            "%d/%b/%Y:%H:%M:%S") + " +0000"
-        end_date = datetime.datetime.strptime(event['end_date'], '%Y-%m-%d').replace(hour=23, minute=59, second=59,
-                                                                                     microsecond=999999).strftime(
-            "%d/%b/%Y:%H:%M:%S") + " +0000"
+        # The model checks the format too, the pattern is cheaper than parsing when called without API Gateway.
+        if not (timestamps.DATE_PATTERN.match(event['start_date']) and
+                timestamps.DATE_PATTERN.match(event['end_date'])):
+            raise ValueError(event['start_date'])
+        start = timestamps.parse_request_date(event['start_date'])
+        end = timestamps.parse_request_date(event['end_date'], end=True)
+
+        # Missing optional values are mapped to empty strings.
+        metric = event.get('metric') or 'events'
+        if metric not in METRICS:
+            raise ValueError(metric)
+
+        # Every metric but the leaderboard is of one application.
+        if not event.get('application') and metric != 'top_applications':
+            raise ValueError(metric)
+
+        top = int(event.get('top') or DEFAULT_TOP)
+        if not 1 <= top <= DEFAULT_CAPACITY:
+            raise ValueError(top)
+
+        request_format = event.get('format') or 'json'
+        if request_format not in FORMATS:
+            raise ValueError(request_format)
 
-        logging.info('dates: {}'.format(json.dumps({'start': start_date, 'end': end_date})))
+        # Exports write event counts per bucket to S3 and return a link instead of the counts.
+        is_export = event.get('export') == 'true'
+        granularity = event.get('granularity') or 'day'
+        if granularity not in GRANULARITIES or (granularity != 'day' and not is_export):
+            raise ValueError(granularity)
+        if is_export and (metric != 'events' or event.get('timezone') or event.get('approximate') == 'true' or
+                          request_format != 'json' or not EXPORT_BUCKET):
+            raise ValueError(metric)
+
+        # Days are UTC unless a time zone is given, which is only supported when counting events.
+        zone = timestamps.zone(event['timezone']) if event.get('timezone') else None
+        if zone is not None and metric != 'events':
+            raise ValueError(metric)
+
+        # Events of one operation are counted on the operation index, which has no hourly counts.
+        if metric == 'events' and event.get('operation') and (zone is not None or granularity != 'day'):
+            raise ValueError(metric)
+
+        # Named ranges compared with the requested one, as a JSON list. Only UTC event counts are compared.
+        compare = json.loads(event.get('compare') or 'null') or []
+        if not isinstance(compare, list) or len(compare) > MAX_COMPARED_RANGES:
+            raise ValueError(compare)
+        if compare and (metric != 'events' or is_export or zone is not None or event.get('approximate') == 'true'):
+            raise ValueError(metric)
+        ranges = [{'name': CURRENT_RANGE, 'start': start, 'end': end}] if compare else []
+        for compared in compare:
+            if not (RANGE_NAME_PATTERN.match(compared['name']) and
+                    timestamps.DATE_PATTERN.match(compared['startDate']) and
+                    timestamps.DATE_PATTERN.match(compared['endDate'])):
+                raise ValueError(compared)
+            if any(named['name'] == compared['name'] for named in ranges):
+                raise ValueError(compared['name'])
+            ranges.append({
+                'name': compared['name'],
+                'start': timestamps.parse_request_date(compared['startDate']),
+                'end': timestamps.parse_request_date(compared['endDate'], end=True)
+            })
     except Exception as e:
-        # Format error message as json.
-        error_json = json.dumps({
-            'type': 'ValidationException',
-            'message': 'Your values are incorrect.'
-        })
-        logging.warning(error_json)
-        raise Exception(error_json)
+        raise exception('ValidationException', 'Your values are incorrect.')
 
     # Check the start day is before the end date.
-    if start_date > end_date:
-        # Format error message as json.
-        error_json = json.dumps({
-            'type': 'ValidationException',
-            'message': 'The start date is further in the future than the end date.'
-        })
-        logging.warning(error_json)
-        raise Exception(error_json)
-
-    # Grab data from DynamoDB.
-    try:
-        # Query for application name and date range.
-        data = table.query(
-            KeyConditionExpression=Key('application').eq(event['application']) & Key('created_at').between(start_date,
-                                                                                                           end_date)
-        )
+    if start > end:
+        raise exception('ValidationException', 'The start date is further in the future than the end date.')
+
+    # Every day of the range is at least one query or one item read.
+    days = (end.date() - start.date()).days + 1
+    if days > MAX_RANGE_DAYS:
+        raise exception('ValidationException', 'The range is longer than {} days.'.format(MAX_RANGE_DAYS))
+    if days > MAX_BUCKETS and not is_export:
+        raise exception('ValidationException', 'The range has more than {} days, export it instead.'.format(
+            MAX_BUCKETS))
+
+    # Compared ranges are bound like the requested one, and the days of all of them together like one range.
+    for compared in ranges[1:]:
+        if compared['start'] > compared['end']:
+            raise exception('ValidationException', 'The start date of {} is further in the future than its end '
+                                                   'date.'.format(compared['name']))
+        if (compared['end'].date() - compared['start'].date()).days + 1 > MAX_BUCKETS:
+            raise exception('ValidationException', 'The range {} has more than {} days.'.format(compared['name'],
+                                                                                                MAX_BUCKETS))
+    if len({named['start'].date() + datetime.timedelta(days=offset) for named in ranges
+            for offset in range((named['end'].date() - named['start'].date()).days + 1)}) > MAX_BUCKETS:
+        raise exception('ValidationException', 'The ranges have more than {} days together.'.format(MAX_BUCKETS))
+
+    return {
+        'application': event.get('application'),
+        'start': start,
+        'end': end,
+        'metric': metric,
+        'operation': event.get('operation'),
+        'top': top,
+        'approximate': event.get('approximate') == 'true',
+        'timezone': event.get('timezone'),
+        'zone': zone,
+        'format': request_format,
+        'export': is_export,
+        'granularity': granularity,
+        'ranges': ranges,
+    }
+
+
+def events(application, start, end, operation=None, record=True, reader=None):
+    # The planner picks between reading the events, counting them per day and the daily counts. Events of one
+    # operation are counted on the operation index or filtered out of the events. Windows are only recorded as
+    # requested when a client asked for them, not for the spans of a comparison. Threads count with a reader of
+    # their own, a planner of span_planners.
+    reader = reader or planner
+    now = datetime.datetime.utcnow()
+    days = snapshots.window(start, end, now) if not operation else None
+    if days is not None:
+        response = snapshot_events(application, start, end, days, now, record, reader)
+        if response is not None:
+            return response
+
+    if counts_cache is not None:
+        return cached_events(application, start, end, operation, reader)
+
+    try:
+        plan = reader.plan(application, start, end, operation)
+        response = reader.execute(plan)
     except Exception as e:
-        # Format error message as json.
-        error_json = json.dumps({
-            'type': 'UnknownException',
-            'message': 'Something went wrong with the database.'
-        })
-        logging.error(error_json)
-        raise Exception(error_json)
+        raise exception('UnknownException', 'Something went wrong with the database.')
 
-    # TODO:: Fix json.dumps for decimals.
+    logging.info('plan: {}'.format(json.dumps(planner_summary(plan))))
 
-    logging.info('data: {}'.format(data))
+    return response
+
+
+def snapshot_events(application, start, end, days, now, record=True, reader=None):
+    # One GetItem of the snapshot of the window, and a count of the events stored for times after it. None when
+    # there is no recent snapshot.
+    reader = reader or planner
+    if record:
+        try:
+            window_counter.add(table_aggregates, application, days, now)
+        except Exception as e:
+            logging.warning('windows: {}'.format(e))
+
+    cost = {'requests': 0, 'read_units': 0.0}
+    try:
+        response = snapshots.read(reader, reader.table_aggregates, application, start, end, now, cost,
+                                  SNAPSHOT_MAX_AGE)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    logging.info('plan: {}'.format(json.dumps({'application': application, 'strategy': 'snapshot', 'window': days,
+                                               'found': response is not None, 'actual': cost})))
+
+    return response
+
+
+def cached_events(application, start, end, operation=None, reader=None):
+    # Whole days are read through the shared cache, those missing from it are counted with one plan over their span.
+    # Partial days are counted every time, they are not the bucket of any other request.
+    reader = reader or planner
+    ranges = timestamps.day_ranges(start, end)
+    days = {cache_key(application, operation, day_start): (day_start, day_end) for day_start, day_end in ranges
+            if whole_day(day_start, day_end)}
+    plans = []
+
+    def load(keys):
+        first = min(days[key][0] for key in keys)
+        last = max(days[key][1] for key in keys)
+        plan = reader.plan(application, first, last, operation)
+        counts = reader.execute(plan)
+        plans.append(plan)
+        return {key: counts.get(timestamps.day(days[key][0]), 0) for key in keys}
+
+    def ttl(key):
+        closed = days[key][1] + datetime.timedelta(seconds=MAX_EVENT_LATENESS) < datetime.datetime.utcnow()
+        return CACHE_CLOSED_TTL if closed else CACHE_OPEN_TTL
+
+    try:
+        cached, stats = counts_cache.get_many(list(days), load, ttl)
+        response = {timestamps.day(days[key][0]): events for key, events in cached.items() if events}
+        for day_start, day_end in ranges:
+            if not whole_day(day_start, day_end):
+                plan = reader.plan(application, day_start, day_end, operation)
+                response.update(reader.execute(plan))
+                plans.append(plan)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Space delimited, read by the cache metric filters.
+    logging.info('cache {hits} {misses} {coalesced} {errors}'.format(**stats))
+    for plan in plans:
+        logging.info('plan: {}'.format(json.dumps(planner_summary(plan))))
+
+    return response
+
+
+def cache_key(application, operation, day_start):
+    return 'events#{}#{}#{}'.format(application, operation or '', timestamps.day(day_start))
 
-    # The dict for holding our dates and counts.
-    response = {}
 
-    # Format and count dates.
+def new_resource():
+    # A session of its own, sessions are not shared between threads either.
+    return boto3.session.Session().resource('dynamodb')
+
+
+def span_events(application, start, end, operation=None):
+    # Events of a span counted in a thread, with a planner taken from the pool and put back for the next span.
+    try:
+        reader = span_planners.get_nowait()
+    except queue.Empty:
+        resource = new_resource()
+        reader = planner.bind(resource.Table(table.name), resource.Table(table_aggregates.name))
     try:
-        for items in data['Items']:
-            # Format the created_at date of each entry (YYYY-mm-dd).
-            created_at = datetime.datetime.strptime(items['created_at'][:-6], '%d/%b/%Y:%H:%M:%S').strftime("%Y-%m-%d")
-            # Does the created_at date key already exists in the dict?
-            if created_at in response:
-                # It does, increment the value by 1.
-                response[created_at] += 1
+        return events(application, start, end, operation, False, reader)
+    finally:
+        span_planners.put(reader)
+
+
+def compare_events(application, ranges, operation=None):
+    # The union of the ranges is cut at their bounds and at midnight, so each piece is in a range or out of it and
+    # is counted once however many ranges cover it. Pieces following each other from midnight to midnight are
+    # counted together in a span, with one plan, and the spans at once. Comparing adjacent or overlapping ranges
+    # costs about one read of their union.
+    bounds = sorted({named['start'] for named in ranges} |
+                    {named['end'] + datetime.timedelta(microseconds=1) for named in ranges})
+    spans = []
+    for piece_start, following in zip(bounds, bounds[1:]):
+        piece_end = following - datetime.timedelta(microseconds=1)
+        if not any(named['start'] <= piece_start and piece_end <= named['end'] for named in ranges):
+            continue
+        for day_start, day_end in timestamps.day_ranges(piece_start, piece_end):
+            if spans and day_start.time() == datetime.time.min and \
+                    spans[-1][-1][1] + datetime.timedelta(microseconds=1) == day_start:
+                spans[-1].append((day_start, day_end))
             else:
-                # It does not, set a new key with a value of 1.
-                response[created_at] = 1
+                spans.append([(day_start, day_end)])
+
+    # Every span has one piece a day, its counts are those of its pieces.
+    with ThreadPoolExecutor(max_workers=min(COMPARE_CONCURRENCY, len(spans))) as executor:
+        counted = list(executor.map(lambda span: span_events(application, span[0][0], span[-1][1], operation),
+                                    spans))
+    pieces = [(day_start, day_end, counts.get(timestamps.day(day_start), 0))
+              for span, counts in zip(spans, counted) for day_start, day_end in span]
+
+    response = {}
+    totals = {}
+    for named in ranges:
+        counts = {}
+        for day_start, day_end, events_counted in pieces:
+            if events_counted and named['start'] <= day_start and day_end <= named['end']:
+                day = timestamps.day(day_start)
+                counts[day] = counts.get(day, 0) + events_counted
+        response[named['name']] = counts
+        totals[named['name']] = sum(counts.values())
+
+    # Changes of the requested range from each compared one, relative to the compared one.
+    current = totals[CURRENT_RANGE]
+    deltas = {}
+    for name, total in totals.items():
+        if name != CURRENT_RANGE:
+            deltas[name] = {
+                'change': current - total,
+                'relative': round(float(current - total) / float(total), 4) if total else None
+            }
+
+    logging.info('compare: {}'.format(json.dumps({'application': application, 'ranges': len(ranges),
+                                                  'spans': len(spans), 'pieces': len(pieces)})))
+
+    summary = {
+        'comparison': {
+            'totals': totals,
+            'deltas': deltas,
+            'spans': len(spans)
+        }
+    }
+
+    return response, summary
+
+
+def local_events(application, start, end, zone, timezone):
+    # Local days are summed from hourly counts, whatever the offset of the time zone.
+    try:
+        response, cost = planner.local_counts(application, start, end, zone)
     except Exception as e:
-        # Format error message as json.
-        error_json = json.dumps({
-            'type': 'UnknownException',
-            'message': 'Something went wrong with tallying dates.'
-        })
-        logging.error(error_json)
-        raise Exception(error_json)
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    logging.info('plan: {}'.format(json.dumps({'application': application, 'strategy': 'hourly',
+                                               'timezone': timezone, 'actual': cost})))
+
+    return response, {'timezone': timezone}
+
+
+def approximate_events(application, start, end, operation=None):
+    # Days the plan would count one by one are sampled instead, when counting them does not fit in the budget.
+    started = time.time()
+    try:
+        plan = planner.plan(application, start, end, operation)
+        if plan['strategy'] == 'raw' or plan['predicted']['requests'] * approximate.REQUEST_MS <= APPROXIMATE_BUDGET:
+            response = planner.execute(plan)
+            summary = {'exact': True}
+        else:
+            exact = dict(plan, counts=[])
+            response = planner.execute(exact)
+
+            # Days before the operation index are filtered, like the plan counts them.
+            unindexed = set(plan.get('unindexed', []))
 
-    logging.info('response: {}'.format(json.dumps(response)))
+            def probe(window_start, window_end):
+                cost = {'requests': 0, 'read_units': 0.0}
+                return planner.count(application, window_start, window_end, cost, operation,
+                                     timestamps.day(window_start) not in unindexed), cost
 
+            budget = APPROXIMATE_BUDGET - (time.time() - started) * 1000
+            buckets, stats = approximate.sample(probe, plan['counts'], plan['density'], budget)
+            estimated, intervals, total = approximate.summarize(buckets)
+            plan['actual'] = {
+                'requests': exact['actual']['requests'] + stats['cost']['requests'],
+                'read_units': exact['actual']['read_units'] + stats['cost']['read_units']
+            }
+
+            # Days read exactly have an interval of their own count.
+            known = sum(response.values())
+            for day, events in response.items():
+                intervals[day] = [events, events]
+            response.update(estimated)
+            summary = {
+                'exact': False,
+                'confidence': 0.95,
+                'intervals': intervals,
+                'total': total['total'] + known,
+                'interval': [total['interval'][0] + known, total['interval'][1] + known],
+                'relative_error': round((total['interval'][1] - total['total']) / float(total['total'] + known), 4)
+                if total['total'] + known else 0.0,
+                'probes': stats['probes'],
+                'window': stats['window']
+            }
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    logging.info('plan: {}'.format(json.dumps(dict(planner_summary(plan), approximate=not summary['exact'],
+                                                   elapsed=round((time.time() - started) * 1000, 1)))))
+
+    return response, {'approximate': summary}
+
+
+def export_events(application, start, end, granularity, operation=None):
+    # Buckets are written as they come out of the planner, whatever their number the function only holds a part.
+    key = 'exports/{}/{}.ndjson'.format(application, uuid.uuid4())
+    cost = {'requests': 0, 'read_units': 0.0}
+    try:
+        if granularity == 'hour':
+            buckets = planner.hourly_counts(application, start, end, cost)
+        else:
+            plan = planner.plan(application, start, end, operation)
+            buckets = planner.counts(plan)
+        written = export.ndjson(buckets, s3, EXPORT_BUCKET, key)
+        url = s3.generate_presigned_url('get_object', Params={'Bucket': EXPORT_BUCKET, 'Key': key},
+                                        ExpiresIn=export.URL_EXPIRES)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    if granularity == 'hour':
+        logging.info('plan: {}'.format(json.dumps({'application': application, 'strategy': 'hourly',
+                                                   'actual': cost})))
+    else:
+        logging.info('plan: {}'.format(json.dumps(planner_summary(plan))))
+
+    return {}, {'export': dict(written, url=url, expires=export.URL_EXPIRES, granularity=granularity)}
+
+
+def columnar(response, start, end, zone=None):
+    # Counts of every day from the first, zero for days without events. Days are local when there is a zone, the
+    # start is then the UTC time of the first local midnight and days changing offset are not 24 hours long.
+    first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = [0] * ((end.date() - first.date()).days + 1)
+    for name, events in response.items():
+        index = (datetime.datetime.strptime(name, timestamps.DAY_FORMAT) - first).days
+        if 0 <= index < len(counts):
+            counts[index] = events
     return {
-        'response': json.dumps(response)
+        'start': timestamps.epoch(timestamps.to_utc(first, zone) if zone is not None else first),
+        'width': DAY_SECONDS,
+        'counts': counts
     }
+
+
+def counts_body(response, request_format, start, end, zone=None):
+    if request_format == 'columnar':
+        return columnar(response, start, end, zone)
+    return {'counts': response}
+
+
+def serialize(body):
+    # The body is encoded once here, the response template passes it through untouched.
+    body = encoder.encode(body)
+
+    logging.info('response: {}'.format(body))
+
+    return {
+        'body': body
+    }
+
+
+def handler(event, context):
+    # Print event to logs.
+    logging.info('request: {}'.format(json.dumps(event)))
+
+    # Missing headers are mapped to empty strings like the body.
+    profiler.start(event.get('profile') == 'true')
+    try:
+        with profiler.span('parse'):
+            request = parse_request(event)
+
+        with profiler.span('query'):
+            response, summary = query(request)
+
+        with profiler.span('format'):
+            if request['ranges']:
+                # Each range is shaped like the body of a request of its own.
+                body = {'ranges': {named['name']: counts_body(response[named['name']], request['format'],
+                                                              named['start'], named['end'])
+                                   for named in request['ranges']}}
+            else:
+                body = counts_body(response, request['format'], request['start'], request['end'], request['zone'])
+            body['summary'] = summary
+
+        with profiler.span('serialize'):
+            return serialize(body)
+    finally:
+        profiler.finish(getattr(context, 'aws_request_id', None))
+
+
+def query(request):
+    metric = request['metric']
+
+    if metric == 'unique_sources':
+        return unique_sources(request['application'], request['start'], request['end'])
+    if metric == 'media_time':
+        return media_time(request['application'], request['operation'], request['start'], request['end'])
+    if metric == 'lateness':
+        return lateness(request['application'], request['start'], request['end'])
+    if metric == 'sessions':
+        return visitor_sessions(request['application'], request['start'], request['end'])
+    if metric == 'top_applications':
+        return top_applications(request['top'], request['start'], request['end'])
+    if metric in ['top_source_ips', 'top_user_agents']:
+        return heavy_hitters(request['application'], metric, request['top'], request['start'], request['end'])
+    if request['export']:
+        return export_events(request['application'], request['start'], request['end'], request['granularity'],
+                             request['operation'])
+    if request['zone'] is not None:
+        return local_events(request['application'], request['start'], request['end'], request['zone'],
+                            request['timezone'])
+    if request['approximate']:
+        return approximate_events(request['application'], request['start'], request['end'], request['operation'])
+    if request['ranges']:
+        return compare_events(request['application'], request['ranges'], request['operation'])
+    return events(request['application'], request['start'], request['end'], request['operation']), {}
+
+
+def unique_sources(application, start, end):
+    # Grab the daily sketches from DynamoDB.
+    try:
+        sketches = aggregates.query_sketches(table_aggregates, application,
+                                             'unique_sources#' + timestamps.day(start),
+                                             'unique_sources#' + timestamps.day(end),
+                                             HyperLogLog)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Estimate each day on its own and the whole range from the merged sketches. Visitors seen on several days
+    # are only counted once in the total.
+    response = {}
+    total = HyperLogLog()
+    for key, sketch in sorted(sketches.items()):
+        response[key.split('#', 1)[1]] = sketch.estimate()
+        total.merge(sketch)
+
+    summary = {
+        'unique_sources': total.estimate(),
+        'relative_error': round(total.relative_error, 4)
+    }
+
+    return response, summary
+
+
+def media_time(application, operation, start, end):
+    # Grab the daily sketches of every operation from DynamoDB, keyed by day first (media_time#day#operation). The
+    # items read grow with the days of the range, not with the history of the application.
+    try:
+        # '$' sorts right after '#', so the range ends after every operation of the last day.
+        sketches = aggregates.query_sketches(table_aggregates, application, 'media_time#' + timestamps.day(start),
+                                             'media_time#' + timestamps.day(end) + '$', DDSketch)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Count observations per day and merge the sketches per operation.
+    response = {}
+    operations = {}
+    for key, sketch in sketches.items():
+        day, operation_name = key.split('#', 2)[1:]
+        if operation and operation_name != operation:
+            continue
+
+        response[day] = response.get(day, 0) + sketch.count
+        if operation_name in operations:
+            operations[operation_name].merge(sketch)
+        else:
+            operations[operation_name] = sketch
+
+    summary = {
+        'media_time': {},
+        'relative_accuracy': DDSketch().relative_accuracy
+    }
+    for operation_name, sketch in sorted(operations.items()):
+        summary['media_time'][operation_name] = dict(
+            [('count', sketch.count)] +
+            [(name, sketch.quantile(q)) for name, q in QUANTILES] +
+            [('histogram', sketch.histogram(HISTOGRAM_BINS))]
+        )
+
+    return response, summary
+
+
+def lateness(application, start, end):
+    # Grab the daily sketches of events sent with a client time from DynamoDB.
+    try:
+        sketches = aggregates.query_sketches(table_aggregates, application, 'lateness#' + timestamps.day(start),
+                                             'lateness#' + timestamps.day(end), DDSketch)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Count events with a client time per day and merge the sketches of the range.
+    response = {}
+    total = DDSketch()
+    for key, sketch in sorted(sketches.items()):
+        response[key.split('#', 1)[1]] = sketch.count
+        total.merge(sketch)
+
+    summary = {
+        'lateness': dict(
+            [('count', total.count)] +
+            [(name, total.quantile(q)) for name, q in QUANTILES] +
+            [('histogram', total.histogram(HISTOGRAM_BINS))]
+        ),
+        'relative_accuracy': total.relative_accuracy
+    }
+
+    return response, summary
+
+
+def visitor_sessions(application, start, end):
+    # Grab the daily session counts from DynamoDB. Sessions count on the day they started, open ones included.
+    try:
+        items = aggregates.query_range(table_aggregates, application,
+                                       sessions.DAILY_PREFIX + timestamps.day(start),
+                                       sessions.DAILY_PREFIX + timestamps.day(end))
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Count sessions per day and sum the counters of the range.
+    response = {}
+    totals = dict.fromkeys(sessions.COUNTERS, 0)
+    for item in items:
+        response[item['sk'][len(sessions.DAILY_PREFIX):]] = item.get('sessions', 0)
+        for name in sessions.COUNTERS:
+            totals[name] += item.get(name, 0)
+
+    # Each step of the funnel as a share of the one before, the first of every session.
+    count = totals['sessions']
+    funnel = []
+    previous = count
+    for name in sessions.FUNNEL:
+        funnel.append({'step': name, 'sessions': totals[name],
+                       'conversion': round(float(totals[name]) / float(previous), 4) if previous else 0.0})
+        previous = totals[name]
+
+    summary = {
+        'sessions': {
+            'count': count,
+            'average_length': round(float(totals['duration']) / float(count), 1) if count else 0.0,
+            'events_per_session': round(float(totals['events']) / float(count), 2) if count else 0.0,
+            'stale_events': totals['stale'],
+            'funnel': funnel
+        }
+    }
+
+    return response, summary
+
+
+def heavy_hitters(application, metric, top, start, end):
+    # Grab the hourly summaries from DynamoDB, the window is widened to whole hours.
+    dimension = 'source_ip' if metric == 'top_source_ips' else 'user_agent'
+    prefix = 'top#{}#'.format(dimension)
+    try:
+        summaries = aggregates.query_sketches(table_aggregates, application, prefix + timestamps.hour(start),
+                                              prefix + timestamps.hour(end), SpaceSaving)
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Count events per day and merge the summaries of the window. Merging keeps the same number of counters, so
+    # memory does not depend on the window or the number of distinct values.
+    response = {}
+    total = SpaceSaving()
+    for key, summary in sorted(summaries.items()):
+        day = key.rsplit('#', 1)[1][:10]
+        response[day] = response.get(day, 0) + summary.total
+        total.merge(summary)
+
+    # Summaries of compact storage count user agent ids, look them up.
+    entries = total.top(top)
+    if metric == 'top_user_agents':
+        try:
+            names = dictionary.decode([entry['value'] for entry in entries])
+        except Exception as e:
+            raise exception('UnknownException', 'Something went wrong with the database.')
+        for entry in entries:
+            entry['value'] = names[entry['value']]
+
+    summary = {
+        metric: entries
+    }
+
+    return response, summary
+
+
+def top_applications(top, start, end):
+    # Grab the leaderboard partition of each day at once, the window is widened to whole days. Items read grow with
+    # the days and the applications seen in them, not with the number of events.
+    days = [timestamps.day(day_start) for day_start, day_end in timestamps.day_ranges(start, end)]
+    try:
+        with ThreadPoolExecutor(max_workers=min(LEADERBOARD_CONCURRENCY, len(days))) as executor:
+            partitions = list(executor.map(
+                lambda day: aggregates.query_partition(table_aggregates, LEADERBOARD_PREFIX + day), days))
+    except Exception as e:
+        raise exception('UnknownException', 'Something went wrong with the database.')
+
+    # Count events of every application per day and sum each application over the range.
+    response = {}
+    totals = {}
+    for day, items in zip(days, partitions):
+        for item in items:
+            response[day] = response.get(day, 0) + item['count']
+            totals[item['sk']] = totals.get(item['sk'], 0) + item['count']
+
+    # Ties are broken by name, so the same range always ranks the same way.
+    ranked = heapq.nsmallest(top, totals.items(), key=lambda entry: (-entry[1], entry[0]))
+
+    summary = {
+        'top_applications': [{'value': application, 'count': count} for application, count in ranked],
+        'applications': len(totals)
+    }
+
+    return response, summary
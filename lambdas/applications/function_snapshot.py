@@ -0,0 +1,56 @@
+import boto3
+import datetime
+import os
+import logging
+import json
+
+import snapshots
+from planner import Planner, summary as planner_summary
+
+# Get the service resource.
+dynamodb = boto3.resource('dynamodb')
+
+# The events table, counted from for the snapshots.
+table = dynamodb.Table(os.environ['TABLE_NAME'])
+
+# The table holding pre-computed aggregates of the events table, snapshots are written to it.
+table_aggregates = dynamodb.Table(os.environ['AGGREGATES_TABLE_NAME'])
+
+# Plans the counts of each snapshot like the read function would.
+planner = Planner(table, table_aggregates)
+
+# Windows computed for every active application, in days ending today.
+WINDOWS = snapshots.parse_windows(os.environ.get('SNAPSHOT_WINDOWS'))
+
+# Requests a window needs over the last days to be computed for an application, and snapshots computed per run.
+MIN_REQUESTS = int(os.environ.get('SNAPSHOT_MIN_REQUESTS', snapshots.MIN_REQUESTS))
+LIMIT = int(os.environ.get('SNAPSHOT_LIMIT', snapshots.LIMIT))
+
+# Seconds a snapshot is served, at least the schedule of this function.
+MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE_S', snapshots.MAX_AGE))
+
+# Set logger level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+def handler(event, context):
+    now = datetime.datetime.utcnow()
+
+    try:
+        pairs = snapshots.choose(table_aggregates, now, WINDOWS, min_requests=MIN_REQUESTS, limit=LIMIT)
+        for application, days in pairs:
+            plan = snapshots.compute(planner, table_aggregates, application, days, now, MAX_AGE)
+            if plan is not None:
+                logging.info('snapshot: {}'.format(json.dumps(dict(planner_summary(plan), window=days))))
+    except Exception as e:
+        # Format error message as json.
+        error_json = json.dumps({
+            'type': 'UnknownException',
+            'message': 'Something went wrong with computing snapshots.'
+        })
+        logging.error(error_json)
+        raise Exception(error_json)
+
+    logging.info('snapshots: {}'.format(json.dumps({'computed': len(pairs)})))
+
+    return {'computed': len(pairs)}
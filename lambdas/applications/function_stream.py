@@ -0,0 +1,203 @@
+import boto3
+import os
+import logging
+import json
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.types import TypeDeserializer
+
+import aggregates
+import sessions
+import timestamps
+from ddsketch import DDSketch
+from dictionary import UserAgentDictionary
+from hyperloglog import HyperLogLog
+from planner import DAILY_PREFIX, HOURLY_PREFIX, LEADERBOARD_PREFIX, OPERATION_KEY, TOTAL_KEY
+from topk import SpaceSaving
+
+# Get the service resource.
+dynamodb = boto3.resource('dynamodb')
+
+# The events table, only written to when compacting user agents.
+table = dynamodb.Table(os.environ['TABLE_NAME'])
+
+# The table holding pre-computed aggregates of the events table.
+table_aggregates = dynamodb.Table(os.environ['AGGREGATES_TABLE_NAME'])
+
+# Compact storage replaces the user agent of each event with a short id from the lookup table.
+COMPACT_USER_AGENTS = os.environ.get('COMPACT_USER_AGENTS') == 'true'
+
+# The user agent lookup table, warm between invocations.
+dictionary = UserAgentDictionary(dynamodb, table_aggregates)
+
+# Sessions of a visitor end after this many seconds without events.
+sessionizer = sessions.Sessionizer(int(os.environ.get('SESSION_TIMEOUT_S', sessions.DEFAULT_TIMEOUT)))
+
+# Converts stream images to plain Python values.
+deserializer = TypeDeserializer()
+
+# Set logger level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+def new_records(event):
+    # Only new events are aggregated, updates and removals are ignored. Each comes with the sequence number of its
+    # record, None when there is none.
+    return [
+        (int(record['dynamodb']['SequenceNumber']) if 'SequenceNumber' in record['dynamodb'] else None,
+         {key: deserializer.deserialize(value) for key, value in record['dynamodb']['NewImage'].items()})
+        for record in event['Records']
+        if record['eventName'] == 'INSERT'
+    ]
+
+
+def sketch(sketches, pk, sk, cls):
+    # The records of the batch for an aggregate item, created on first use.
+    key = (pk, sk)
+    if key not in sketches:
+        sketches[key] = (cls, [])
+    return sketches[key][1]
+
+
+def handler(event, context):
+    records = new_records(event)
+    items = [item for sequence, item in records]
+
+    logging.info('records: {}'.format(json.dumps({'total': len(event['Records']), 'inserted': len(items)})))
+
+    # Intern the user agents first, the summaries then count the short ids.
+    try:
+        if COMPACT_USER_AGENTS:
+            for item in items:
+                item['user_agent_id'] = dictionary.intern(item['user_agent'])
+    except Exception as e:
+        # Format error message as json.
+        error_json = json.dumps({
+            'type': 'UnknownException',
+            'message': 'Something went wrong with interning user agents.'
+        })
+        logging.error(error_json)
+        raise Exception(error_json)
+
+    # Group the values of the whole batch first, so each aggregate item is written once per batch.
+    try:
+        sketches = {}
+        counts = {}
+        quarters = {}
+        indexed = {}
+        for sequence, item in records:
+            application = item['application']
+            created_at = timestamps.parse_created_at(item['created_at'])
+            day = timestamps.day(created_at)
+            hour = timestamps.hour(created_at)
+
+            # The day events started to be stored with the key of the operation index, by the time they arrived.
+            if OPERATION_KEY in item:
+                received = timestamps.day(timestamps.parse_created_at(item.get('received_at', item['created_at'])))
+                indexed[application] = min(indexed.get(application, received), received)
+
+            sketch(sketches, application, 'unique_sources#' + day, HyperLogLog).append(
+                (sequence, item['source_ip']))
+            sketch(sketches, application, 'media_time#{}#{}'.format(day, item['operation']), DDSketch).append(
+                (sequence, float(item['current_media_time'])))
+            sketch(sketches, application, 'top#source_ip#' + hour, SpaceSaving).append(
+                (sequence, item['source_ip']))
+            sketch(sketches, application, 'top#user_agent#' + hour, SpaceSaving).append(
+                (sequence, item.get('user_agent_id', item['user_agent'])))
+            # Events sent with a client time, seconds between the event and its arrival. Late events are merged
+            # into the buckets of the day they happened, like any other.
+            if 'lateness_ms' in item:
+                sketch(sketches, application, 'lateness#' + day, DDSketch).append(
+                    (sequence, max(0.0, float(item['lateness_ms']) / 1000)))
+            counts.setdefault((application, day), []).append((sequence, {'count': 1}))
+            quarters.setdefault((application, hour), []).append(
+                (sequence, {'q{}'.format(created_at.minute // 15): 1}))
+    except Exception as e:
+        # Format error message as json.
+        error_json = json.dumps({
+            'type': 'UnknownException',
+            'message': 'Something went wrong with building sketches.'
+        })
+        logging.error(error_json)
+        raise Exception(error_json)
+
+    # Merge the records into the stored sketches. Records merged before, by a batch which failed after this point
+    # and is retried or split, are skipped.
+    try:
+        for (pk, sk), (cls, values) in sketches.items():
+            aggregates.merge_sketch(table_aggregates, pk, sk, cls, values)
+
+        # Daily counts and the running total read by the planner. Counters are added to once per record like the
+        # sketches are merged, the planner serves the daily counts as exact.
+        totals = {}
+        for (application, day), counted in counts.items():
+            aggregates.add_counts(table_aggregates, {'pk': application, 'sk': DAILY_PREFIX + day}, counted)
+            # The same count in the partition of the day, ranking applications only reads the days of the range.
+            aggregates.add_counts(table_aggregates, {'pk': LEADERBOARD_PREFIX + day, 'sk': application}, counted)
+            total, since = totals.get(application, ([], day))
+            totals[application] = (total + counted, min(since, day))
+        # Hourly counts split in quarters, so days of any time zone offset can be summed from them.
+        for (application, hour), counted in quarters.items():
+            aggregates.add_counts(table_aggregates, {'pk': application, 'sk': HOURLY_PREFIX + hour}, counted)
+        for application, (counted, since) in totals.items():
+            values = {':since': since}
+            update = 'since = if_not_exists(since, :since)'
+            if application in indexed:
+                values[':index_since'] = indexed[application]
+                update += ', index_since = if_not_exists(index_since, :index_since)'
+            aggregates.add_counts(table_aggregates, {'pk': application, 'sk': TOTAL_KEY}, counted, update, values)
+
+        # Replace the user agent of the stored events with its id. Updates are ignored by this function.
+        if COMPACT_USER_AGENTS:
+            for item in items:
+                table.update_item(
+                    Key={'application': item['application'], 'created_at': item['created_at']},
+                    UpdateExpression='SET user_agent_id = :id REMOVE user_agent',
+                    ConditionExpression=Attr('created_at').exists(),
+                    ExpressionAttributeValues={':id': item['user_agent_id']}
+                )
+    except Exception as e:
+        # Format error message as json.
+        error_json = json.dumps({
+            'type': 'UnknownException',
+            'message': 'Something went wrong with the database.'
+        })
+        logging.error(error_json)
+        raise Exception(error_json)
+
+    # Fold the events of each visitor into its open session in time order. Records of an application come from one
+    # shard in order, so sessions are read and written once per visitor per batch without conditions. Records
+    # folded into a session before, by a batch which failed after saving it, are skipped.
+    try:
+        visits = {}
+        for sequence, item in records:
+            visits.setdefault((item['application'], sessions.visitor(item)), []).append(
+                (timestamps.epoch(timestamps.parse_created_at(item['created_at'])), item['operation'], sequence))
+        states = sessions.load(dynamodb, table_aggregates, list(visits))
+        counts = {}
+        for key, events in visits.items():
+            state = states.get(key)
+            folded = state.get('sequence') if state else None
+            events = [event for event in events if event[2] is None or folded is None or event[2] > folded]
+            if not events:
+                del states[key]
+                continue
+            days = counts.setdefault(key[0], {})
+            for time, operation, sequence in sorted(events, key=lambda event: event[:2]):
+                # The counters each record adds to, so they are added once like those of the events.
+                added = {}
+                state = sessionizer.add(state, time, operation, added)
+                for day, counters in added.items():
+                    days.setdefault(day, []).append((sequence, counters))
+            sequences = [sequence for time, operation, sequence in events if sequence is not None]
+            if sequences:
+                state = dict(state, sequence=max(sequences + ([folded] if folded is not None else [])))
+            states[key] = state
+        sessions.save(table_aggregates, states, counts)
+    except Exception as e:
+        # Format error message as json.
+        error_json = json.dumps({
+            'type': 'UnknownException',
+            'message': 'Something went wrong with sessions.'
+        })
+        logging.error(error_json)
+        raise Exception(error_json)
@@ -0,0 +1,71 @@
+import hashlib
+import math
+import zlib
+
+# The number of registers is 2^precision. A precision of 12 uses 4096 one byte registers and has a standard error
+# of 1.04 / sqrt(4096), about 1.6%. Estimates are within two standard errors (3.3%) about 95% of the time.
+DEFAULT_PRECISION = 12
+
+
+class HyperLogLog(object):
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('The precision must be between 4 and 16.')
+
+        self.precision = precision
+        self.size = 1 << precision
+
+        if registers is None:
+            self.registers = bytearray(self.size)
+        elif len(registers) == self.size:
+            self.registers = bytearray(registers)
+        else:
+            raise ValueError('The registers do not match the precision.')
+
+    @property
+    def relative_error(self):
+        # Standard error of the estimate (Flajolet et al. 2007).
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        # A 64 bit hash makes the large range correction unnecessary.
+        hashed = int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+        # The first bits pick the register, the position of the leftmost 1 in the rest is the rank.
+        index = hashed >> (64 - self.precision)
+        remaining = (hashed << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = min(64 - remaining.bit_length(), 64 - self.precision) + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Only sketches with the same precision can be merged.')
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        raw = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+
+        # Small range correction, linear counting is more accurate while registers are still empty.
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.size and zeros:
+            return int(round(self.size * math.log(self.size / float(zeros))))
+
+        return int(round(raw))
+
+    def to_bytes(self):
+        # Registers of quiet days are mostly zero, so they compress well.
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
@@ -0,0 +1,466 @@
+import bisect
+import collections
+import datetime
+import math
+import threading
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+
+import timestamps
+
+# Sort key of the running total of an application kept by the stream function. It also holds the first day the
+# stream function saw, daily counts are complete for every day after it, and the first day it saw an event with the
+# key of the operation index (index_since), the index is complete for every day after that one.
+TOTAL_KEY = 'events#total'
+
+# Prefix of the daily counts kept by the stream function (events#YYYY-mm-dd).
+DAILY_PREFIX = 'events#'
+
+# Prefix of the hourly counts kept by the stream function (events#hour#YYYY-mm-ddTHH). Each has the counts of its
+# four quarters of an hour in q0 to q3.
+HOURLY_PREFIX = 'events#hour#'
+
+# Prefix of the partitions of daily counts of every application (leaderboard#YYYY-mm-dd) kept by the stream
+# function. Each has one item per application, its sort key, with the count of the day.
+LEADERBOARD_PREFIX = 'leaderboard#'
+
+# Average size of a stored event and of a daily count. Read units are charged on whole items, whatever the
+# projection.
+EVENT_BYTES = 200
+DAILY_BYTES = 40
+
+# Index of the events by application and operation (application#operation) and time. Only the keys are projected,
+# an item of the index is about a third of an event. The index is sparse, events stored before the PUT template set
+# its key are not in it.
+OPERATION_INDEX = 'operation'
+OPERATION_KEY = 'application_operation'
+INDEX_BYTES = 70
+
+# Queries are eventually consistent, half a unit per 4 KB read, and return at most 1 MB per page.
+READ_UNIT = 4096
+PAGE_SIZE = 1024 * 1024
+
+# Width of the parts of an hour counted separately, every time zone offset is a multiple of it.
+QUARTER = datetime.timedelta(minutes=15)
+
+HOUR = datetime.timedelta(hours=1)
+
+# Read units one request is worth, every request adds a round trip to the latency.
+REQUEST_COST = 1.0
+
+# Seconds the totals of an application are trusted by a warm container.
+TOTALS_TTL = 60
+
+# Totals kept warm per container.
+CACHE_SIZE = 10000
+
+# Items counted at most when sampling the density of an application without totals.
+SAMPLE_LIMIT = 1000
+
+
+def query_cost(items, item_bytes):
+    size = items * item_bytes
+    return {
+        'requests': max(1, int(math.ceil(size / float(PAGE_SIZE)))),
+        'read_units': max(0.5, math.ceil(size / float(READ_UNIT)) * 0.5)
+    }
+
+
+def add_cost(cost, other):
+    return {
+        'requests': cost['requests'] + other['requests'],
+        'read_units': cost['read_units'] + other['read_units']
+    }
+
+
+def weight(cost):
+    return cost['read_units'] + REQUEST_COST * cost['requests']
+
+
+def whole_day(day_start, day_end):
+    return day_start.time() == datetime.time.min and day_end.time() == datetime.time.max
+
+
+class Planner(object):
+    # Picks the cheapest way to count the events of an application per day:
+    #  raw    - one query of the whole partition, counted in the function. Cheapest for quiet applications.
+    #  count  - one Select=COUNT query per day, nothing but the count is returned.
+    #  rollup - one query of the daily counts, with count queries for days they do not cover.
+    #  index  - one Select=COUNT query per day on the operation index, when counting one operation. Days before the
+    #           index are counted like filter does.
+    #  filter - one Select=COUNT query per day of the events filtered on the operation, when none of the days are on
+    #           the index.
+
+    def __init__(self, table, table_aggregates):
+        self.table = table
+        self.table_aggregates = table_aggregates
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def bind(self, table, table_aggregates):
+        # A planner reading through other table resources and sharing the totals kept warm. boto3 resources are not
+        # thread safe, threads counting at once each read through their own.
+        planner = Planner(table, table_aggregates)
+        planner.cache = self.cache
+        planner.lock = self.lock
+        return planner
+
+    def _query(self, table, cost, **kwargs):
+        # Every query returns its consumed capacity, so the actual cost of a plan can be logged.
+        data = table.query(ReturnConsumedCapacity='TOTAL', **kwargs)
+        cost['requests'] += 1
+        cost['read_units'] += float(data.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        return data
+
+    def totals(self, application, cost):
+        # The running total and first day of an application, None before the stream function saw it.
+        with self.lock:
+            cached = self.cache.get(application)
+            if cached is not None and cached[0] > time.time():
+                self.cache.move_to_end(application)
+                return cached[1]
+
+        data = self.table_aggregates.get_item(Key={'pk': application, 'sk': TOTAL_KEY},
+                                              ReturnConsumedCapacity='TOTAL')
+        cost['requests'] += 1
+        cost['read_units'] += float(data.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        item = data.get('Item')
+        totals = {'count': int(item['count']), 'since': item['since'], 'index_since': item.get('index_since')} \
+            if item else None
+
+        with self.lock:
+            self.cache[application] = (time.time() + TOTALS_TTL, totals)
+            self.cache.move_to_end(application)
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return totals
+
+    def sample(self, application, day_start, day_end, cost, operation=None):
+        # Events of one day, counting stops at the sample limit.
+        data = self._query(self.table, cost, Select='COUNT', Limit=SAMPLE_LIMIT,
+                           **key_condition(application, day_start, day_end, operation))
+        return data['Count']
+
+    def density(self, application, ranges, totals, cost):
+        # Events per day, averaged since the first day seen or sampled from the last day of the range.
+        if totals:
+            since = datetime.datetime.strptime(totals['since'], timestamps.DAY_FORMAT)
+            return totals['count'] / float(max(1, (datetime.datetime.utcnow() - since).days + 1))
+        return self.sample(application, ranges[-1][0], ranges[-1][1], cost)
+
+    def count(self, application, start, end, cost, operation=None, index=True):
+        # Events between two times, both inclusive to the second. Events of one operation are counted on the index,
+        # or filtered out of the events for times before it.
+        kwargs = dict(key_condition(application, start, end, operation, index), Select='COUNT')
+        events = 0
+        while True:
+            data = self._query(self.table, cost, **kwargs)
+            events += data['Count']
+            if 'LastEvaluatedKey' not in data:
+                return events
+            kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+    def local_counts(self, application, start, end, zone):
+        # Events per local day between two local times. Quarters of an hour after the first day seen are summed
+        # from the hourly counts, which costs the same for every time zone. The rest is counted from the events.
+        cost = {'requests': 0, 'read_units': 0.0}
+        totals = self.totals(application, cost)
+        days = timestamps.local_day_ranges(start, end, zone)
+        boundaries = [day_start for name, day_start, day_end in days]
+        utc_start, utc_end = days[0][1], days[-1][2]
+        response = {}
+
+        # The whole quarters the hourly counts cover. A range ending within a quarter, like at 10:07, leaves its last
+        # part to the events.
+        covered_start = quarter_ceil(utc_start)
+        covered_end = quarter_floor(utc_end + datetime.timedelta(microseconds=1))
+        if totals:
+            first_day = datetime.datetime.strptime(totals['since'], timestamps.DAY_FORMAT) + datetime.timedelta(days=1)
+            covered_start = max(covered_start, first_day)
+        else:
+            covered_start = covered_end
+
+        if covered_start < covered_end:
+            kwargs = {
+                'KeyConditionExpression': Key('pk').eq(application) & Key('sk').between(
+                    HOURLY_PREFIX + timestamps.hour(covered_start), HOURLY_PREFIX + timestamps.hour(covered_end))
+            }
+            while True:
+                data = self._query(self.table_aggregates, cost, **kwargs)
+                for item in data['Items']:
+                    hour = datetime.datetime.strptime(item['sk'][len(HOURLY_PREFIX):], timestamps.HOUR_FORMAT)
+                    for index in range(4):
+                        quarter = hour + index * QUARTER
+                        events = int(item.get('q{}'.format(index), 0))
+                        if events and covered_start <= quarter < covered_end:
+                            name = days[bisect.bisect_right(boundaries, quarter) - 1][0]
+                            response[name] = response.get(name, 0) + events
+                if 'LastEvaluatedKey' not in data:
+                    break
+                kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+        else:
+            covered_start = covered_end = utc_end + datetime.timedelta(microseconds=1)
+
+        # Before and after the covered quarters, split at local and UTC midnights.
+        pieces = [(utc_start, covered_start - datetime.timedelta(microseconds=1)), (covered_end, utc_end)]
+        for name, day_start, day_end in days:
+            for piece_start, piece_end in pieces:
+                piece_start, piece_end = max(piece_start, day_start), min(piece_end, day_end)
+                for range_start, range_end in timestamps.day_ranges(piece_start, piece_end):
+                    events = self.count(application, range_start, range_end, cost)
+                    if events:
+                        response[name] = response.get(name, 0) + events
+
+        return response, cost
+
+    def plan(self, application, start, end, operation=None):
+        # The cheapest way to count the events.
+        return self.plans(application, start, end, operation)[0]
+
+    def plans(self, application, start, end, operation=None):
+        # Every way to count the events with its predicted cost, cheapest first.
+        cost = {'requests': 0, 'read_units': 0.0}
+        ranges = timestamps.day_ranges(start, end)
+        totals = self.totals(application, cost)
+
+        if operation:
+            plans = self._operation_plans(application, ranges, totals, operation, cost)
+            density = plans[0]['density']
+        else:
+            density = self.density(application, ranges, totals, cost)
+            plans = self._event_plans(ranges, totals, density)
+
+        for candidate in plans:
+            candidate.update({'application': application, 'start': start, 'end': end, 'operation': operation,
+                              'density': round(density, 2), 'planning': cost})
+        return sorted(plans, key=lambda candidate: weight(candidate['predicted']))
+
+    def _event_plans(self, ranges, totals, density):
+        plans = []
+
+        # Count queries cost the same read units as reading the events, without returning them.
+        count = {'requests': 0, 'read_units': 0.0}
+        for _ in ranges:
+            count = add_cost(count, query_cost(density, EVENT_BYTES))
+        plans.append({'strategy': 'count', 'counts': ranges, 'predicted': count})
+
+        if totals:
+            # The whole partition is read, whatever the range.
+            plans.append({'strategy': 'raw', 'predicted': query_cost(totals['count'], EVENT_BYTES)})
+
+            # Whole days after the first day seen are read from the daily counts.
+            rollup = [timestamps.day(day_start) for day_start, day_end in ranges
+                      if whole_day(day_start, day_end) and timestamps.day(day_start) > totals['since']]
+            if rollup:
+                counts = [(day_start, day_end) for day_start, day_end in ranges
+                          if timestamps.day(day_start) not in rollup]
+                predicted = query_cost(len(rollup), DAILY_BYTES)
+                for _ in counts:
+                    predicted = add_cost(predicted, query_cost(density, EVENT_BYTES))
+                plans.append({'strategy': 'rollup', 'rollup': rollup, 'counts': counts, 'predicted': predicted})
+
+        return plans
+
+    def _operation_plans(self, application, ranges, totals, operation, cost):
+        # Events of one operation are counted per day on the index, which only reads matching events, or filtered
+        # out of every event of the application. Days up to the first one with events on the index are filtered
+        # too, the index would miss the events stored before it.
+        index_since = totals.get('index_since') if totals else None
+        unindexed = [timestamps.day(day_start) for day_start, day_end in ranges
+                     if index_since is None or timestamps.day(day_start) <= index_since]
+        predicted = {'requests': 0, 'read_units': 0.0}
+        # Unindexed days come first, the last day is on the index when any is.
+        if len(unindexed) < len(ranges):
+            density = self.sample(application, ranges[-1][0], ranges[-1][1], cost, operation)
+            for _ in ranges[len(unindexed):]:
+                predicted = add_cost(predicted, query_cost(density, INDEX_BYTES))
+        if unindexed:
+            events_density = self.density(application, ranges, totals, cost)
+            for _ in unindexed:
+                predicted = add_cost(predicted, query_cost(events_density, EVENT_BYTES))
+            if len(unindexed) == len(ranges):
+                density = events_density
+        plans = [{'strategy': 'index' if len(unindexed) < len(ranges) else 'filter', 'counts': ranges,
+                  'unindexed': unindexed, 'predicted': predicted, 'density': density}]
+        if totals:
+            plans.append({'strategy': 'raw', 'predicted': query_cost(totals['count'], EVENT_BYTES)})
+        return plans
+
+    def execute(self, plan):
+        # Events per day, only days with events are returned. The cost is added to the plan.
+        return dict(self.counts(plan))
+
+    def counts(self, plan):
+        # Events per day in time order as (YYYY-mm-dd, events), days without events are skipped. Each day is
+        # yielded as soon as it is known, the cost is added to the plan after the last one.
+        cost = {'requests': 0, 'read_units': 0.0}
+        application = plan['application']
+
+        if plan['strategy'] == 'raw':
+            # The partition is not sorted by time across days, every day is known once it was read whole.
+            response = self._raw(plan, cost)
+            for day in sorted(response):
+                yield day, response[day]
+
+        # Daily counts and count queries are merged in order, the pages of daily counts are read as needed.
+        daily = self._daily(application, plan.get('rollup', []), cost)
+        pending = next(daily, None)
+        unindexed = set(plan.get('unindexed', []))
+        for day_start, day_end in plan.get('counts', []):
+            name = timestamps.day(day_start)
+            while pending is not None and pending[0] < name:
+                yield pending
+                pending = next(daily, None)
+            events = self.count(application, day_start, day_end, cost, plan.get('operation'), name not in unindexed)
+            if events:
+                yield name, events
+        while pending is not None:
+            yield pending
+            pending = next(daily, None)
+
+        plan['actual'] = cost
+
+    def _raw(self, plan, cost):
+        kwargs = {
+            'KeyConditionExpression': Key('application').eq(plan['application']),
+            'ProjectionExpression': 'created_at'
+        }
+        operation = plan.get('operation')
+        if operation:
+            # Read units are charged on whole events, those of other operations are dropped here.
+            kwargs.update({'ProjectionExpression': 'created_at, #operation',
+                           'ExpressionAttributeNames': {'#operation': 'operation'}})
+        start_day, end_day = timestamps.day(plan['start']), timestamps.day(plan['end'])
+        response = {}
+        # Days already formatted, events of a day share the same created_at prefix (dd/MMM/yyyy).
+        days = {}
+        while True:
+            data = self._query(self.table, cost, **kwargs)
+            for item in data['Items']:
+                if operation and item.get('operation') != operation:
+                    continue
+                prefix = item['created_at'][:11]
+                if prefix not in days:
+                    days[prefix] = timestamps.day(timestamps.parse_created_at(item['created_at']))
+                created_at = days[prefix]
+                if not start_day <= created_at <= end_day:
+                    continue
+                # Only the first and last day can be partial.
+                if created_at in [start_day, end_day] and \
+                        not plan['start'] <= timestamps.parse_created_at(item['created_at']) <= plan['end']:
+                    continue
+                response[created_at] = response.get(created_at, 0) + 1
+            if 'LastEvaluatedKey' not in data:
+                return response
+            kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+    def _daily(self, application, rollup, cost):
+        # Daily counts of the given days in time order, read a page at a time.
+        if not rollup:
+            return
+        days = set(rollup)
+        kwargs = {
+            'KeyConditionExpression': Key('pk').eq(application) & Key('sk').between(
+                DAILY_PREFIX + rollup[0], DAILY_PREFIX + rollup[-1])
+        }
+        while True:
+            data = self._query(self.table_aggregates, cost, **kwargs)
+            for item in data['Items']:
+                created_at = item['sk'][len(DAILY_PREFIX):]
+                if created_at in days and item['count']:
+                    yield created_at, int(item['count'])
+            if 'LastEvaluatedKey' not in data:
+                return
+            kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+    def hourly_counts(self, application, start, end, cost):
+        # Events per hour in time order as (YYYY-mm-ddTHH, events), hours without events are skipped. Whole hours
+        # after the first day seen are read from the hourly counts, the rest is counted from the events.
+        totals = self.totals(application, cost)
+        covered_start = hour_ceil(start)
+        covered_end = (end + datetime.timedelta(microseconds=1)).replace(minute=0, second=0, microsecond=0)
+        if totals:
+            first_day = datetime.datetime.strptime(totals['since'], timestamps.DAY_FORMAT) + datetime.timedelta(days=1)
+            covered_start = max(covered_start, first_day)
+        if not totals or covered_start >= covered_end:
+            covered_start = covered_end = end + datetime.timedelta(microseconds=1)
+
+        for name, events in self._count_hours(application, start, covered_start - datetime.timedelta(microseconds=1),
+                                              cost):
+            yield name, events
+
+        if covered_start < covered_end:
+            kwargs = {
+                'KeyConditionExpression': Key('pk').eq(application) & Key('sk').between(
+                    HOURLY_PREFIX + timestamps.hour(covered_start),
+                    HOURLY_PREFIX + timestamps.hour(covered_end - HOUR))
+            }
+            while True:
+                data = self._query(self.table_aggregates, cost, **kwargs)
+                for item in data['Items']:
+                    events = sum(int(item.get('q{}'.format(index), 0)) for index in range(4))
+                    if events:
+                        yield item['sk'][len(HOURLY_PREFIX):], events
+                if 'LastEvaluatedKey' not in data:
+                    break
+                kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+        for name, events in self._count_hours(application, covered_end, end, cost):
+            yield name, events
+
+    def _count_hours(self, application, start, end, cost):
+        # One count query per hour, or part of an hour, between two times.
+        current = start
+        while current <= end:
+            hour_end = current.replace(minute=59, second=59, microsecond=999999)
+            events = self.count(application, current, min(hour_end, end), cost)
+            if events:
+                yield timestamps.hour(current), events
+            current = hour_end + datetime.timedelta(microseconds=1)
+
+
+def key_condition(application, start, end, operation=None, index=True):
+    # Events of an application between two times, or of one of its operations on the index. Without the index the
+    # events of other operations are filtered out, their read units are still charged.
+    between = Key('created_at').between(timestamps.format_created_at(start), timestamps.created_at_bound(end))
+    if operation and index:
+        return {
+            'IndexName': OPERATION_INDEX,
+            'KeyConditionExpression': Key(OPERATION_KEY).eq('{}#{}'.format(application, operation)) & between
+        }
+    condition = {'KeyConditionExpression': Key('application').eq(application) & between}
+    if operation:
+        condition['FilterExpression'] = Attr('operation').eq(operation)
+    return condition
+
+
+def hour_ceil(date):
+    # The first hour starting at or after a time.
+    floor = date.replace(minute=0, second=0, microsecond=0)
+    return floor if floor == date else floor + HOUR
+
+
+def quarter_floor(date):
+    # The quarter of an hour a time is in.
+    return date.replace(minute=date.minute - date.minute % 15, second=0, microsecond=0)
+
+
+def quarter_ceil(date):
+    # The first quarter of an hour starting at or after a time.
+    floor = quarter_floor(date)
+    return floor if floor == date else floor + QUARTER
+
+
+def summary(plan):
+    # What is logged of a plan, to tune the cost model against actual costs.
+    return {
+        'application': plan['application'],
+        'strategy': plan['strategy'],
+        'operation': plan.get('operation'),
+        'days': len(timestamps.day_ranges(plan['start'], plan['end'])),
+        'density': plan['density'],
+        'planning': plan['planning'],
+        'predicted': plan['predicted'],
+        'actual': plan.get('actual')
+    }
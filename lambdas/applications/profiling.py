@@ -0,0 +1,229 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+# What a profile records: cpu (cProfile), memory (tracemalloc) and spans (wall-clock time of each stage).
+MODES = ['cpu', 'memory', 'spans']
+
+# Profiles started per minute at most in a container, whatever the sampling rate and headers ask for. Sampled and
+# requested profiles are limited apart, so clients asking for profiles can't push out the sampled ones.
+MAX_PER_MINUTE = 6
+
+# Frames kept of each allocation traceback, and lines of each collapsed profile, heaviest first.
+MEMORY_FRAMES = 16
+MAX_STACKS = 200
+
+# Stacks under this many microseconds (or bytes), or deeper than this, are left out of collapsed profiles.
+MIN_WEIGHT = 1
+MAX_DEPTH = 64
+
+# Object key prefix of profiles written to S3.
+KEY_PREFIX = 'profiles/'
+
+
+class NullSpan(object):
+    # Spans outside of a profile cost a method call.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, spans, name):
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.spans[self.name] = round(self.spans.get(self.name, 0.0) + elapsed, 3)
+        return False
+
+
+class Profile(object):
+    # The profilers of one invocation. cProfile only sees the thread it was enabled in, the work of worker threads,
+    # like the spans of a comparison or approximate probes, is in the spans but not in the CPU stacks.
+
+    def __init__(self, modes):
+        self.modes = modes
+        self.spans = {}
+        self.cpu = None
+        self.tracing = False
+        if 'memory' in modes and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            self.tracing = True
+        if 'cpu' in modes:
+            self.cpu = cProfile.Profile()
+            self.cpu.enable()
+
+    def span(self, name):
+        return Span(self.spans, name) if 'spans' in self.modes else NULL_SPAN
+
+    def stop(self):
+        # Collapsed stacks of CPU time (microseconds) and of the memory still allocated (bytes), and the spans.
+        # Both profilers are stopped first, so they don't record the work of collapsing the other.
+        result = {'spans': self.spans}
+        if self.cpu is not None:
+            self.cpu.disable()
+        if self.tracing:
+            snapshot = tracemalloc.take_snapshot()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            result['memory'] = collapse_memory(snapshot)
+        if self.cpu is not None:
+            result['cpu'] = collapse_cpu(pstats.Stats(self.cpu).stats)
+        return result
+
+
+class Profiler(object):
+    # Profiles a share of the invocations (rate, 0 to 1), and those asked for with a header when on_request is set.
+    # At most max_per_minute sampled and as many requested profiles are started, so profiling can't slow a container
+    # down whatever its traffic. Outside of a profile the hooks do nothing.
+
+    def __init__(self, rate=0.0, modes=None, max_per_minute=MAX_PER_MINUTE, output='logs', s3=None, bucket=None,
+                 on_request=False):
+        self.rate = rate
+        self.modes = MODES if modes is None else modes
+        self.max_per_minute = max_per_minute
+        self.output = output
+        self.s3 = s3
+        self.bucket = bucket
+        self.on_request = on_request
+        # Start times of the profiles of the last minute, by kind. Invocations of a container can run in threads,
+        # like the local emulator does.
+        self.started = {'sampled': [], 'requested': []}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self, requested=False):
+        # The profile of this invocation, None when it is not profiled.
+        self.local.profile = None
+        requested = requested and self.on_request
+        if not requested and not (self.rate and random.random() < self.rate):
+            return None
+        kind = 'requested' if requested else 'sampled'
+        now = time.time()
+        with self.lock:
+            started = [started for started in self.started[kind] if started > now - 60]
+            self.started[kind] = started
+            if len(started) >= self.max_per_minute:
+                return None
+            started.append(now)
+        self.local.profile = Profile(self.modes)
+        return self.local.profile
+
+    def span(self, name):
+        profile = getattr(self.local, 'profile', None)
+        return NULL_SPAN if profile is None else profile.span(name)
+
+    def finish(self, request_id):
+        # Stops the profile of this invocation and writes it out, returns what was logged.
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            return None
+        self.local.profile = None
+        result = profile.stop()
+
+        if self.output == 's3' and self.s3 is not None and self.bucket:
+            prefix = '{}{}/{}'.format(KEY_PREFIX, time.strftime('%Y-%m-%d', time.gmtime()), request_id)
+            for mode in ['cpu', 'memory']:
+                if mode in result:
+                    self.s3.put_object(Bucket=self.bucket, Key='{}.{}.folded'.format(prefix, mode),
+                                       Body='\n'.join(result.pop(mode)).encode('utf-8'), ContentType='text/plain')
+            result['location'] = 's3://{}/{}'.format(self.bucket, prefix)
+        logging.info('profile: {}'.format(json.dumps(result, separators=(',', ':'))))
+        return result
+
+
+def from_environment(s3=None, bucket=None):
+    # PROFILE_RATE of the invocations are profiled, and those with an X-Profile: true header when PROFILE_ON_REQUEST
+    # is true. PROFILE_MODES is a comma separated list of modes and PROFILE_OUTPUT logs or s3.
+    modes = os.environ.get('PROFILE_MODES')
+    return Profiler(
+        rate=float(os.environ.get('PROFILE_RATE', '0')),
+        modes=[mode for mode in modes.split(',') if mode in MODES] if modes else None,
+        max_per_minute=int(os.environ.get('PROFILE_MAX_PER_MINUTE', MAX_PER_MINUTE)),
+        output=os.environ.get('PROFILE_OUTPUT', 'logs'),
+        s3=s3,
+        bucket=bucket,
+        on_request=os.environ.get('PROFILE_ON_REQUEST') == 'true'
+    )
+
+
+def frame_name(function):
+    # cProfile keys are (file, line, name), built-ins have no file.
+    path, line, name = function
+    if path == '~':
+        return name.replace(';', ':')
+    return '{}:{}'.format(os.path.basename(path), name).replace(';', ':')
+
+
+def collapse_cpu(stats, max_stacks=MAX_STACKS):
+    # cProfile has the time of each function per caller, not whole stacks. Stacks are rebuilt from the outermost
+    # functions down, the time of a function is split between its callers in proportion to the time they spent in
+    # it. Exact for call trees, an estimate when a function is called from several places.
+    children = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            children.setdefault(caller, []).append((function, caller_stats[3]))
+    # Functions called before profiling started have no callers, or callers which were never profiled.
+    roots = [function for function, (_, _, _, _, callers) in stats.items()
+             if not any(caller in stats for caller in callers)]
+
+    weights = {}
+
+    def walk(function, stack, weight):
+        total = stats[function][3]
+        if not total or weight * 1e6 < MIN_WEIGHT or len(stack) >= MAX_DEPTH:
+            return
+        stack = stack + [frame_name(function)]
+        own = stats[function][2] * weight / total
+        if own * 1e6 >= MIN_WEIGHT:
+            name = ';'.join(stack)
+            weights[name] = weights.get(name, 0.0) + own
+        for child, child_total in children.get(function, []):
+            if child not in stats:
+                continue
+            # Recursion is folded into the first call.
+            if frame_name(child) not in stack:
+                walk(child, stack, weight * child_total / total)
+
+    for root in roots:
+        walk(root, [], stats[root][3])
+    return ['{} {}'.format(stack, int(weight * 1e6)) for stack, weight in
+            sorted(weights.items(), key=lambda item: -item[1])[:max_stacks]]
+
+
+def collapse_memory(snapshot, max_stacks=MAX_STACKS):
+    # Bytes still allocated at the end of the invocation, by allocation traceback from the outermost frame.
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__)])
+    lines = []
+    for statistic in snapshot.statistics('traceback')[:max_stacks]:
+        if statistic.size < MIN_WEIGHT:
+            continue
+        # Frames are the most recent first before Python 3.7.
+        frames = list(statistic.traceback)
+        if sys.version_info < (3, 7):
+            frames.reverse()
+        stack = ';'.join('{}:{}'.format(os.path.basename(frame.filename), frame.lineno).replace(';', ':')
+                         for frame in frames)
+        lines.append('{} {}'.format(stack, statistic.size))
+    return lines
@@ -0,0 +1,109 @@
+import datetime
+import hashlib
+
+import aggregates
+import timestamps
+
+# Sort key prefix of the open session of a visitor (session#{visitor}) and of the daily session counts
+# (sessions#YYYY-mm-dd), both in the partition of the application.
+STATE_PREFIX = 'session#'
+DAILY_PREFIX = 'sessions#'
+
+# Seconds without events after which the session of a visitor is over.
+DEFAULT_TIMEOUT = 1800
+
+# Steps of the funnel in order. A session reaches a step with an event of its operation after reaching the previous.
+FUNNEL = ['play', 'pause', 'complete']
+
+# Counters of the daily items. Duration is in seconds, stale events came in too late to join any open session.
+COUNTERS = ['sessions', 'events', 'duration', 'stale'] + FUNNEL
+
+# Keys of a BatchGetItem request.
+BATCH_SIZE = 100
+
+
+def visitor(item):
+    # Visitors are told apart by address and user agent, hashed so the state stays small whatever the user agent.
+    return hashlib.sha1('{}\n{}'.format(item['source_ip'], item['user_agent']).encode('utf-8')).hexdigest()[:16]
+
+
+class Sessionizer(object):
+    # Folds the events of a visitor into its open session. The state of a session is a few numbers: when it started
+    # and when it was last seen (epoch seconds) and how far down the funnel it went.
+    #
+    # Daily counts are added to as sessions grow, a session counts on the day it started as soon as it starts. Nothing
+    # is left to emit when a session ends, so idle sessions are evicted by letting their state expire: the next event
+    # of the visitor after the timeout starts a new session and DynamoDB deletes state nobody came back to.
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+
+    def add(self, state, time, operation, counts):
+        # The state after an event at time (epoch seconds). counts maps days to counters and is added to.
+        if state is None or time > state['last'] + self.timeout:
+            state = {'start': time, 'last': time, 'stage': 0}
+            day_counts(counts, time)['sessions'] += 1
+        elif time < state['start'] - self.timeout:
+            # Late events of a session already over are not merged into the open one.
+            day_counts(counts, time)['stale'] += 1
+            return state
+        else:
+            state = dict(state)
+            if time > state['last']:
+                day_counts(counts, state['start'])['duration'] += time - state['last']
+                state['last'] = time
+
+        day_counts(counts, state['start'])['events'] += 1
+        if state['stage'] < len(FUNNEL) and operation == FUNNEL[state['stage']]:
+            day_counts(counts, state['start'])[operation] += 1
+            state['stage'] += 1
+        state['expires'] = state['last'] + self.timeout
+        return state
+
+
+def day_counts(counts, time):
+    day = timestamps.day(timestamps.EPOCH + datetime.timedelta(seconds=time))
+    if day not in counts:
+        counts[day] = dict.fromkeys(COUNTERS, 0)
+    return counts[day]
+
+
+def load(dynamodb, table, keys):
+    # Open sessions of (application, visitor) pairs, read consistently since the previous batch just wrote them.
+    states = {}
+    for offset in range(0, len(keys), BATCH_SIZE):
+        request = {
+            table.name: {
+                'Keys': [{'pk': application, 'sk': STATE_PREFIX + name} for application, name in
+                         keys[offset:offset + BATCH_SIZE]],
+                'ConsistentRead': True
+            }
+        }
+        while request:
+            data = dynamodb.batch_get_item(RequestItems=request)
+            for item in data['Responses'].get(table.name, []):
+                states[(item['pk'], item['sk'][len(STATE_PREFIX):])] = {
+                    'start': int(item['start']),
+                    'last': int(item['last']),
+                    'stage': int(item['stage']),
+                    'sequence': int(item['sequence']) if 'sequence' in item else None,
+                }
+            request = data.get('UnprocessedKeys')
+    return states
+
+
+def save(table, states, counts):
+    # One write per application and day and one per visitor, whatever the number of events in the batch. counts maps
+    # applications to their days, and days to the (sequence number, counters) of the records counted on them. The
+    # counters are written first, a session is only saved with the sequence number of the last record folded into it
+    # once its records are counted.
+    for application, days in counts.items():
+        for day, records in days.items():
+            aggregates.add_counts(table, {'pk': application, 'sk': DAILY_PREFIX + day}, records)
+    for (application, name), state in states.items():
+        item = dict(state, pk=application, sk=STATE_PREFIX + name)
+        if item.get('sequence') is None:
+            item.pop('sequence', None)
+        else:
+            item['sequence'] = aggregates.sequence_value(item['sequence'])
+        table.put_item(Item=item)
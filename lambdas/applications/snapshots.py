@@ -0,0 +1,145 @@
+import datetime
+import time
+
+import aggregates
+import timestamps
+from planner import LEADERBOARD_PREFIX
+
+# Sort key prefix of snapshots (snapshot#{start}#{end}) in the partition of the application, and partition key
+# prefix of the windows requested each day (windows#YYYY-mm-dd) with one counter per application and window.
+PREFIX = 'snapshot#'
+WINDOWS_PREFIX = 'windows#'
+
+# Windows (days ending today) computed for every active application, like today and the last 7 and 30 days.
+DEFAULT_WINDOWS = [1, 7, 30]
+
+# Seconds a snapshot is served after it was computed, events stored late for times before it are only counted by
+# the next one. Twice the schedule of the snapshot function by default.
+MAX_AGE = 1800
+
+# Seconds left out at the end of a snapshot, events of the last seconds may still be written.
+SETTLE = 60
+
+# Days of requested windows a snapshot function learns from, requests needed for a window to be computed, and
+# snapshots computed at most per run, the most requested and active first.
+LEARN_DAYS = 7
+MIN_REQUESTS = 10
+LIMIT = 200
+
+# Seconds between writes of the windows counted by a container.
+FLUSH_INTERVAL = 60
+
+
+def key(start, end):
+    return '{}{}#{}'.format(PREFIX, timestamps.day(start), timestamps.day(end))
+
+
+def window(start, end, now):
+    # Days of a range of whole days ending today, None for any other range.
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if start.time() != datetime.time.min or end.time() != datetime.time.max or end.date() != today.date():
+        return None
+    return (end.date() - start.date()).days + 1
+
+
+def parse_windows(value):
+    # SNAPSHOT_WINDOWS is a comma separated list of days, like 1,7,30.
+    return sorted({int(days) for days in value.split(',') if days.strip()}) if value else list(DEFAULT_WINDOWS)
+
+
+class WindowCounter(object):
+    # Counts the windows requested in a container and adds them to the counters of the day now and then, so
+    # requests do not each pay for a write.
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.counts = {}
+        self.flushed = time.time()
+
+    def add(self, table_aggregates, application, days, now):
+        name = (timestamps.day(now), application, days)
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if time.time() - self.flushed >= self.flush_interval:
+            self.flush(table_aggregates)
+
+    def flush(self, table_aggregates):
+        counts, self.counts = self.counts, {}
+        self.flushed = time.time()
+        for (day, application, days), requests in counts.items():
+            table_aggregates.update_item(
+                Key={'pk': WINDOWS_PREFIX + day, 'sk': '{}#{}'.format(application, days)},
+                UpdateExpression='ADD #requests :requests SET #expires = :expires',
+                ExpressionAttributeNames={'#requests': 'requests', '#expires': 'expires'},
+                ExpressionAttributeValues={
+                    ':requests': requests,
+                    ':expires': timestamps.epoch(datetime.datetime.strptime(day, timestamps.DAY_FORMAT)) +
+                    (LEARN_DAYS + 1) * 86400
+                }
+            )
+
+
+def choose(table_aggregates, now, windows, learn_days=LEARN_DAYS, min_requests=MIN_REQUESTS, limit=LIMIT):
+    # (application, days) pairs to compute: the configured windows of every application with events today, and
+    # windows requested at least min_requests times over the last days. The most requested come first, then the
+    # busiest applications.
+    requested = {}
+    for offset in range(learn_days):
+        day = timestamps.day(now - datetime.timedelta(days=offset))
+        for item in aggregates.query_partition(table_aggregates, WINDOWS_PREFIX + day):
+            application, _, days = item['sk'].rpartition('#')
+            pair = (application, int(days))
+            requested[pair] = requested.get(pair, 0) + int(item['requests'])
+
+    active = {item['sk']: int(item['count']) for item in
+              aggregates.query_partition(table_aggregates, LEADERBOARD_PREFIX + timestamps.day(now))}
+
+    pairs = {pair for pair, requests in requested.items() if requests >= min_requests}
+    pairs.update((application, days) for application in active for days in windows)
+    return sorted(pairs, key=lambda pair: (-requested.get(pair, 0), -active.get(pair[0], 0), pair))[:limit]
+
+
+def compute(planner, table_aggregates, application, days, now, max_age=MAX_AGE):
+    # Counts the events of the window up to a little before now into its snapshot, returns the plan.
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - datetime.timedelta(days=days - 1)
+    end = today.replace(hour=23, minute=59, second=59, microsecond=999999)
+    as_of = (now - datetime.timedelta(seconds=SETTLE)).replace(microsecond=0)
+
+    plan = None
+    counts = {}
+    if as_of >= start:
+        plan = planner.plan(application, start, as_of)
+        counts = planner.execute(plan)
+    else:
+        as_of = start - datetime.timedelta(seconds=1)
+
+    table_aggregates.put_item(Item={
+        'pk': application,
+        'sk': key(start, end),
+        'counts': counts,
+        'as_of': timestamps.format_created_at(as_of),
+        'expires': timestamps.epoch(now) + max_age
+    })
+    return plan
+
+
+def read(planner, table_aggregates, application, start, end, now, cost, max_age=MAX_AGE):
+    # Events per day from the snapshot of exactly this range, topped up with the events stored for times after it.
+    # None when there is no recent snapshot.
+    data = table_aggregates.get_item(Key={'pk': application, 'sk': key(start, end)}, ReturnConsumedCapacity='TOTAL')
+    cost['requests'] += 1
+    cost['read_units'] += float(data.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+    item = data.get('Item')
+    if item is None:
+        return None
+    as_of = timestamps.parse_created_at(item['as_of'])
+    if as_of < now - datetime.timedelta(seconds=max_age):
+        return None
+
+    counts = {day: int(events) for day, events in item['counts'].items()}
+    for day_start, day_end in timestamps.day_ranges(as_of + datetime.timedelta(seconds=1), end):
+        events = planner.count(application, day_start, day_end, cost)
+        if events:
+            name = timestamps.day(day_start)
+            counts[name] = counts.get(name, 0) + events
+    return counts
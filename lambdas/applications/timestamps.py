@@ -0,0 +1,123 @@
+import datetime
+import re
+
+from dateutil import tz
+
+# Items are stamped with $context.requestTime which uses the Common Log Format (dd/MMM/yyyy:HH:mm:ss +-hhmm).
+# https://httpd.apache.org/docs/1.3/logs.html#common
+CLF_FORMAT = '%d/%b/%Y:%H:%M:%S'
+
+# Length of the date and time part of a created_at value, without the offset.
+CLF_LENGTH = 20
+
+# Format used for day buckets (YYYY-mm-dd).
+DAY_FORMAT = '%Y-%m-%d'
+
+# Format used for hour buckets (YYYY-mm-ddTHH).
+HOUR_FORMAT = '%Y-%m-%dT%H'
+
+# IANA time zone names and POSIX TZ strings, anything read from a path is refused.
+ZONE_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_+\-]*(/[A-Za-z0-9_+\-]+)*$')
+
+# Format of request times, dates can also be given with a time (YYYY-mm-ddTHH:MM).
+TIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+# Request dates and times, the same pattern as the POST request model.
+DATE_PATTERN = re.compile(r'^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])(T([01][0-9]|2[0-3]):[0-5][0-9])?$')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Sorts after the separator and any id of an event.
+ID_BOUND = '#~'
+
+
+def parse_request_date(value, end=False):
+    # A date covers the whole day and a time the whole minute, ends are inclusive.
+    if 'T' in value:
+        date = datetime.datetime.strptime(value, TIME_FORMAT)
+        return date.replace(second=59, microsecond=999999) if end else date
+
+    date = datetime.datetime.strptime(value, DAY_FORMAT)
+    return date.replace(hour=23, minute=59, second=59, microsecond=999999) if end else date
+
+
+def parse_created_at(created_at):
+    # Only read the date and time, everything is stored as +0000.
+    return datetime.datetime.strptime(created_at[:CLF_LENGTH], CLF_FORMAT)
+
+
+def format_created_at(date):
+    return date.strftime(CLF_FORMAT) + ' +0000'
+
+
+def created_at_bound(date):
+    # Events are stored as created_at#id, the eventId or the request id, so events of an application in the same
+    # second don't overwrite each other. Inclusive upper bounds of ranges sort after every id of their last second,
+    # ids are letters, digits, - and _. Events stored before ids were added have no suffix and sort first.
+    return format_created_at(date) + ID_BOUND
+
+
+def day(date):
+    return date.strftime(DAY_FORMAT)
+
+
+def hour(date):
+    return date.strftime(HOUR_FORMAT)
+
+
+def epoch(date):
+    # Seconds since the epoch of a UTC time.
+    return int((date - EPOCH).total_seconds())
+
+
+def days(start, end):
+    # Every day bucket between two dates, both inclusive.
+    current = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    buckets = []
+    while current <= end:
+        buckets.append(day(current))
+        current += datetime.timedelta(days=1)
+    return buckets
+
+
+def day_ranges(start, end):
+    # The part of each day between two dates, as (start, end) pairs.
+    ranges = []
+    current = start
+    while current <= end:
+        day_end = current.replace(hour=23, minute=59, second=59, microsecond=999999)
+        ranges.append((current, min(day_end, end)))
+        current = day_end + datetime.timedelta(microseconds=1)
+    return ranges
+
+
+def zone(name):
+    # A time zone like Europe/Amsterdam or Asia/Kathmandu.
+    if not ZONE_PATTERN.match(name):
+        raise ValueError(name)
+    found = tz.gettz(name)
+    if found is None:
+        raise ValueError(name)
+    return found
+
+
+def to_utc(local, zone):
+    # Local times skipped by a DST change are moved forward, repeated ones are read as the first of the two.
+    aware = tz.resolve_imaginary(local.replace(tzinfo=zone))
+    return aware.astimezone(tz.UTC).replace(tzinfo=None)
+
+
+def local_day_ranges(start, end, zone):
+    # The part of each local day between two local times, as (YYYY-mm-dd, UTC start, UTC end) both inclusive. Days
+    # around DST changes are 23 or 25 hours long.
+    ranges = []
+    current = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while current <= end:
+        following = current + datetime.timedelta(days=1)
+        ranges.append((
+            day(current),
+            to_utc(max(start, current), zone),
+            min(to_utc(end, zone), to_utc(following, zone) - datetime.timedelta(microseconds=1))
+        ))
+        current = following
+    return ranges
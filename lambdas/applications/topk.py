@@ -0,0 +1,72 @@
+import json
+import zlib
+
+# Counters kept per summary. Any value seen more than total / capacity times is guaranteed to be kept.
+DEFAULT_CAPACITY = 100
+
+
+class SpaceSaving(object):
+    # Space-Saving heavy hitters (Metwally et al. 2005) in bounded memory, whatever the number of distinct values.
+    # Counts are upper bounds, the true count is at least count - error.
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+
+    def add(self, value, count=1):
+        self.total += count
+
+        if value in self.counters:
+            self.counters[value][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = [count, 0]
+        else:
+            # Replace the smallest counter, the new value may have been counted there before.
+            smallest = min(self.counters, key=lambda key: self.counters[key][0])
+            minimum = self.counters.pop(smallest)[0]
+            self.counters[value] = [minimum + count, minimum]
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def _minimum(self):
+        # Values missing from a full summary may have been counted up to its smallest counter.
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, error in self.counters.values())
+
+    def merge(self, other):
+        # Mergeable summaries (Agarwal et al. 2012), keeps the largest counters of both.
+        own_minimum = self._minimum()
+        other_minimum = other._minimum()
+
+        merged = {}
+        for value in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(value, (own_minimum, own_minimum))
+            other_count, other_error = other.counters.get(value, (other_minimum, other_minimum))
+            merged[value] = [count + other_count, error + other_error]
+
+        largest = sorted(merged.items(), key=lambda pair: pair[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(largest)
+        self.total += other.total
+
+    def top(self, n):
+        largest = sorted(self.counters.items(), key=lambda pair: (-pair[1][0], pair[0]))[:n]
+        return [{'value': value, 'count': count, 'error': error} for value, (count, error) in largest]
+
+    def to_bytes(self):
+        return zlib.compress(json.dumps({
+            'capacity': self.capacity,
+            'total': self.total,
+            'counters': self.counters,
+        }, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+        summary = cls(capacity=values['capacity'])
+        summary.total = values['total']
+        summary.counters = values['counters']
+        return summary
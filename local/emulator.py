@@ -0,0 +1,597 @@
+import argparse
+import datetime
+import decimal
+import gzip
+import importlib
+import json
+import logging
+import os
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.types import TypeSerializer
+
+import cache
+from local import resp
+from local.storage import MemoryS3
+from local.table import MemoryDynamoDB
+
+# [ API Gateway ] Models
+#
+# - Mirrors the request models of ApplicationmetricsStack, the unit tests compare them with the synthesized template.
+
+PUT_REQUEST_MODEL = {
+    '$schema': 'http://json-schema.org/draft-04/schema#',
+    'title': 'PUTRequestModel',
+    'type': 'object',
+    'properties': {
+        'application': {'type': 'string', 'minLength': 1},
+        'operation': {'type': 'string', 'minLength': 1},
+        'currentMediaTime': {'type': 'number', 'minLength': 1},
+        'eventTime': {'type': 'integer', 'minimum': 0},
+        'eventId': {'type': 'string', 'pattern': '^[A-Za-z0-9_-]{1,64}$'},
+    },
+    'required': ['application', 'operation', 'currentMediaTime'],
+    'dependencies': {'eventId': ['eventTime']},
+}
+
+DATE_PATTERN = '^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])(T([01][0-9]|2[0-3]):[0-5][0-9])?$'
+
+POST_REQUEST_MODEL = {
+    '$schema': 'http://json-schema.org/draft-04/schema#',
+    'title': 'POSTRequestModel',
+    'type': 'object',
+    'properties': {
+        'startDate': {'type': 'string', 'pattern': DATE_PATTERN},
+        'endDate': {'type': 'string', 'pattern': DATE_PATTERN},
+        'application': {'type': 'string', 'minLength': 1},
+        'metric': {'type': 'string', 'enum': ['events', 'unique_sources', 'media_time', 'top_source_ips',
+                                              'top_user_agents', 'lateness', 'top_applications', 'sessions']},
+        'operation': {'type': 'string', 'minLength': 1},
+        'top': {'type': 'integer', 'minimum': 1, 'maximum': 100},
+        'approximate': {'type': 'boolean'},
+        'timezone': {'type': 'string', 'minLength': 1},
+        'format': {'type': 'string', 'enum': ['json', 'columnar']},
+        'export': {'type': 'boolean'},
+        'granularity': {'type': 'string', 'enum': ['day', 'hour']},
+        'compare': {
+            'type': 'array',
+            'minItems': 1,
+            'maxItems': 4,
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'pattern': '^[A-Za-z0-9_-]{1,32}$'},
+                    'startDate': {'type': 'string', 'pattern': DATE_PATTERN},
+                    'endDate': {'type': 'string', 'pattern': DATE_PATTERN},
+                },
+                'required': ['name', 'startDate', 'endDate'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['startDate', 'endDate'],
+}
+
+# [ API Gateway ] Integration responses
+#
+# - Selection patterns in the order they are declared. The PUT patterns match the DynamoDB status code, the POST
+#   patterns match the Lambda error message. Java patterns must match the whole value.
+
+PUT_SELECTION_PATTERNS = [
+    ('.*400.*', 400),
+    ('.*401.*', 401),
+    ('.*403.*', 403),
+    ('.*404.*', 404),
+    ('.*413.*', 413),
+    ('.*429.*', 429),
+    ('5\\d{2}', 500),
+]
+
+POST_SELECTION_PATTERNS = [
+    ('.*ValidationException.*', 400),
+    ('(\n|.)+', 500),
+]
+
+# Response body of every failed integration, except validation errors of the Lambda.
+FAIL_RESPONSE = {'state': 'Fail', 'message': 'Error, please contact the admin.'}
+
+# Response body of a PUT of an event already stored, which fails the condition of the PutItem.
+DUPLICATE_RESPONSE = {'state': 'Duplicate', 'message': 'Event already stored.'}
+
+# Response body when the request validator rejects a body.
+INVALID_BODY_RESPONSE = {'message': 'Invalid request body'}
+
+# Response bodies when a request has no valid API key, or is over the limits of its usage plan or the stage.
+FORBIDDEN_RESPONSE = {'message': 'Forbidden'}
+THROTTLED_RESPONSE = {'message': 'Too Many Requests'}
+
+JSON_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+}
+
+
+def validate(schema, value):
+    # The subset of JSON schema draft 4 used by the models.
+    expected = schema.get('type')
+    if expected in ['number', 'integer']:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        if expected == 'integer' and value != int(value):
+            return False
+    elif expected is not None and not isinstance(value, JSON_TYPES[expected]):
+        return False
+
+    if 'enum' in schema and value not in schema['enum']:
+        return False
+
+    if isinstance(value, str):
+        if len(value) < schema.get('minLength', 0) or len(value) > schema.get('maxLength', len(value)):
+            return False
+        if 'pattern' in schema and not re.search(schema['pattern'], value):
+            return False
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value < schema.get('minimum', value) or value > schema.get('maximum', value):
+            return False
+
+    if isinstance(value, list):
+        if len(value) < schema.get('minItems', 0) or len(value) > schema.get('maxItems', len(value)):
+            return False
+        if 'items' in schema and not all(validate(schema['items'], child) for child in value):
+            return False
+
+    if isinstance(value, dict):
+        if any(name not in value for name in schema.get('required', [])):
+            return False
+        for name, required in schema.get('dependencies', {}).items():
+            if name in value and any(other not in value for other in required):
+                return False
+        for name, child in schema.get('properties', {}).items():
+            if name in value and not validate(child, value[name]):
+                return False
+        if schema.get('additionalProperties') is False and any(name not in schema.get('properties', {})
+                                                                for name in value):
+            return False
+
+    return True
+
+
+def select(patterns, value):
+    for pattern, status in patterns:
+        if re.fullmatch(pattern, value):
+            return status
+    return None
+
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# Defaults of the event time window of the stack, in seconds.
+MAX_EVENT_LATENESS = 7 * 24 * 3600
+MAX_EVENT_LEAD = 300
+
+# Defaults of the query limits of the stack, in days.
+MAX_RANGE_DAYS = 731
+MAX_BUCKETS = 400
+
+
+def request_time(now):
+    # $context.requestTime
+    return now.strftime('%d/%b/%Y:%H:%M:%S') + ' +0000'
+
+
+def event_time(epoch_ms):
+    # Mirrors the integer arithmetic of the event time template, in Common Log Format.
+    seconds = epoch_ms // 1000
+    z = seconds // 86400 + 719468
+    second = seconds % 86400
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    year = yoe + era * 400 + (1 if month <= 2 else 0)
+    return '{:02d}/{}/{}:{:02d}:{:02d}:{:02d} +0000'.format(day, MONTHS[month - 1], year, second // 3600,
+                                                            second % 3600 // 60, second % 60)
+
+
+def path_value(body, name):
+    # $input.path('$').name renders missing values as empty strings.
+    value = body.get(name)
+    return '' if value is None else value
+
+
+def map_put(body, context, max_event_lateness=MAX_EVENT_LATENESS, max_event_lead=MAX_EVENT_LEAD):
+    # Mirrors the PutItem request template. Event times outside the window leave the sort key empty, others are
+    # suffixed with the eventId or the request id.
+    item = {
+        'application': path_value(body, 'application'),
+        'operation': path_value(body, 'operation'),
+        'application_operation': '{}#{}'.format(path_value(body, 'application'), path_value(body, 'operation')),
+        'current_media_time': decimal.Decimal(str(body['currentMediaTime'])),
+        'source_ip': context['sourceIp'],
+        'user_agent': context['userAgent'],
+        'created_at': request_time(context['requestTime']),
+    }
+    if body.get('eventTime') is not None:
+        epoch = datetime.datetime(1970, 1, 1)
+        request_epoch = int((context['requestTime'] - epoch).total_seconds() * 1000)
+        lateness = request_epoch - body['eventTime']
+        if lateness > max_event_lateness * 1000 or lateness < -max_event_lead * 1000:
+            item['created_at'] = ''
+        else:
+            item['created_at'] = event_time(body['eventTime'])
+        item['received_at'] = request_time(context['requestTime'])
+        item['lateness_ms'] = lateness
+    if item['created_at']:
+        item['created_at'] += '#' + (body.get('eventId') or context['requestId'])
+    return item
+
+
+def map_post(body, headers=None):
+    # Mirrors the Lambda request template.
+    return {
+        'start_date': path_value(body, 'startDate'),
+        'end_date': path_value(body, 'endDate'),
+        'application': path_value(body, 'application'),
+        'metric': path_value(body, 'metric'),
+        'operation': path_value(body, 'operation'),
+        'top': str(path_value(body, 'top')),
+        # Booleans are rendered in lower case.
+        'approximate': str(path_value(body, 'approximate')).lower(),
+        'timezone': path_value(body, 'timezone'),
+        'format': path_value(body, 'format'),
+        'export': str(path_value(body, 'export')).lower(),
+        'granularity': path_value(body, 'granularity'),
+        # $input.json('$.compare'), escaped into a string.
+        'compare': json.dumps(body['compare']) if 'compare' in body else '',
+        'profile': (headers or {}).get('X-Profile') or '',
+    }
+
+
+class LambdaContext(object):
+
+    def __init__(self, function_name, timeout=3):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 128
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int(max(self.deadline - time.time(), 0) * 1000)
+
+
+class TokenBucket(object):
+    # Throttling of API Gateway, rate requests a second on average with bursts of up to burst requests.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Emulator(object):
+    # The API mappings, a DynamoDB stand-in and both Lambda functions in one process. The functions keep their
+    # clients in module globals, so only one emulator should be used per process.
+
+    def __init__(self, stream=True, max_event_lateness=MAX_EVENT_LATENESS, max_event_lead=MAX_EVENT_LEAD,
+                 api_keys=None, throttles=None, minimum_compression_size=None, record=None, cache=None, max_range_days=MAX_RANGE_DAYS,
+                 max_buckets=MAX_BUCKETS, profile_on_request=False):
+        self.stream = stream
+        # Requests with an X-Profile: true header are profiled, like profile_on_request of the stack.
+        self.profile_on_request = profile_on_request
+        self.max_range_days = max_range_days
+        self.max_buckets = max_buckets
+        # Queries refused by the request validator and by the read function, like the metric filters of the stack.
+        self.rejected = {'model': 0, 'function': 0}
+        # Backend of the shared cache of daily counts (cache.RedisBackend or cache.MemoryBackend), none by default.
+        self.cache = cache
+        # Stream batches are written to this file as JSON lines, local/replay.py handles them again.
+        self.record = record
+        # Bodies of at least this many bytes are gzipped when the client accepts it, never without a size.
+        self.minimum_compression_size = minimum_compression_size
+        self.max_event_lateness = max_event_lateness
+        self.max_event_lead = max_event_lead
+        self.dynamodb = MemoryDynamoDB()
+        self.table = self.dynamodb.create_table('events', 'application', 'created_at')
+        self.table.add_index('operation', 'application_operation', 'created_at')
+        self.table_aggregates = self.dynamodb.create_table('aggregates', 'pk', 'sk')
+        self.s3 = MemoryS3()
+        self.export_bucket = 'exports'
+        self.serializer = TypeSerializer()
+        # Records of a shard are handled by one invocation at a time, the stream function never runs concurrently
+        # with itself for the same keys.
+        self.stream_lock = threading.Lock()
+        # Sequence numbers of the stream records, in the order they are handled like those of a shard.
+        self.sequence = 0
+
+        # Usage plan limits of each API key ({'rate_limit': ..., 'burst_limit': ...}) and stage throttles per
+        # method ({'/applications/PUT': {...}}), like the stack. Without keys every request is let through.
+        self.api_keys = None if api_keys is None else {
+            key: TokenBucket(limits['rate_limit'], limits['burst_limit']) for key, limits in api_keys.items()}
+        self.throttles = {path: TokenBucket(limits['rate_limit'], limits['burst_limit'])
+                          for path, limits in (throttles or {}).items()}
+
+        # The functions read their configuration when imported.
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+        os.environ['TABLE_NAME'] = self.table.name
+        os.environ['AGGREGATES_TABLE_NAME'] = self.table_aggregates.name
+        os.environ['EXPORT_BUCKET_NAME'] = self.export_bucket
+
+        self.function_post = self._load('function_post')
+        self.function_stream = self._load('function_stream')
+        self.function_snapshot = self._load('function_snapshot')
+
+    def _load(self, name):
+        module = importlib.import_module(name)
+        module.dynamodb = self.dynamodb
+        module.table = self.table
+        module.table_aggregates = self.table_aggregates
+        if hasattr(module, 'dictionary'):
+            module.dictionary.dynamodb = self.dynamodb
+            module.dictionary.table = self.table_aggregates
+        if hasattr(module, 'planner'):
+            module.planner.table = self.table
+            module.planner.table_aggregates = self.table_aggregates
+            module.planner.cache.clear()
+        if hasattr(module, 'span_planners'):
+            module.span_planners = module.queue.LifoQueue()
+            module.new_resource = lambda: self.dynamodb
+        if hasattr(module, 's3'):
+            module.s3 = self.s3
+            module.EXPORT_BUCKET = self.export_bucket
+        if hasattr(module, 'MAX_RANGE_DAYS'):
+            module.MAX_RANGE_DAYS = self.max_range_days
+            module.MAX_BUCKETS = self.max_buckets
+        if hasattr(module, 'profiler'):
+            module.profiler = module.profiling.from_environment(self.s3, self.export_bucket)
+            module.profiler.on_request = self.profile_on_request
+        if hasattr(module, 'window_counter'):
+            module.window_counter = module.snapshots.WindowCounter()
+        if hasattr(module, 'counts_cache'):
+            module.counts_cache = module.cache.ReadThroughCache(self.cache) if self.cache is not None else None
+            module.MAX_EVENT_LATENESS = self.max_event_lateness
+        return module
+
+    def admit(self, method, path, api_key):
+        # The API key and throttles are checked before the body, None when the request is let through.
+        if self.api_keys is not None:
+            if api_key not in self.api_keys:
+                return 403, FORBIDDEN_RESPONSE
+            if not self.api_keys[api_key].take():
+                return 429, THROTTLED_RESPONSE
+        throttle = self.throttles.get(path + '/' + method)
+        if throttle is not None and not throttle.take():
+            return 429, THROTTLED_RESPONSE
+        return None
+
+    def put(self, body, source_ip='127.0.0.1', user_agent='', now=None):
+        if not isinstance(body, dict) or not validate(PUT_REQUEST_MODEL, body):
+            return 400, INVALID_BODY_RESPONSE
+
+        item = map_put(body, {
+            'sourceIp': source_ip,
+            'userAgent': user_agent,
+            'requestTime': now or datetime.datetime.utcnow(),
+            'requestId': str(uuid.uuid4()),
+        }, self.max_event_lateness, self.max_event_lead)
+
+        try:
+            self.table.put_item(Item=item, ConditionExpression=Attr('created_at').not_exists())
+        except Exception as e:
+            # Like the 400 response template, duplicates are answered as stored.
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return 200, DUPLICATE_RESPONSE
+            status = select(PUT_SELECTION_PATTERNS, str(getattr(e, 'response', {}).get('ResponseMetadata', {})
+                                                        .get('HTTPStatusCode', 500)))
+            return status or 200, FAIL_RESPONSE
+
+        # The stream is invoked synchronously, so aggregates are up to date when the request returns.
+        if self.stream:
+            self.invoke_stream([{
+                'eventName': 'INSERT',
+                'dynamodb': {'NewImage': {name: self.serializer.serialize(value) for name, value in item.items()}}
+            }])
+
+        return 200, {'state': 'Success', 'message': 'Updated items.'}
+
+    def invoke_stream(self, records):
+        # Batches are recorded before they are handled, so failing ones can be replayed too. Replayed records keep
+        # their sequence numbers.
+        with self.stream_lock:
+            for record in records:
+                if 'SequenceNumber' not in record['dynamodb']:
+                    self.sequence += 1
+                    record['dynamodb']['SequenceNumber'] = str(self.sequence)
+                else:
+                    self.sequence = max(self.sequence, int(record['dynamodb']['SequenceNumber']))
+            if self.record is not None:
+                self.record.write(json.dumps({'Records': records}) + '\n')
+                self.record.flush()
+            self.function_stream.handler({'Records': records}, LambdaContext('stream'))
+
+    def invoke_snapshot(self):
+        # The scheduled run of the snapshot function, the windows counted by the read function are written first.
+        self.function_post.window_counter.flush(self.table_aggregates)
+        return self.function_snapshot.handler({}, LambdaContext('snapshot'))
+
+    def post(self, body, headers=None):
+        if not isinstance(body, dict) or not validate(POST_REQUEST_MODEL, body):
+            self.rejected['model'] += 1
+            return 400, INVALID_BODY_RESPONSE
+
+        try:
+            result = self.function_post.handler(map_post(body, headers), LambdaContext('post'))
+        except Exception as e:
+            message = str(e)
+            status = select(POST_SELECTION_PATTERNS, message)
+            if status == 400:
+                self.rejected['function'] += 1
+                return status, {'state': 'Fail', 'message': json.loads(message)['message']}
+            return status or 500, FAIL_RESPONSE
+
+        return 200, json.loads(result['body'])
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, like API Gateway.
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, don't let them wait for delayed acknowledgements.
+    disable_nagle_algorithm = True
+
+    # Set on the server class by serve().
+    emulator = None
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        compress = self.emulator.minimum_compression_size is not None and \
+            len(data) >= self.emulator.minimum_compression_size and \
+            'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            data = gzip.compress(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Credentials', 'true')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8') or 'null')
+        except ValueError:
+            return None
+
+    def do_PUT(self):
+        if self.path.rstrip('/') != '/applications':
+            return self._respond(403, {'message': 'Missing Authentication Token'})
+        refused = self.emulator.admit('PUT', '/applications', self.headers.get('X-Api-Key'))
+        if refused:
+            return self._respond(*refused)
+        self._respond(*self.emulator.put(self._body(),
+                                         source_ip=self.headers.get('X-Forwarded-For', self.client_address[0]),
+                                         user_agent=self.headers.get('User-Agent', '')))
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/applications':
+            return self._respond(403, {'message': 'Missing Authentication Token'})
+        refused = self.emulator.admit('POST', '/applications', self.headers.get('X-Api-Key'))
+        if refused:
+            return self._respond(*refused)
+        self._respond(*self.emulator.post(self._body(), {'X-Profile': self.headers.get('X-Profile')}))
+
+    def do_GET(self):
+        # Exports, at the presigned URLs of the S3 stand-in.
+        bucket, _, key = self.path.lstrip('/').partition('/')
+        stored = self.emulator.s3.objects.get((bucket, key.split('?')[0]))
+        if stored is None:
+            return self._respond(403, {'message': 'Missing Authentication Token'})
+        self.send_response(200)
+        self.send_header('Content-Type', stored['ContentType'])
+        self.send_header('Content-Length', str(len(stored['Body'])))
+        self.end_headers()
+        self.wfile.write(stored['Body'])
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'OPTIONS,GET,PUT,POST,DELETE,PATCH,HEAD')
+        self.send_header('Access-Control-Allow-Headers',
+                         'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Amz-User-Agent')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(emulator, host, port):
+    handler = type('Handler', (RequestHandler,), {'emulator': emulator})
+    server = ThreadingServer((host, port), handler)
+    emulator.s3.endpoint = 'http://{}:{}'.format(host, server.server_address[1])
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the API and Lambda functions locally.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--no-stream', action='store_true', help='do not update the aggregates on PUT')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--minimum-compression-size', type=int, help='gzip bodies of at least this many bytes')
+    parser.add_argument('--api-key', action='append', help='require an API key, can be repeated')
+    parser.add_argument('--rate-limit', type=float, default=100, help='requests per second of each API key')
+    parser.add_argument('--burst-limit', type=int, default=200, help='burst of each API key')
+    parser.add_argument('--record', type=argparse.FileType('a'), help='append stream batches to this file')
+    parser.add_argument('--snapshot-interval', type=float, help='run the snapshot function every this many seconds')
+    parser.add_argument('--cache', nargs='?', const='local', help='share daily counts through a Redis protocol '
+                                                                  'server, a local stand-in without a redis:// URL')
+    parser.add_argument('--profile-on-request', action='store_true', help='profile requests with X-Profile: true')
+    arguments = parser.parse_args()
+
+    api_keys = None
+    if arguments.api_key:
+        api_keys = {key: {'rate_limit': arguments.rate_limit, 'burst_limit': arguments.burst_limit}
+                    for key in arguments.api_key}
+    backend = None
+    if arguments.cache == 'local':
+        cache_server = resp.serve(arguments.host)
+        backend = cache.RedisBackend(*cache_server.server_address)
+        print('Cache on redis://{}:{}'.format(*cache_server.server_address))
+    elif arguments.cache:
+        backend = cache.from_url(arguments.cache)
+    emulator = Emulator(stream=not arguments.no_stream, api_keys=api_keys,
+                        minimum_compression_size=arguments.minimum_compression_size, record=arguments.record,
+                        cache=backend, profile_on_request=arguments.profile_on_request)
+    # The functions set the root logger to INFO when imported.
+    logging.getLogger().setLevel(arguments.log_level)
+
+    if arguments.snapshot_interval:
+        def snapshot():
+            while True:
+                time.sleep(arguments.snapshot_interval)
+                emulator.invoke_snapshot()
+
+        threading.Thread(target=snapshot, daemon=True).start()
+
+    server = serve(emulator, arguments.host, arguments.port)
+    print('Listening on http://{}:{}/applications'.format(arguments.host, arguments.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
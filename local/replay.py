@@ -0,0 +1,75 @@
+import argparse
+import itertools
+import json
+import logging
+
+from local.emulator import Emulator
+
+
+def batches(lines, batch_size=None):
+    # Recorded batches in order, or their records regrouped in batches of batch_size like a different stream
+    # configuration would.
+    recorded = (json.loads(line)['Records'] for line in lines if line.strip())
+    if batch_size is None:
+        for records in recorded:
+            yield records
+        return
+    records = itertools.chain.from_iterable(recorded)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def replay(emulator, lines, batch_size=None):
+    # Hands the batches to the stream function of an emulator, returns the number of batches and records.
+    handled = {'batches': 0, 'records': 0}
+    for records in batches(lines, batch_size):
+        emulator.invoke_stream(records)
+        handled['batches'] += 1
+        handled['records'] += len(records)
+    return handled
+
+
+def daily_sessions(emulator):
+    # Session counters of every application and day, as the stream function left them.
+    sessions = emulator.function_stream.sessions
+    rows = []
+    for application, partition in sorted(emulator.table_aggregates.partitions.items()):
+        for sk, item in sorted(partition.items()):
+            if sk.startswith(sessions.DAILY_PREFIX):
+                rows.append(dict({name: int(item.get(name, 0)) for name in sessions.COUNTERS},
+                                 application=application, day=sk[len(sessions.DAILY_PREFIX):]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays stream batches recorded by the emulator (--record) '
+                                                 'through the stream function and prints the daily sessions.')
+    parser.add_argument('path')
+    parser.add_argument('--batch-size', type=int, help='regroup the records in batches of this size')
+    parser.add_argument('--timeout', type=int, help='seconds of inactivity ending a session')
+    args = parser.parse_args()
+
+    emulator = Emulator(stream=False)
+    # The functions set the root logger to INFO when imported.
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.timeout is not None:
+        emulator.function_stream.sessionizer.timeout = args.timeout
+
+    with open(args.path) as fp:
+        handled = replay(emulator, fp, args.batch_size)
+    print('{batches} batches, {records} records'.format(**handled))
+
+    print('{:<24} {:<10} {:>9} {:>8} {:>10} {:>6} {:>6} {:>6} {:>9} {:>6}'.format(
+        'application', 'day', 'sessions', 'events', 'avg (s)', 'play', 'pause', 'done', 'rate', 'stale'))
+    for row in daily_sessions(emulator):
+        print('{application:<24} {day:<10} {sessions:>9} {events:>8} {average:>10.1f} {play:>6} {pause:>6} '
+              '{complete:>6} {rate:>9.1%} {stale:>6}'.format(
+                  average=row['duration'] / float(row['sessions']) if row['sessions'] else 0.0,
+                  rate=row['complete'] / float(row['sessions']) if row['sessions'] else 0.0, **row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import socketserver
+import threading
+
+from cache import RELEASE_SCRIPT, MemoryBackend
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    # One connection, commands are answered in order until the client goes away.
+
+    def handle(self):
+        while True:
+            try:
+                args = self._command()
+            except ValueError:
+                return
+            if args is None:
+                return
+            self.wfile.write(self.server.execute(args))
+            self.wfile.flush()
+
+    def _command(self):
+        # Clients send commands as arrays of bulk strings.
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            raise ValueError(line)
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+        return args
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    # A Redis protocol stand-in with the commands and the script used by the read-through cache, values live in
+    # memory. Every command can be made to fail, like a server going away.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.backend = MemoryBackend()
+        self.commands = {}
+        self.failing = False
+        self.lock = threading.Lock()
+
+    def execute(self, args):
+        name = args[0].upper()
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+        if self.failing:
+            return b'-ERR unavailable\r\n'
+        if name == 'PING':
+            return b'+PONG\r\n'
+        if name in ['GET', 'MGET']:
+            values = self.backend.mget(args[1:])
+            if name == 'GET':
+                return bulk(values[0])
+            return b'*' + str(len(values)).encode('ascii') + b'\r\n' + b''.join(bulk(value) for value in values)
+        if name == 'SET':
+            options = [option.upper() for option in args[3:]]
+            ttl_ms = 365 * 86400 * 1000
+            if 'PX' in options:
+                ttl_ms = int(args[3 + options.index('PX') + 1])
+            elif 'EX' in options:
+                ttl_ms = int(args[3 + options.index('EX') + 1]) * 1000
+            if not self.backend.set(args[1], args[2], ttl_ms, only_new='NX' in options):
+                return b'$-1\r\n'
+            return b'+OK\r\n'
+        if name == 'DEL':
+            return ':{}\r\n'.format(self.backend.delete(args[1:])).encode('ascii')
+        if name == 'EVAL':
+            # Only the script releasing the locks of the cache, there is no Lua here.
+            if args[1] != RELEASE_SCRIPT:
+                return b'-ERR unknown script\r\n'
+            keys = args[3:3 + int(args[2])]
+            return ':{}\r\n'.format(self.backend.delete_if(keys, args[3 + int(args[2])])).encode('ascii')
+        if name == 'FLUSHALL':
+            self.backend.delete(list(self.backend.values))
+            return b'+OK\r\n'
+        return "-ERR unknown command '{}'\r\n".format(args[0]).encode('utf-8')
+
+
+def bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    data = value.encode('utf-8')
+    return b'$' + str(len(data)).encode('ascii') + b'\r\n' + data + b'\r\n'
+
+
+def serve(host='127.0.0.1', port=0):
+    # Starts a server in a background thread, port 0 picks a free one.
+    server = RespServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a Redis protocol stand-in for the read-through cache.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    server = RespServer((args.host, args.port))
+    print('Listening on redis://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+import uuid
+
+from botocore.exceptions import ClientError
+
+# Every part of a multipart upload but the last is at least this large.
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def error(code, message, operation, status=400):
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'HTTPStatusCode': status}
+    }, operation)
+
+
+class MemoryS3(object):
+    # An S3 client stand-in with the calls used by exports. Presigned URLs point at the emulator, which serves
+    # objects on GET /{bucket}/{key}.
+
+    def __init__(self, endpoint='http://127.0.0.1:8080'):
+        self.endpoint = endpoint
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType='binary/octet-stream'):
+        with self.lock:
+            self.objects[(Bucket, Key)] = {'Body': bytes(Body), 'ContentType': ContentType}
+        return {'ETag': '"{}"'.format(hashlib.md5(Body).hexdigest())}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise error('NoSuchKey', 'The specified key does not exist.', 'GetObject', 404)
+        return dict(self.objects[(Bucket, Key)])
+
+    def create_multipart_upload(self, Bucket, Key, ContentType='binary/octet-stream'):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'ContentType': ContentType, 'Parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if UploadId not in self.uploads:
+            raise error('NoSuchUpload', 'The specified upload does not exist.', 'UploadPart', 404)
+        etag = '"{}"'.format(hashlib.md5(Body).hexdigest())
+        self.uploads[UploadId]['Parts'][PartNumber] = (etag, bytes(Body))
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.get(UploadId)
+        if upload is None:
+            raise error('NoSuchUpload', 'The specified upload does not exist.', 'CompleteMultipartUpload', 404)
+        parts = MultipartUpload['Parts']
+        if [part['PartNumber'] for part in parts] != sorted(part['PartNumber'] for part in parts):
+            raise error('InvalidPartOrder', 'The list of parts was not in ascending order.', 'CompleteMultipartUpload')
+        bodies = []
+        for index, part in enumerate(parts):
+            etag, body = upload['Parts'].get(part['PartNumber'], (None, None))
+            if etag != part['ETag']:
+                raise error('InvalidPart', 'One or more of the specified parts could not be found.',
+                            'CompleteMultipartUpload')
+            if index < len(parts) - 1 and len(body) < MIN_PART_SIZE:
+                raise error('EntityTooSmall', 'Your proposed upload is smaller than the minimum allowed size.',
+                            'CompleteMultipartUpload')
+            bodies.append(body)
+        with self.lock:
+            self.objects[(Bucket, Key)] = {'Body': b''.join(bodies), 'ContentType': upload['ContentType']}
+            del self.uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return '{}/{}/{}'.format(self.endpoint, Params['Bucket'], Params['Key'])
@@ -0,0 +1,437 @@
+import bisect
+import copy
+import decimal
+import math
+import re
+import threading
+
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+# Size of an item is the length of its attribute names plus their values.
+# https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/CapacityUnitCalculations.html
+READ_UNIT = 4096
+WRITE_UNIT = 1024
+
+# A query or scan returns at most 1 MB of items per page.
+PAGE_SIZE = 1024 * 1024
+
+
+def attribute_size(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, decimal.Decimal)):
+        # Numbers take about one byte per two significant digits plus one.
+        return int(math.ceil(len(str(value).replace('.', '').lstrip('-0') or '0') / 2.0)) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode('utf-8')) + attribute_size(child) + 1 for key, child in value.items())
+    return 3 + sum(attribute_size(child) + 1 for child in value)
+
+
+def item_size(item):
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def error(code, message, operation):
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'HTTPStatusCode': 400}
+    }, operation)
+
+
+def resolve(path, item):
+    # Only top level attributes are supported.
+    return item.get(path.name)
+
+
+def evaluate(condition, item):
+    # Evaluates boto3 condition objects (Key and Attr) against an item.
+    operator = condition.expression_operator
+    values = condition._values
+
+    if operator == 'AND':
+        return evaluate(values[0], item) and evaluate(values[1], item)
+    if operator == 'OR':
+        return evaluate(values[0], item) or evaluate(values[1], item)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+    if operator == 'attribute_exists':
+        return values[0].name in item
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+
+    value = resolve(values[0], item)
+    if value is None:
+        return False
+    if operator == '=':
+        return value == values[1]
+    if operator == '<>':
+        return value != values[1]
+    if operator == '<':
+        return value < values[1]
+    if operator == '<=':
+        return value <= values[1]
+    if operator == '>':
+        return value > values[1]
+    if operator == '>=':
+        return value >= values[1]
+    if operator == 'BETWEEN':
+        return values[1] <= value <= values[2]
+    if operator == 'begins_with':
+        return value.startswith(values[1])
+    if operator == 'IN':
+        return value in values[1]
+    if operator == 'contains':
+        return values[1] in value
+
+    raise NotImplementedError(operator)
+
+
+def partition_value(condition, name):
+    # The value the partition key is compared to in a key condition.
+    if condition.expression_operator == 'AND':
+        return partition_value(condition._values[0], name) or partition_value(condition._values[1], name)
+    if condition.expression_operator == '=' and condition._values[0].name == name:
+        return condition._values[1]
+    return None
+
+
+def sort_range(condition, name):
+    # The lowest and highest sort key a key condition can match, None when unbounded.
+    operator = condition.expression_operator
+    if operator == 'AND':
+        for child in condition._values:
+            bounds = sort_range(child, name)
+            if bounds != (None, None):
+                return bounds
+        return None, None
+    if condition._values[0].name != name:
+        return None, None
+    if operator == 'BETWEEN':
+        return condition._values[1], condition._values[2]
+    if operator in ['=', 'begins_with']:
+        return condition._values[1], None
+    if operator in ['>', '>=']:
+        return condition._values[1], None
+    if operator in ['<', '<=']:
+        return None, condition._values[1]
+    return None, None
+
+
+class MemoryIndex(object):
+    # A global secondary index of a MemoryTable. Indexes are sparse, items without both keys of the index are left
+    # out. Items are projected to the keys of the table and of the index, plus the attributes given, and several
+    # items can share the same index key.
+
+    def __init__(self, table, name, partition_key, sort_key, attributes=None):
+        self.table = table
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.attributes = [table.partition_key, table.sort_key, partition_key, sort_key] + list(attributes or [])
+        # Items of each partition by index sort key then table key.
+        self.partitions = {}
+        # Sorted keys and sort keys of each partition, rebuilt on the first query after a write.
+        self.sorted = {}
+
+    def _key(self, item):
+        return item[self.sort_key], item[self.table.partition_key], item[self.table.sort_key]
+
+    def _indexed(self, item):
+        return item is not None and self.partition_key in item and self.sort_key in item
+
+    def update(self, old, new):
+        if self._indexed(old):
+            self.partitions.get(old[self.partition_key], {}).pop(self._key(old), None)
+            self.sorted.pop(old[self.partition_key], None)
+        if self._indexed(new):
+            projected = {name: new[name] for name in self.attributes if name in new}
+            self.partitions.setdefault(new[self.partition_key], {})[self._key(new)] = projected
+            self.sorted.pop(new[self.partition_key], None)
+
+    def _query_items(self, kwargs):
+        condition = kwargs['KeyConditionExpression']
+        value = partition_value(condition, self.partition_key)
+        partition = self.partitions.get(value, {})
+        if value not in self.sorted:
+            keys = sorted(partition)
+            self.sorted[value] = keys, [key[0] for key in keys]
+        keys, sorts = self.sorted[value]
+
+        low, high = sort_range(condition, self.sort_key)
+        first = bisect.bisect_left(sorts, low) if low is not None else 0
+        last = bisect.bisect_right(sorts, high) if high is not None else len(sorts)
+        items = [partition[key] for key in keys[first:last]]
+        return [item for item in items if evaluate(condition, item)]
+
+    def _position(self, item):
+        return self._key(item)
+
+    def _last_key(self, item):
+        # Pages of an index continue after both the table and the index key.
+        return {name: item[name] for name in self.attributes[:4]}
+
+
+class MemoryTable(object):
+    # A DynamoDB table resource stand-in, covering the calls made by the Lambda functions.
+
+    def __init__(self, name, partition_key, sort_key):
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.partitions = {}
+        # Sorted sort keys of each partition, rebuilt on the first query after a write.
+        self.sorted = {}
+        self.indexes = {}
+        self.lock = threading.RLock()
+
+    def add_index(self, name, partition_key, sort_key, attributes=None):
+        # Keys only unless attributes are given, items stored before are indexed too.
+        index = MemoryIndex(self, name, partition_key, sort_key, attributes)
+        for partition in self.partitions.values():
+            for item in partition.values():
+                index.update(None, item)
+        self.indexes[name] = index
+        return index
+
+    def clear(self):
+        with self.lock:
+            self.partitions.clear()
+            self.sorted.clear()
+            for name, index in list(self.indexes.items()):
+                self.add_index(name, index.partition_key, index.sort_key, index.attributes[4:])
+
+    def _key(self, key):
+        return key[self.partition_key], key[self.sort_key]
+
+    def _stored(self, key):
+        partition, sort = self._key(key)
+        return self.partitions.get(partition, {}).get(sort)
+
+    def _store(self, item):
+        # Binary values are returned wrapped, like boto3 does.
+        item = {
+            name: Binary(value) if isinstance(value, (bytes, bytearray)) else value
+            for name, value in copy.deepcopy(item).items()
+        }
+        partition, sort = self._key(item)
+        old = self.partitions.get(partition, {}).get(sort)
+        self.partitions.setdefault(partition, {})[sort] = item
+        self.sorted.pop(partition, None)
+        for index in self.indexes.values():
+            index.update(old, item)
+        return item
+
+    def _check(self, kwargs, existing, operation):
+        condition = kwargs.get('ConditionExpression')
+        if condition is not None and not evaluate(condition, existing or {}):
+            raise error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    def _consumed(self, kwargs, units):
+        if kwargs.get('ReturnConsumedCapacity') in ['TOTAL', 'INDEXES']:
+            return {'ConsumedCapacity': {'TableName': self.name, 'CapacityUnits': units}}
+        return {}
+
+    def _write_units(self, item):
+        return math.ceil(item_size(item) / float(WRITE_UNIT)) if item else 1
+
+    def put_item(self, **kwargs):
+        if any(kwargs['Item'].get(name) == '' for name in [self.partition_key, self.sort_key]):
+            raise error('ValidationException', 'One or more parameter values are not valid. The AttributeValue for a '
+                                               'key attribute cannot contain an empty string value.', 'PutItem')
+        with self.lock:
+            self._check(kwargs, self._stored(kwargs['Item']), 'PutItem')
+            item = self._store(kwargs['Item'])
+            return self._consumed(kwargs, self._write_units(item))
+
+    def get_item(self, **kwargs):
+        with self.lock:
+            item = self._stored(kwargs['Key'])
+            units = math.ceil(item_size(item or {}) / float(READ_UNIT)) or 1
+            response = self._consumed(kwargs, units if kwargs.get('ConsistentRead') else units * 0.5)
+            if item is not None:
+                response['Item'] = copy.deepcopy(item)
+            return response
+
+    def delete_item(self, **kwargs):
+        with self.lock:
+            existing = self._stored(kwargs['Key'])
+            self._check(kwargs, existing, 'DeleteItem')
+            if existing is not None:
+                partition, sort = self._key(kwargs['Key'])
+                del self.partitions[partition][sort]
+                self.sorted.pop(partition, None)
+                for index in self.indexes.values():
+                    index.update(existing, None)
+            return self._consumed(kwargs, self._write_units(existing))
+
+    def update_item(self, **kwargs):
+        with self.lock:
+            existing = self._stored(kwargs['Key'])
+            self._check(kwargs, existing, 'UpdateItem')
+
+            item = copy.deepcopy(existing) if existing is not None else dict(kwargs['Key'])
+            apply_update(item, kwargs['UpdateExpression'], kwargs.get('ExpressionAttributeValues', {}),
+                         kwargs.get('ExpressionAttributeNames', {}))
+            item = self._store(item)
+
+            response = self._consumed(kwargs, self._write_units(item))
+            if kwargs.get('ReturnValues') == 'ALL_NEW':
+                response['Attributes'] = copy.deepcopy(item)
+            return response
+
+    def _query_items(self, kwargs):
+        condition = kwargs['KeyConditionExpression']
+        value = partition_value(condition, self.partition_key)
+        partition = self.partitions.get(value, {})
+        if value not in self.sorted:
+            self.sorted[value] = sorted(partition)
+        keys = self.sorted[value]
+
+        # Only the keys within the bounds of the sort key condition are evaluated.
+        low, high = sort_range(condition, self.sort_key)
+        first = bisect.bisect_left(keys, low) if low is not None else 0
+        last = bisect.bisect_right(keys, high) if high is not None else len(keys)
+        items = [partition[sort] for sort in keys[first:last]]
+        return [item for item in items if evaluate(condition, item)]
+
+    def _position(self, item):
+        return self._key(item)
+
+    def _last_key(self, item):
+        return {self.partition_key: item[self.partition_key], self.sort_key: item[self.sort_key]}
+
+    def query(self, **kwargs):
+        with self.lock:
+            source = self
+            if kwargs.get('IndexName') is not None:
+                if kwargs['IndexName'] not in self.indexes:
+                    raise error('ValidationException', 'The table does not have the specified index: {}'.format(
+                        kwargs['IndexName']), 'Query')
+                source = self.indexes[kwargs['IndexName']]
+            items = source._query_items(kwargs)
+            if not kwargs.get('ScanIndexForward', True):
+                items.reverse()
+
+            # Continue after the last key of the previous page.
+            start = kwargs.get('ExclusiveStartKey')
+            if start is not None:
+                last = source._position(start)
+                if kwargs.get('ScanIndexForward', True):
+                    items = [item for item in items if source._position(item) > last]
+                else:
+                    items = [item for item in items if source._position(item) < last]
+
+            # Pages end at the limit or at 1 MB of items read.
+            page = []
+            size = 0
+            for item in items:
+                if len(page) == kwargs.get('Limit', len(items)) or size >= PAGE_SIZE:
+                    break
+                page.append(item)
+                size += item_size(item)
+
+            scanned = len(page)
+            if kwargs.get('FilterExpression') is not None:
+                page_filtered = [item for item in page if evaluate(kwargs['FilterExpression'], item)]
+            else:
+                page_filtered = page
+
+            units = math.ceil(size / float(READ_UNIT)) or 1
+            response = self._consumed(kwargs, units if kwargs.get('ConsistentRead') else units * 0.5)
+            response['Count'] = len(page_filtered)
+            response['ScannedCount'] = scanned
+
+            if kwargs.get('Select') != 'COUNT':
+                names = kwargs.get('ProjectionExpression')
+                if names:
+                    names = [kwargs.get('ExpressionAttributeNames', {}).get(name.strip(), name.strip())
+                             for name in names.split(',')]
+                    response['Items'] = [{name: copy.deepcopy(item[name]) for name in names if name in item}
+                                         for item in page_filtered]
+                else:
+                    response['Items'] = copy.deepcopy(page_filtered)
+
+            if len(page) < len(items):
+                response['LastEvaluatedKey'] = source._last_key(page[-1])
+            return response
+
+    def load(self, items):
+        # Bulk load without conditions, for benchmarks and tests.
+        with self.lock:
+            for item in items:
+                self._store(item)
+
+    def count(self):
+        return sum(len(partition) for partition in self.partitions.values())
+
+
+# SET a = :v, SET a = if_not_exists(a, :v), SET a = a + :v, ADD a :v and REMOVE a, b.
+CLAUSE = re.compile(r'\b(SET|REMOVE|ADD)\b')
+
+# Commas between assignments, not those between the arguments of a function.
+SEPARATOR = re.compile(r',(?![^(]*\))')
+
+
+def apply_update(item, expression, values, names):
+    parts = CLAUSE.split(expression)
+    for action, body in zip(parts[1::2], parts[2::2]):
+        for assignment in [part.strip() for part in SEPARATOR.split(body) if part.strip()]:
+            if action == 'REMOVE':
+                item.pop(names.get(assignment, assignment), None)
+            elif action == 'ADD':
+                name, value = assignment.split()
+                name = names.get(name, name)
+                value = values[value]
+                if isinstance(value, set):
+                    item[name] = item.get(name, set()) | value
+                else:
+                    item[name] = item.get(name, 0) + value
+            else:
+                name, value = [part.strip() for part in assignment.split('=', 1)]
+                item[names.get(name, name)] = update_value(item, value, values, names)
+
+
+def update_value(item, value, values, names):
+    match = re.match(r'if_not_exists\((\S+),\s*(\S+)\)$', value)
+    if match:
+        name = names.get(match.group(1), match.group(1))
+        return item[name] if name in item else values[match.group(2)]
+
+    if '+' in value:
+        left, right = [update_value(item, part.strip(), values, names) for part in value.split('+', 1)]
+        return left + right
+
+    if value.startswith(':'):
+        return values[value]
+    return item[names.get(value, value)]
+
+
+class MemoryDynamoDB(object):
+    # A DynamoDB service resource stand-in.
+
+    def __init__(self):
+        self.tables = {}
+
+    def create_table(self, name, partition_key, sort_key):
+        self.tables[name] = MemoryTable(name, partition_key, sort_key)
+        return self.tables[name]
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            responses[name] = [
+                item for item in (table.get_item(Key=key).get('Item') for key in request['Keys'])
+                if item is not None
+            ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
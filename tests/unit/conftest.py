@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Lambda functions are deployed from a flat asset directory, import their modules the same way.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambdas', 'applications'))
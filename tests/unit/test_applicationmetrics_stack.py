@@ -29,3 +29,72 @@ def test_api_gateway_rest_api_created():
 
 def test_api_gateway_request_validator_created():
     assert ("AWS::ApiGateway::RequestValidator" in get_template())
+
+
+def test_dynamo_db_stream_created():
+    assert ("StreamSpecification" in get_template())
+
+
+def test_lambda_event_source_mapping_created():
+    assert ("AWS::Lambda::EventSourceMapping" in get_template())
+
+
+def test_lambda_function_environment_for_aggregates_table_created():
+    assert ("AGGREGATES_TABLE_NAME" in get_template())
+
+
+def test_lambda_function_environment_for_compact_user_agents_created():
+    app = core.App()
+    ApplicationmetricsStack(app, "applicationmetrics", compact_user_agents=True)
+    assert ("COMPACT_USER_AGENTS" in json.dumps(app.synth().get_stack("applicationmetrics").template))
+    assert ("COMPACT_USER_AGENTS" not in get_template())
+
+
+def test_lambda_function_environment_for_cache_created():
+    app = core.App()
+    ApplicationmetricsStack(app, "applicationmetrics", cache_url='redis://cache.internal:6379')
+    template = json.dumps(app.synth().get_stack("applicationmetrics").template)
+    assert ("redis://cache.internal:6379" in template)
+    assert ("CacheHits" in template)
+    assert ("CACHE_URL" not in get_template())
+
+
+def test_snapshot_schedule_created():
+    template = get_template()
+    assert ("AWS::Events::Rule" in template)
+    assert ("rate(15 minutes)" in template)
+    assert ("SNAPSHOT_WINDOWS" in template)
+
+
+def test_alarm_thresholds_follow_memory_and_timeout():
+    def thresholds(**kwargs):
+        app = core.App()
+        ApplicationmetricsStack(app, "applicationmetrics", **kwargs)
+        resources = app.synth().get_stack("applicationmetrics").template['Resources']
+        alarms = {name: resource['Properties']['Threshold'] for name, resource in resources.items()
+                  if resource['Type'] == 'AWS::CloudWatch::Alarm'}
+        functions = [resource['Properties'] for resource in resources.values()
+                     if resource['Type'] == 'AWS::Lambda::Function'
+                     and resource['Properties'].get('Handler') == 'function_post.handler']
+        return ([threshold for name, threshold in alarms.items() if name.startswith('LambdaLogMemory')][0],
+                [threshold for name, threshold in alarms.items() if name.startswith('LambdaDuration')][0],
+                functions[0]['MemorySize'], functions[0]['Timeout'])
+
+    assert thresholds() == (110, 1000, 128, 3)
+    assert thresholds(memory_size=512, timeout=6) == (440, 2000, 512, 6)
+
+
+def test_profiling_on_request_is_opt_in():
+    app = core.App()
+    ApplicationmetricsStack(app, "applicationmetrics", profile_on_request=True)
+    assert ("PROFILE_ON_REQUEST" in json.dumps(app.synth().get_stack("applicationmetrics").template))
+    assert ("PROFILE_ON_REQUEST" not in get_template())
+
+
+def test_rejected_queries_are_counted_from_the_warning_only():
+    template = json.loads(get_template())
+    patterns = [resource['Properties']['FilterPattern'] for resource in template['Resources'].values()
+                if resource['Type'] == 'AWS::Logs::MetricFilter' and
+                resource['Properties']['MetricTransformations'][0]['MetricNamespace'] == 'Lambdas' and
+                resource['Properties']['MetricTransformations'][0]['MetricName'] == 'RejectedQueries']
+    assert patterns == ['[level, timestamp, request_id, marker="rejected:", ...]']
@@ -0,0 +1,50 @@
+import datetime
+import time
+
+from approximate import sample, summarize
+from benchmarks.bench_approximate import run
+
+
+def test_census_of_every_window_is_exact():
+    start = datetime.datetime(2020, 3, 1)
+    ranges = [(start + datetime.timedelta(days=day), start + datetime.timedelta(days=day, hours=23, minutes=59,
+                                                                                  seconds=59)) for day in range(3)]
+
+    def count(window_start, window_end):
+        # One event every ten seconds.
+        seconds = int((window_end - window_start).total_seconds()) + 1
+        return (seconds + window_start.second % 10) // 10, {'requests': 1, 'read_units': 0.5}
+
+    buckets, stats = sample(count, ranges, density=8640, budget=1000, seed=1)
+    response, intervals, total = summarize(buckets)
+    assert response == {'2020-03-01': 8640, '2020-03-02': 8640, '2020-03-03': 8640}
+    assert total['interval'] == [25920, 25920]
+    assert stats['probes'] == sum(bucket.windows for bucket in buckets)
+
+
+def test_sampled_counts_are_close_and_within_budget():
+    results = run(events=100000, days=180, budget=100, latency=2, trials=3)
+    for result in results:
+        assert not result['exact']
+        assert result['elapsed'] < 300
+        assert abs(result['error']) < 0.05
+        assert result['day_coverage'] > 0.8
+
+
+def test_no_probe_outlives_the_budget():
+    start = datetime.datetime(2020, 3, 1)
+    ranges = [(start + datetime.timedelta(days=day), start + datetime.timedelta(days=day, hours=23, minutes=59,
+                                                                                  seconds=59)) for day in range(30)]
+    running = []
+
+    def count(window_start, window_end):
+        running.append(window_start)
+        time.sleep(0.02)
+        running.remove(window_start)
+        return 1, {'requests': 1, 'read_units': 0.5}
+
+    buckets, stats = sample(count, ranges, density=86400, budget=30, seed=1)
+    # Probes in flight at the deadline were waited for and counted, none is left reading.
+    assert running == []
+    assert stats['probes'] == sum(len(bucket.samples) for bucket in buckets) == stats['cost']['requests']
+    assert all(len(bucket.probed) == len(bucket.samples) for bucket in buckets)
@@ -0,0 +1,42 @@
+from benchmarks import sizing
+from benchmarks.bench_handler import run
+from benchmarks.generators import synthetic_events
+
+
+def test_synthetic_events_are_deterministic_and_skewed():
+    events = synthetic_events(5000, days=7, seed=3)
+    assert events == synthetic_events(5000, days=7, seed=3)
+    assert len(events) == 5000
+
+    applications = {}
+    for event in events:
+        applications[event['application']] = applications.get(event['application'], 0) + 1
+    assert max(applications.values()) > 5 * sorted(applications.values())[len(applications) // 2]
+
+
+def test_handler_stages_follow_the_plan():
+    result = run(2000, repeat=1, with_rollups=False)
+    assert result['strategy'] == 'count'
+    assert result['actual']['requests'] == 30
+    assert 0 < result['items'] <= result['stored']
+    assert set(result['ms']) == {'parse', 'plan', 'execute', 'serialize', 'handler'}
+
+    result = run(2000, repeat=1)
+    assert result['strategy'] == 'rollup'
+    assert result['actual'] == result['predicted']
+
+
+def test_sizing_recommends_the_cheapest_tier_meeting_the_target():
+    result = {'events': 1000, 'ms': {'handler': 20.0}, 'actual': {'requests': 3}, 'peak_kb': 40960.0}
+    assert sizing.model(result, 128, request_ms=10)['fits'] is False
+    fast = sizing.model(result, 1769, request_ms=10)
+    assert fast['latency_ms'] == 50.0 and fast['used_mb'] == sizing.RUNTIME_MB + 40
+    assert sizing.model(result, 256, request_ms=10)['latency_ms'] > fast['latency_ms']
+    assert sizing.throughput(fast['latency_ms'], 10) == 200.0
+
+    # Cheaper memory is slower, the target decides.
+    assert sizing.recommend([result], target_ms=1000, rate=20, request_ms=10)['memory_size'] == 256
+    recommendation = sizing.recommend([result], target_ms=60, rate=20, request_ms=10)
+    assert recommendation['memory_size'] == 1769
+    assert recommendation['concurrency'] == 1 and recommendation['timeout'] == sizing.MIN_TIMEOUT
+    assert sizing.recommend([result], tiers=[128]) is None
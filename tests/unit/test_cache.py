@@ -0,0 +1,198 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+import timestamps
+from cache import LOCK_PREFIX, CacheError, MemoryBackend, ReadThroughCache, RedisBackend
+from local import emulator, resp
+
+
+@pytest.fixture
+def server():
+    server = resp.serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_commands_round_trip_through_the_stand_in(server):
+    backend = RedisBackend(*server.server_address)
+    assert backend.mget(['a', 'b']) == [None, None]
+    assert backend.set('a', 1, 1000)
+    assert not backend.set('a', 2, 1000, only_new=True)
+    assert backend.set('b', 'two words', 1000, only_new=True)
+    assert backend.mget(['a', 'b', 'c']) == ['1', 'two words', None]
+    assert backend.delete(['a', 'c']) == 1
+
+    server.failing = True
+    with pytest.raises(CacheError):
+        backend.mget(['b'])
+    server.failing = False
+    assert backend.mget(['b']) == ['two words']
+
+
+def test_threads_sharing_a_connection_read_their_own_replies(server):
+    backend = RedisBackend(*server.server_address)
+    for index in range(8):
+        backend.set('key-{}'.format(index), index, 10000)
+    mixed = []
+
+    def read(index):
+        for _ in range(100):
+            values = backend.mget(['key-{}'.format(index)] * 3)
+            if values != [str(index)] * 3:
+                mixed.append(values)
+
+    threads = [threading.Thread(target=read, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert mixed == []
+
+
+def test_concurrent_misses_are_loaded_once(server):
+    loads = []
+
+    def load(keys):
+        loads.append(keys)
+        time.sleep(0.05)
+        return {key: len(key) for key in keys}
+
+    results = []
+
+    def read():
+        counts = ReadThroughCache(RedisBackend(*server.server_address))
+        results.append(counts.get_many(['events#a#2020-01-01', 'events#a#2020-01-02'], load, lambda key: 60))
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(key for keys in loads for key in keys) == ['events#a#2020-01-01', 'events#a#2020-01-02']
+    assert all(values == {'events#a#2020-01-01': 19, 'events#a#2020-01-02': 19} for values, stats in results)
+    assert sum(stats['misses'] for values, stats in results) == 2
+    assert sum(stats['hits'] + stats['coalesced'] for values, stats in results) == 14
+
+
+@pytest.mark.parametrize('remote', [False, True])
+def test_locks_taken_over_by_another_container_are_left_to_it(server, remote):
+    backend = RedisBackend(*server.server_address) if remote else MemoryBackend()
+    key = 'events#a#2020-01-01'
+
+    def load(keys):
+        # Slower than the lock, another container takes it over meanwhile.
+        time.sleep(0.05)
+        assert backend.set(LOCK_PREFIX + key, 'other', 1000, only_new=True)
+        return {key: 1 for key in keys}
+
+    values, stats = ReadThroughCache(backend, lock_ttl=10).get_many([key], load, lambda key: 60)
+    assert values == {key: 1}
+    assert stats['errors'] == 0
+    assert backend.mget([LOCK_PREFIX + key]) == ['other']
+
+    # A lock still holding the token is released.
+    values, stats = ReadThroughCache(backend).get_many(['events#a#2020-01-02'], lambda keys: {keys[0]: 2},
+                                                       lambda key: 60)
+    assert backend.mget([LOCK_PREFIX + 'events#a#2020-01-02']) == [None]
+
+
+def test_closed_days_are_cached_longer_than_open_ones():
+    backend = MemoryBackend()
+    local = emulator.Emulator(max_event_lateness=2 * 86400, cache=backend)
+    yesterday = datetime.datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0) - \
+        datetime.timedelta(days=1)
+    for now in [datetime.datetime(2020, 6, 1, 12), datetime.datetime(2020, 6, 1, 13), yesterday]:
+        assert local.put({'application': 'cached', 'operation': 'play', 'currentMediaTime': 0}, now=now)[0] == 200
+
+    for start in ['2020-06-01', timestamps.day(yesterday)]:
+        status, body = local.post({'startDate': start, 'endDate': start, 'application': 'cached'})
+        assert status == 200
+        assert sum(body['counts'].values()) == (2 if start == '2020-06-01' else 1)
+
+    now = time.time()
+    closed = backend.values['events#cached##2020-06-01'][1] - now
+    opened = backend.values['events#cached##' + timestamps.day(yesterday)][1] - now
+    assert 3500 < closed <= 3600
+    assert 0 < opened <= 10
+
+    # Served from the cache, whatever is in the tables.
+    local.table.clear()
+    assert local.post({'startDate': '2020-06-01', 'endDate': '2020-06-01',
+                       'application': 'cached'})[1]['counts'] == {'2020-06-01': 2}
+
+
+def test_reads_fall_back_to_the_tables_when_the_cache_fails(server):
+    local = emulator.Emulator(cache=RedisBackend(*server.server_address))
+    for hour in [1, 2, 25]:
+        local.put({'application': 'uncached', 'operation': 'play', 'currentMediaTime': 0},
+                  now=datetime.datetime(2020, 6, 1) + datetime.timedelta(hours=hour))
+
+    server.failing = True
+    status, body = local.post({'startDate': '2020-06-01', 'endDate': '2020-06-02', 'application': 'uncached'})
+    assert status == 200
+    assert body['counts'] == {'2020-06-01': 2, '2020-06-02': 1}
+    assert server.commands['MGET'] == 1
+
+
+class TrackedTable(object):
+    # Fails when two threads read through the same table resource at once.
+
+    def __init__(self, table, busy):
+        self.table = table
+        self.name = table.name
+        self.busy = busy
+
+    def _call(self, method, **kwargs):
+        assert id(self) not in self.busy
+        self.busy.add(id(self))
+        try:
+            time.sleep(0.001)
+            return getattr(self.table, method)(**kwargs)
+        finally:
+            self.busy.discard(id(self))
+
+    def query(self, **kwargs):
+        return self._call('query', **kwargs)
+
+    def get_item(self, **kwargs):
+        return self._call('get_item', **kwargs)
+
+
+def test_spans_of_a_comparison_are_counted_through_their_own_connections(server, monkeypatch):
+    local = emulator.Emulator(cache=RedisBackend(*server.server_address))
+    for day in range(1, 29):
+        for hour in range(0, 24, 5):
+            local.put({'application': 'compared', 'operation': 'play', 'currentMediaTime': 0},
+                      now=datetime.datetime(2020, 4, day, hour))
+
+    busy = set()
+    resources = []
+
+    class TrackedResource(object):
+        def __init__(self):
+            resources.append(self)
+
+        def Table(self, name):
+            return TrackedTable(local.dynamodb.Table(name), busy)
+
+    monkeypatch.setattr(local.function_post, 'new_resource', TrackedResource)
+    # Every range ends in the middle of a day, so the union is counted in many spans at once.
+    request = {'startDate': '2020-04-22', 'endDate': '2020-04-28T12:00', 'application': 'compared',
+               'compare': [{'name': 'week-{}'.format(week), 'startDate': '2020-04-{:02d}'.format(1 + 5 * week),
+                            'endDate': '2020-04-{:02d}T{:02d}:00'.format(5 + 5 * week, 6 + 3 * week)}
+                           for week in range(4)]}
+    for _ in range(3):
+        server.backend.delete(list(server.backend.values))
+        status, body = local.post(request)
+        assert status == 200
+        assert body['summary']['comparison']['spans'] > 4
+        for named in [request] + request['compare']:
+            assert local.post({'startDate': named['startDate'], 'endDate': named['endDate'],
+                               'application': 'compared'})[1]['counts'] == \
+                body['ranges'][named.get('name', 'current')]['counts']
+    assert 1 < len(resources) <= 8
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from client import Client, DROP_NEWEST
+
+
+def serve(statuses):
+    # An HTTP server answering each request with the next status, the last one is repeated. Returns the bodies.
+    received = []
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            length = 0
+            while True:
+                header = (await reader.readline()).decode('latin-1').strip()
+                if not header:
+                    break
+                name, value = header.split(':', 1)
+                if name.lower() == 'content-length':
+                    length = int(value)
+            received.append(json.loads((await reader.readexactly(length)).decode('utf-8')))
+            status = statuses[min(len(received), len(statuses)) - 1]
+            writer.write('HTTP/1.1 {} Status\r\nContent-Length: 2\r\n\r\n{{}}'.format(status).encode('ascii'))
+            await writer.drain()
+        writer.close()
+
+    return handle, received
+
+
+def run(statuses, send, **kwargs):
+    async def main():
+        handle, received = serve(statuses)
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        client = Client('http://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1]), backoff_base=0.001,
+                        seed=1, **kwargs)
+        client.start()
+        try:
+            await send(client)
+        finally:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+            # Let the handlers see their connections closed.
+            await asyncio.sleep(0.01)
+        return client, received
+
+    return asyncio.new_event_loop().run_until_complete(main())
+
+
+def test_events_are_flushed_by_size_and_on_close():
+    async def send(client):
+        for index in range(250):
+            client.track('application-1', 'play', index, event_time=1600000000000 + index)
+        # Two full batches go out at once, the rest waits for the timer or close.
+        assert len(client.buffer) == 50
+
+    client, received = run([200], send, batch_size=100, flush_interval=60)
+    assert client.stats['sent'] == 250
+    assert sorted(body['currentMediaTime'] for body in received) == list(range(250))
+    event_id = received[0].pop('eventId')
+    assert received[0] == {'application': 'application-1', 'operation': 'play', 'currentMediaTime': 0,
+                           'eventTime': 1600000000000}
+    assert len(set(body['eventId'] for body in received[1:]) | {event_id}) == 250
+
+
+def test_events_are_flushed_by_time():
+    async def send(client):
+        client.track('application-1', 'play', 1.5)
+        await asyncio.sleep(0.2)
+        assert client.stats['sent'] == 1
+
+    run([200], send, batch_size=100, flush_interval=0.05)
+
+
+def test_throttled_and_failed_requests_are_retried_client_errors_are_not():
+    async def send(client):
+        client.track('application-1', 'play', 1.5)
+        await client.flush()
+        client.track('application-1', 'play', 2.5)
+
+    client, received = run([429, 503, 200, 400], send)
+    assert client.stats == {'tracked': 2, 'sent': 1, 'rejected': 1, 'failed': 0, 'dropped': 0, 'retries': 2}
+    assert len(received) == 4
+    # Retries send the same event, the backend only stores it once.
+    assert received[0] == received[1] == received[2]
+
+
+def test_memory_is_bounded_while_the_backend_is_down():
+    async def send(client):
+        for index in range(100):
+            client.track('application-1', 'play', index)
+        assert len(client.buffer) == 10
+        assert len(client.batches) == 2
+
+    client, received = run([503], send, batch_size=5, max_batches=2, max_buffer=10, max_attempts=3,
+                           drop_policy=DROP_NEWEST)
+    # Two batches went out before the buffer filled up, everything after the first ten waiting was dropped.
+    assert client.stats['dropped'] == 80
+    assert client.stats['failed'] == 20
+    assert client.stats['sent'] == 0
+    assert len(received) == 20 * 3
@@ -0,0 +1,49 @@
+import random
+import pytest
+
+from ddsketch import DDSketch
+
+
+def synthetic_media_times(count, seed):
+    generator = random.Random(seed)
+    return [generator.lognormvariate(5, 1.5) for _ in range(count)]
+
+
+@pytest.mark.parametrize('q', [0.5, 0.9, 0.99])
+def test_quantile_within_relative_accuracy_of_exact(q):
+    values = synthetic_media_times(20000, seed=1)
+    sketch = DDSketch()
+    sketch.update(values)
+
+    exact = sorted(values)[int(q * (len(values) - 1))]
+    assert abs(sketch.quantile(q) - exact) <= sketch.relative_accuracy * exact
+
+
+def test_merged_days_match_single_sketch():
+    values = synthetic_media_times(7000, seed=2)
+    single = DDSketch()
+    single.update(values)
+
+    merged = DDSketch()
+    for day in range(7):
+        daily = DDSketch()
+        daily.update(values[day * 1000:(day + 1) * 1000])
+        merged.merge(DDSketch.from_bytes(daily.to_bytes()))
+
+    assert merged.count == single.count
+    assert merged.bins == single.bins
+    assert merged.quantile(0.9) == single.quantile(0.9)
+
+
+def test_zero_media_time_is_counted():
+    sketch = DDSketch()
+    sketch.update([0, 0, 0, 10])
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.histogram(2)[0]['count'] == 3
+
+
+def test_bins_are_bounded():
+    sketch = DDSketch(max_bins=64)
+    sketch.update(synthetic_media_times(10000, seed=3))
+    assert len(sketch.bins) <= 64
+    assert sketch.count == 10000
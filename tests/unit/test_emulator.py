@@ -0,0 +1,434 @@
+import datetime
+import decimal
+import json
+import logging
+import pytest
+
+from aws_cdk import core
+from applicationmetrics.applicationmetrics_stack import ApplicationmetricsStack
+import timestamps
+from local import emulator
+
+
+@pytest.fixture(scope='module')
+def template():
+    app = core.App()
+    ApplicationmetricsStack(app, "applicationmetrics")
+    return app.synth().get_stack("applicationmetrics").template
+
+
+@pytest.fixture(scope='module')
+def local():
+    return emulator.Emulator()
+
+
+def resources(template, resource_type):
+    return [resource['Properties'] for resource in template['Resources'].values() if resource['Type'] == resource_type]
+
+
+def selection_patterns(template, method):
+    for properties in resources(template, 'AWS::ApiGateway::Method'):
+        if properties['HttpMethod'] == method:
+            return [(response['SelectionPattern'], int(response['StatusCode']))
+                    for response in properties['Integration']['IntegrationResponses']
+                    if 'SelectionPattern' in response]
+
+
+def test_request_models_match_stack(template):
+    models = {properties['Name']: properties['Schema'] for properties in resources(template, 'AWS::ApiGateway::Model')}
+    assert models['PUTRequestModel'] == emulator.PUT_REQUEST_MODEL
+    assert models['POSTRequestModel'] == emulator.POST_REQUEST_MODEL
+
+
+def test_selection_patterns_match_stack(template):
+    assert selection_patterns(template, 'PUT') == emulator.PUT_SELECTION_PATTERNS
+    assert selection_patterns(template, 'POST') == emulator.POST_SELECTION_PATTERNS
+
+
+def test_put_then_post_counts_events(local):
+    for second in range(3):
+        status, body = local.put({'application': 'emulated', 'operation': 'play', 'currentMediaTime': 1.5},
+                                 source_ip='10.0.0.{}'.format(second), now=datetime.datetime(2020, 1, 1, 0, 0, second))
+        assert status == 200
+
+    status, body = local.post({'startDate': '2020-01-01', 'endDate': '2020-01-01', 'application': 'emulated',
+                               'metric': 'unique_sources'})
+    assert status == 200
+    assert body['counts'] == {'2020-01-01': 3}
+    assert body['summary']['unique_sources'] == 3
+
+
+def test_invalid_bodies_are_rejected_before_integration(local):
+    assert local.put({'application': 'emulated'})[0] == 400
+    assert local.post({'startDate': '2020-01-01', 'endDate': '2020-01-01'})[0] == 400
+
+
+def test_validation_exception_maps_to_400(local):
+    status, body = local.post({'startDate': '2020-01-02', 'endDate': '2020-01-01', 'application': 'emulated'})
+    assert status == 400
+    assert body == {'state': 'Fail', 'message': 'The start date is further in the future than the end date.'}
+
+
+def test_rejected_queries_are_logged_once_with_a_prefix(local, caplog):
+    caplog.set_level(logging.WARNING)
+    assert local.post({'startDate': '2020-01-02', 'endDate': '2020-01-01', 'application': 'emulated'})[0] == 400
+    rejected = [record.getMessage() for record in caplog.records if 'ValidationException' in record.getMessage()]
+    assert len(rejected) == 1
+    assert rejected[0].startswith('rejected: {')
+
+
+def test_malformed_and_oversized_queries_are_rejected_before_the_tables(local, monkeypatch):
+    def query(**kwargs):
+        raise AssertionError(kwargs)
+
+    monkeypatch.setattr(local.table, 'query', query)
+    monkeypatch.setattr(local.table_aggregates, 'query', query)
+    monkeypatch.setattr(local.table_aggregates, 'get_item', query)
+    rejected = dict(local.rejected)
+
+    for start, end in [('2020-1-1', '2020-01-01'), ('2020-02-30T25:00', '2020-03-01'), ('yesterday', 'today')]:
+        assert local.post({'startDate': start, 'endDate': end, 'application': 'emulated'}) == \
+            (400, emulator.INVALID_BODY_RESPONSE)
+    # Days which do not exist are let through by the pattern.
+    assert local.post({'startDate': '2020-02-31', 'endDate': '2020-03-01', 'application': 'emulated'})[0] == 400
+    status, body = local.post({'startDate': '2010-01-01', 'endDate': '2019-12-31', 'application': 'emulated'})
+    assert status == 400
+    assert body['message'] == 'The range is longer than 731 days.'
+    status, body = local.post({'startDate': '2019-01-01', 'endDate': '2020-12-31', 'application': 'emulated'})
+    assert body['message'] == 'The range has more than 400 days, export it instead.'
+    assert local.rejected == {'model': rejected['model'] + 3, 'function': rejected['function'] + 3}
+
+    assert timestamps.DATE_PATTERN.pattern == emulator.DATE_PATTERN
+
+
+def test_event_time_template_matches_stack(template):
+    for properties in resources(template, 'AWS::ApiGateway::Method'):
+        if properties['HttpMethod'] == 'PUT':
+            # The table name is joined in at deploy time.
+            request_template = ''.join(part for part in properties['Integration']['RequestTemplates']
+                                       ['application/json']['Fn::Join'][1] if isinstance(part, str))
+    assert '$lateness > {} || $lateness < -{}'.format(emulator.MAX_EVENT_LATENESS * 1000,
+                                                      emulator.MAX_EVENT_LEAD * 1000) in request_template
+    assert '"created_at": {"S": "$createdAt"}' in request_template
+
+    # The template arithmetic gives the same dates as the standard library.
+    for epoch_ms in [0, 951782400000, 1582934399999, 1582934400000, 1609459199000, 4102444799999]:
+        date = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=epoch_ms)
+        assert emulator.event_time(epoch_ms) == date.strftime('%d/%b/%Y:%H:%M:%S +0000')
+
+
+def test_late_events_count_on_the_day_they_happened(local):
+    now = datetime.datetime(2020, 2, 2, 0, 5)
+    epoch = datetime.datetime(1970, 1, 1)
+    for minutes, expected in [(15, 200), (60 * 24 * 8, 400), (-10, 400)]:
+        event_time = int((now - datetime.timedelta(minutes=minutes) - epoch).total_seconds() * 1000)
+        status, body = local.put({'application': 'late', 'operation': 'play', 'currentMediaTime': 1,
+                                  'eventTime': event_time}, now=now)
+        assert status == expected
+
+    status, body = local.post({'startDate': '2020-02-01', 'endDate': '2020-02-02', 'application': 'late'})
+    assert body['counts'] == {'2020-02-01': 1}
+
+    status, body = local.post({'startDate': '2020-02-01', 'endDate': '2020-02-02', 'application': 'late',
+                               'metric': 'lateness'})
+    assert body['counts'] == {'2020-02-01': 1}
+    assert abs(body['summary']['lateness']['p50'] - 900) <= 9
+
+
+def test_usage_plans_and_throttles_match_stack(template):
+    from applicationmetrics import applicationmetrics_stack
+
+    plans = {properties['UsagePlanName']: properties['Throttle']
+             for properties in resources(template, 'AWS::ApiGateway::UsagePlan')}
+    assert plans == {tier: {'RateLimit': limits['rate_limit'], 'BurstLimit': limits['burst_limit']}
+                     for tier, limits in applicationmetrics_stack.usage_plan_tiers.items()}
+    assert all(properties['ApiKeyRequired'] for properties in resources(template, 'AWS::ApiGateway::Method')
+               if properties['HttpMethod'] in ['PUT', 'POST'])
+
+    settings = {'{}/{}'.format(setting['ResourcePath'].replace('~1', '/')[1:], setting['HttpMethod']): setting
+                for setting in resources(template, 'AWS::ApiGateway::Stage')[0]['MethodSettings']
+                if 'ThrottlingRateLimit' in setting}
+    assert {path: {'rate_limit': setting['ThrottlingRateLimit'], 'burst_limit': setting['ThrottlingBurstLimit']}
+            for path, setting in settings.items()} == applicationmetrics_stack.method_throttles
+
+
+def test_requests_over_the_limits_of_a_key_are_throttled(local, monkeypatch):
+    monkeypatch.setattr(local, 'api_keys', {'key': emulator.TokenBucket(rate=0.001, burst=3)})
+    monkeypatch.setattr(local, 'throttles', {'/applications/POST': emulator.TokenBucket(rate=0.001, burst=1)})
+
+    assert local.admit('PUT', '/applications', None) == (403, emulator.FORBIDDEN_RESPONSE)
+    assert [local.admit('PUT', '/applications', 'key') for _ in range(3)] == [None] * 3
+    assert local.admit('PUT', '/applications', 'key') == (429, emulator.THROTTLED_RESPONSE)
+
+    monkeypatch.setattr(local, 'api_keys', None)
+    assert local.admit('POST', '/applications', None) is None
+    assert local.admit('POST', '/applications', None) == (429, emulator.THROTTLED_RESPONSE)
+
+
+def test_columnar_format_has_every_day_in_order(local):
+    for day, hour in [(1, 3), (1, 4), (3, 12)]:
+        assert local.put({'application': 'columnar', 'operation': 'play', 'currentMediaTime': 1},
+                         now=datetime.datetime(2020, 3, day, hour))[0] == 200
+
+    status, body = local.post({'startDate': '2020-03-01', 'endDate': '2020-03-04', 'application': 'columnar',
+                               'format': 'columnar'})
+    assert body == {'start': 1583020800, 'width': 86400, 'counts': [2, 0, 1, 0], 'summary': {}}
+
+    # Local days start at the UTC time of local midnight, the events at 3 and 4 UTC are on the last day of February.
+    status, body = local.post({'startDate': '2020-02-29', 'endDate': '2020-03-01', 'application': 'columnar',
+                               'format': 'columnar', 'timezone': 'America/New_York'})
+    assert body['start'] == 1582952400
+    assert body['counts'] == [2, 0]
+
+
+def test_body_is_encoded_once_with_decimals(local, template):
+    result = local.function_post.serialize({'counts': {'2020-03-01': decimal.Decimal('3')},
+                                            'summary': {'ratio': decimal.Decimal('0.5')}})
+    assert result == {'body': '{"counts":{"2020-03-01":3},"summary":{"ratio":0.5}}'}
+
+    for properties in resources(template, 'AWS::ApiGateway::Method'):
+        if properties['HttpMethod'] == 'POST':
+            responses = properties['Integration']['IntegrationResponses']
+    assert responses[0]['ResponseTemplates']['application/json'] == "$input.path('$.body')"
+
+
+def test_operation_index_matches_stack(template, local):
+    table = [properties for properties in resources(template, 'AWS::DynamoDB::Table')
+             if properties.get('StreamSpecification')][0]
+    index = table['GlobalSecondaryIndexes'][0]
+    assert index['IndexName'] == 'operation'
+    assert [key['AttributeName'] for key in index['KeySchema']] == ['application_operation', 'created_at']
+    assert index['Projection'] == {'ProjectionType': 'KEYS_ONLY'}
+
+    for properties in resources(template, 'AWS::ApiGateway::Method'):
+        if properties['HttpMethod'] == 'PUT':
+            request_template = ''.join(part for part in properties['Integration']['RequestTemplates']
+                                       ['application/json']['Fn::Join'][1] if isinstance(part, str))
+    assert ('"application_operation": {"S": "$util.escapeJavaScript($input.path(\'$\').application)#'
+            '$util.escapeJavaScript($input.path(\'$\').operation)"}') in request_template
+
+
+def test_events_of_one_operation_are_counted(local):
+    for second, operation in enumerate(['play', 'pause', 'play', 'complete']):
+        local.put({'application': 'operations', 'operation': operation, 'currentMediaTime': 1},
+                  now=datetime.datetime(2020, 4, 1, 0, 0, second))
+
+    request = {'startDate': '2020-04-01', 'endDate': '2020-04-01', 'application': 'operations', 'operation': 'play'}
+    assert local.post(request)[1]['counts'] == {'2020-04-01': 2}
+    assert local.post(dict(request, approximate=True))[1]['counts'] == {'2020-04-01': 2}
+    # There are no hourly counts per operation.
+    assert local.post(dict(request, timezone='America/New_York'))[0] == 400
+
+
+def test_applications_are_ranked_from_the_days_of_the_range(local):
+    for day, application, events in [(1, 'ranked-a', 3), (1, 'ranked-b', 1), (2, 'ranked-b', 4), (2, 'ranked-c', 2),
+                                      (3, 'ranked-c', 9)]:
+        for second in range(events):
+            local.put({'application': application, 'operation': 'play', 'currentMediaTime': 1},
+                      now=datetime.datetime(2020, 5, day, 0, 0, second))
+
+    status, body = local.post({'startDate': '2020-05-01', 'endDate': '2020-05-02', 'metric': 'top_applications',
+                               'top': 2})
+    assert status == 200
+    assert body['counts'] == {'2020-05-01': 4, '2020-05-02': 6}
+    assert body['summary'] == {'top_applications': [{'value': 'ranked-b', 'count': 5},
+                                                    {'value': 'ranked-a', 'count': 3}],
+                               'applications': 3}
+
+    # Other metrics are of one application.
+    assert local.post({'startDate': '2020-05-01', 'endDate': '2020-05-02'})[0] == 400
+
+
+def test_retried_events_are_stored_once(local, template):
+    now = datetime.datetime(2020, 7, 1, 23, 59, 59)
+    event_time = int((now - datetime.datetime(1970, 1, 1)).total_seconds() * 1000)
+    event = {'application': 'retried', 'operation': 'play', 'currentMediaTime': 1, 'eventTime': event_time}
+    assert local.put(dict(event, eventId='a1'), now=now) == (200, {'state': 'Success', 'message': 'Updated items.'})
+    assert local.put(dict(event, eventId='a1'), now=now) == (200, emulator.DUPLICATE_RESPONSE)
+    # Events in the same second without an id, or with another one, are all kept.
+    assert local.put(dict(event, eventId='b2'), now=now)[0] == 200
+    assert local.put(event, now=now)[0] == 200
+    assert local.put(event, now=now)[0] == 200
+    # An id without a time would not be the same key on retry.
+    assert local.put({'application': 'retried', 'operation': 'play', 'currentMediaTime': 1, 'eventId': 'c3'},
+                     now=now)[0] == 400
+
+    # The last second of the range includes every id.
+    status, body = local.post({'startDate': '2020-07-01', 'endDate': '2020-07-01', 'application': 'retried'})
+    assert body['counts'] == {'2020-07-01': 4}
+    status, body = local.post({'startDate': '2020-07-01', 'endDate': '2020-07-01', 'application': 'retried',
+                               'operation': 'play'})
+    assert body['counts'] == {'2020-07-01': 4}
+
+    for properties in resources(template, 'AWS::ApiGateway::Method'):
+        if properties['HttpMethod'] == 'PUT':
+            integration = properties['Integration']
+    assert '"ConditionExpression": "attribute_not_exists(created_at)"' in ''.join(
+        part for part in integration['RequestTemplates']['application/json']['Fn::Join'][1] if isinstance(part, str))
+    response = [response for response in integration['IntegrationResponses'] if response['StatusCode'] == '400'][0]
+    assert json.dumps(emulator.DUPLICATE_RESPONSE) in response['ResponseTemplates']['application/json']
+
+
+def test_ranges_are_compared_from_one_read_of_their_union(local, caplog):
+    for day, hour in [(1, 3), (3, 12), (3, 13), (8, 9), (9, 6), (9, 18), (10, 1)]:
+        assert local.put({'application': 'compared', 'operation': 'play', 'currentMediaTime': 0},
+                         now=datetime.datetime(2020, 4, day, hour))[0] == 200
+
+    caplog.set_level('INFO')
+    request = {'startDate': '2020-04-08', 'endDate': '2020-04-14', 'application': 'compared',
+               'compare': [{'name': 'last_week', 'startDate': '2020-04-01', 'endDate': '2020-04-07'},
+                           {'name': 'overlap', 'startDate': '2020-04-05', 'endDate': '2020-04-09T12:00'}]}
+    status, body = local.post(request)
+    assert status == 200
+    assert body['ranges'] == {
+        'current': {'counts': {'2020-04-08': 1, '2020-04-09': 2, '2020-04-10': 1}},
+        'last_week': {'counts': {'2020-04-01': 1, '2020-04-03': 2}},
+        'overlap': {'counts': {'2020-04-08': 1, '2020-04-09': 1}},
+    }
+    assert body['summary']['comparison']['deltas'] == {'last_week': {'change': 1, 'relative': 0.3333},
+                                                       'overlap': {'change': 2, 'relative': 1.0}}
+    # The union is counted in two spans, cut where the overlap ends in the middle of a day.
+    assert body['summary']['comparison']['spans'] == 2
+    assert len([record for record in caplog.records if record.getMessage().startswith('plan: ')]) == 2
+
+    for named in request['compare']:
+        assert local.post({'startDate': named['startDate'], 'endDate': named['endDate'],
+                           'application': 'compared'})[1]['counts'] == body['ranges'][named['name']]['counts']
+    status, body = local.post(dict(request, format='columnar'))
+    assert body['ranges']['last_week']['counts'] == [1, 0, 2, 0, 0, 0, 0]
+
+    # Names are unique, and only event counts are compared.
+    for compare, metric in [([{'name': 'current', 'startDate': '2020-04-01', 'endDate': '2020-04-07'}], 'events'),
+                            ([request['compare'][0]] * 2, 'events'),
+                            (request['compare'], 'unique_sources')]:
+        assert local.post(dict(request, compare=compare, metric=metric))[0] == 400
+    for compare in [[dict(request['compare'][0], name='last week')],
+                    [dict(request['compare'][0], application='other')],
+                    request['compare'] * 3]:
+        assert local.post(dict(request, compare=compare)) == (400, emulator.INVALID_BODY_RESPONSE)
+
+
+def test_retried_stream_batches_are_merged_into_sketches_once():
+    local = emulator.Emulator(stream=False)
+    for second, media_time in enumerate([1, 2, 400]):
+        assert local.put({'application': 'retried', 'operation': 'play', 'currentMediaTime': media_time},
+                         now=datetime.datetime(2020, 5, 1, 0, 0, second))[0] == 200
+    records = [{'eventName': 'INSERT',
+                'dynamodb': {'NewImage': {name: local.serializer.serialize(value) for name, value in item.items()}}}
+               for item in sorted(local.table.partitions['retried'].values(), key=lambda item: item['created_at'])]
+
+    # The batch fails after the sketches were merged, is retried and then split in two.
+    local.invoke_stream(records)
+    local.invoke_stream(records)
+    local.invoke_stream(records[:1])
+    local.invoke_stream(records[1:])
+    local.stream = True
+    assert local.put({'application': 'retried', 'operation': 'play', 'currentMediaTime': 3},
+                     now=datetime.datetime(2020, 5, 1, 0, 0, 3))[0] == 200
+
+    status, body = local.post({'startDate': '2020-05-01', 'endDate': '2020-05-01', 'application': 'retried',
+                               'metric': 'media_time'})
+    assert body['summary']['media_time']['play']['count'] == 4
+    assert body['summary']['media_time']['play']['p50'] == pytest.approx(2, rel=0.05)
+
+
+def test_events_stored_before_the_operation_index_are_counted():
+    local = emulator.Emulator()
+    # Stored by the PUT template before it set the key of the index.
+    local.table.load({'application': 'unindexed', 'operation': 'play',
+                      'created_at': timestamps.format_created_at(datetime.datetime(2020, 6, 1, hour)) + '#old'}
+                     for hour in range(3))
+    for day, operation in [(3, 'play'), (3, 'pause'), (4, 'play'), (5, 'play')]:
+        assert local.put({'application': 'unindexed', 'operation': operation, 'currentMediaTime': 0},
+                         now=datetime.datetime(2020, 6, day, 12))[0] == 200
+
+    expected = {'2020-06-01': 3, '2020-06-03': 1, '2020-06-04': 1, '2020-06-05': 1}
+    request = {'startDate': '2020-06-01', 'endDate': '2020-06-05', 'application': 'unindexed', 'operation': 'play'}
+    assert local.post(request)[1]['counts'] == expected
+    assert local.post(dict(request, approximate=True))[1]['counts'] == expected
+
+    # The index is only read for the days after the first one with events on it.
+    planner = local.function_post.planner
+    plans = planner.plans('unindexed', timestamps.parse_request_date('2020-06-01'),
+                          timestamps.parse_request_date('2020-06-05', end=True), 'play')
+    index = [plan for plan in plans if plan['strategy'] == 'index'][0]
+    assert index['unindexed'] == ['2020-06-01', '2020-06-02', '2020-06-03']
+    for plan in plans:
+        assert planner.execute(plan) == expected
+
+
+def test_media_time_reads_the_sketches_of_the_range_only(monkeypatch):
+    local = emulator.Emulator()
+    for day in range(1, 31):
+        for operation, media_time in [('play', day), ('pause', 100 + day)]:
+            assert local.put({'application': 'history', 'operation': operation, 'currentMediaTime': media_time},
+                             now=datetime.datetime(2020, 7, day, 12))[0] == 200
+
+    read = []
+    query = local.table_aggregates.query
+
+    def counted(**kwargs):
+        data = query(**kwargs)
+        read.extend(item['sk'] for item in data['Items'])
+        return data
+
+    monkeypatch.setattr(local.table_aggregates, 'query', counted)
+    request = {'startDate': '2020-07-10', 'endDate': '2020-07-11', 'application': 'history', 'metric': 'media_time'}
+    status, body = local.post(request)
+    assert status == 200
+    assert body['counts'] == {'2020-07-10': 2, '2020-07-11': 2}
+    assert sorted(body['summary']['media_time']) == ['pause', 'play']
+    assert body['summary']['media_time']['play']['count'] == 2
+    assert sorted(read) == ['media_time#2020-07-10#pause', 'media_time#2020-07-10#play',
+                            'media_time#2020-07-11#pause', 'media_time#2020-07-11#play']
+
+    body = local.post(dict(request, operation='pause'))[1]
+    assert body['counts'] == {'2020-07-10': 1, '2020-07-11': 1}
+    assert list(body['summary']['media_time']) == ['pause']
+    assert body['summary']['media_time']['pause']['p50'] == pytest.approx(110.5, rel=0.05)
+
+
+def test_retried_stream_batches_are_counted_once(monkeypatch):
+    from local.replay import daily_sessions
+
+    local = emulator.Emulator(stream=False)
+    # Daily counts are read for the days after the first one seen.
+    assert local.put({'application': 'recounted', 'operation': 'play', 'currentMediaTime': 0},
+                     now=datetime.datetime(2020, 3, 16, 12))[0] == 200
+    for minute in range(20):
+        assert local.put({'application': 'recounted', 'operation': 'play', 'currentMediaTime': minute},
+                         source_ip='10.0.0.{}'.format(minute % 2),
+                         now=datetime.datetime(2020, 3, 17, 10, minute * 3))[0] == 200
+    records = [{'eventName': 'INSERT',
+                'dynamodb': {'NewImage': {name: local.serializer.serialize(value) for name, value in item.items()}}}
+               for item in sorted(local.table.partitions['recounted'].values(), key=lambda item: item['created_at'])]
+
+    # The batch fails in the sessions step after the counters were added, is retried and then split in two.
+    sessions = local.function_stream.sessions
+    save = sessions.save
+
+    def unavailable(*args):
+        raise Exception('unavailable')
+
+    monkeypatch.setattr(sessions, 'save', unavailable)
+    with pytest.raises(Exception):
+        local.invoke_stream(records)
+    monkeypatch.setattr(sessions, 'save', save)
+    local.invoke_stream(records)
+    local.invoke_stream(records[:10])
+    local.invoke_stream(records[10:])
+
+    expected = {'2020-03-17': 20}
+    planner = local.function_post.planner
+    planner.cache.clear()
+    plans = planner.plans('recounted', timestamps.parse_request_date('2020-03-17'),
+                          timestamps.parse_request_date('2020-03-17', end=True))
+    assert 'rollup' in [plan['strategy'] for plan in plans]
+    for plan in plans:
+        assert planner.execute(plan) == expected
+
+    request = {'startDate': '2020-03-17', 'endDate': '2020-03-17', 'application': 'recounted'}
+    assert local.post(dict(request, timezone='Asia/Kathmandu'))[1]['counts'] == expected
+    assert local.post(dict(request, metric='top_applications'))[1]['counts'] == expected
+    assert local.table_aggregates.get_item(Key={'pk': 'recounted', 'sk': 'events#total'})['Item']['count'] == 21
+    assert [row['events'] for row in daily_sessions(local) if row['application'] == 'recounted'] == [1, 20]
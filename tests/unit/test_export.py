@@ -0,0 +1,64 @@
+import datetime
+import json
+import pytest
+
+import export
+from local import emulator, storage
+
+
+def test_large_exports_are_uploaded_in_parts(monkeypatch):
+    monkeypatch.setattr(export, 'PART_SIZE', 1024)
+    monkeypatch.setattr(storage, 'MIN_PART_SIZE', 1024)
+    s3 = storage.MemoryS3()
+
+    buckets = (('2020-03-01T{:02d}'.format(index % 24), index) for index in range(1000))
+    written = export.ndjson(buckets, s3, 'exports', 'large.ndjson')
+    body = s3.get_object(Bucket='exports', Key='large.ndjson')['Body']
+    assert written['buckets'] == 1000
+    assert written['bytes'] == len(body)
+    assert written['parts'] > 10
+    assert json.loads(body.splitlines()[-1]) == {'bucket': '2020-03-01T15', 'count': 999}
+
+    # Small exports are written at once.
+    export.ndjson(iter([('2020-03-01', 1)]), s3, 'exports', 'small.ndjson')
+    assert s3.get_object(Bucket='exports', Key='small.ndjson')['Body'] == b'{"bucket":"2020-03-01","count":1}\n'
+
+
+def test_failed_exports_are_aborted(monkeypatch):
+    monkeypatch.setattr(export, 'PART_SIZE', 1)
+    s3 = storage.MemoryS3()
+
+    def buckets():
+        yield '2020-03-01', 1
+        raise RuntimeError('query failed')
+
+    with pytest.raises(RuntimeError):
+        export.ndjson(buckets(), s3, 'exports', 'failed.ndjson')
+    assert s3.uploads == {}
+    assert ('exports', 'failed.ndjson') not in s3.objects
+
+
+def test_export_returns_a_link_to_hourly_counts():
+    local = emulator.Emulator()
+    for hour, events in [(1, 2), (5, 1), (23, 3)]:
+        for second in range(events):
+            local.put({'application': 'exported', 'operation': 'play', 'currentMediaTime': 1},
+                      now=datetime.datetime(2020, 3, 1, hour, 0, second))
+
+    status, body = local.post({'startDate': '2020-03-01', 'endDate': '2020-03-02', 'application': 'exported',
+                               'export': True, 'granularity': 'hour'})
+    assert status == 200
+    assert body['counts'] == {}
+    summary = body['summary']['export']
+    assert summary['buckets'] == 3
+    bucket, key = summary['url'].split('/', 3)[3].split('/', 1)
+    lines = local.s3.get_object(Bucket=bucket, Key=key)['Body'].decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == [{'bucket': '2020-03-01T01', 'count': 2},
+                                                    {'bucket': '2020-03-01T05', 'count': 1},
+                                                    {'bucket': '2020-03-01T23', 'count': 3}]
+
+    # Hours are only counted when exporting, and only events can be exported.
+    assert local.post({'startDate': '2020-03-01', 'endDate': '2020-03-02', 'application': 'exported',
+                       'granularity': 'hour'})[0] == 400
+    assert local.post({'startDate': '2020-03-01', 'endDate': '2020-03-02', 'application': 'exported',
+                       'export': True, 'metric': 'media_time'})[0] == 400
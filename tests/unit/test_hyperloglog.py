@@ -0,0 +1,49 @@
+import random
+import pytest
+
+from hyperloglog import HyperLogLog
+
+
+def synthetic_ips(count, seed):
+    generator = random.Random(seed)
+    return ['{}.{}.{}.{}'.format(*(generator.randint(0, 255) for _ in range(4))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('cardinality', [10, 1000, 50000])
+def test_estimate_within_error_bound_of_exact_count(cardinality):
+    ips = synthetic_ips(cardinality, seed=cardinality)
+    sketch = HyperLogLog()
+    # Repeated visits must not change the estimate.
+    sketch.update(ips + ips[:cardinality // 2])
+
+    exact = len(set(ips))
+    assert abs(sketch.estimate() - exact) <= 3 * sketch.relative_error * exact + 1
+
+
+def test_merged_days_match_exact_count_of_range():
+    days = [synthetic_ips(5000, seed=day) for day in range(7)]
+    # Half of the visitors come back the next day.
+    for day in range(1, 7):
+        days[day][:2500] = days[day - 1][2500:]
+
+    total = HyperLogLog()
+    for ips in days:
+        sketch = HyperLogLog()
+        sketch.update(ips)
+        total.merge(sketch)
+
+    exact = len(set(ip for ips in days for ip in ips))
+    assert abs(total.estimate() - exact) <= 3 * total.relative_error * exact
+
+
+def test_serialization_round_trip():
+    sketch = HyperLogLog()
+    sketch.update(synthetic_ips(100, seed=1))
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.registers == sketch.registers
+    assert restored.estimate() == sketch.estimate()
+
+
+def test_merge_rejects_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=12).merge(HyperLogLog(precision=10))
@@ -0,0 +1,29 @@
+import random
+
+from benchmarks.histogram import LatencyHistogram
+from benchmarks.loadgen import regressions, synthetic_trace
+
+
+def test_histogram_percentiles_within_significant_digits():
+    generator = random.Random(1)
+    latencies = [generator.lognormvariate(-4, 1) for _ in range(10000)]
+    histogram = LatencyHistogram()
+    for latency in latencies:
+        histogram.record(latency)
+
+    exact = sorted(latencies)[int(0.99 * len(latencies)) - 1] * 1000
+    assert abs(histogram.percentile(99) - exact) <= exact * 0.01
+    assert LatencyHistogram.from_dict(histogram.to_dict()).summary() == histogram.summary()
+
+
+def test_synthetic_trace_is_open_loop_at_target_rate():
+    trace = list(synthetic_trace(rate=100, duration=60, put_ratio=0.9, applications=10, seed=1))
+    offsets = [offset for offset, method, body in trace]
+    assert offsets == sorted(offsets)
+    assert 5400 < len(trace) < 6600
+
+
+def test_regressions_compare_percentiles_with_tolerance():
+    baseline = {'latency': {'all': {'p50': 10.0, 'p99': 100.0, 'p999': 200.0}}}
+    report = {'latency': {'all': {'p50': 10.5, 'p99': 150.0, 'p999': 200.0}}}
+    assert regressions(report, baseline, tolerance=0.1) == ['all p99 150.000 ms > 100.000 ms']
@@ -0,0 +1,181 @@
+import datetime
+
+from boto3.dynamodb.conditions import Key
+
+import timestamps
+from local.table import MemoryTable
+from planner import DAILY_PREFIX, TOTAL_KEY, Planner
+
+
+def events_table(events_per_day, days, now):
+    table = MemoryTable('events', 'application', 'created_at')
+    table.load({
+        'application': 'application',
+        'created_at': timestamps.format_created_at(now - datetime.timedelta(days=day, seconds=index * 7)),
+    } for day in range(days) for index in range(events_per_day))
+    return table
+
+
+def aggregates_table(events, since):
+    table = MemoryTable('aggregates', 'pk', 'sk')
+    counts = {}
+    for partition in events.partitions.values():
+        for item in partition.values():
+            day = timestamps.day(timestamps.parse_created_at(item['created_at']))
+            counts[day] = counts.get(day, 0) + 1
+    table.load([{'pk': 'application', 'sk': DAILY_PREFIX + day, 'count': count} for day, count in counts.items()])
+    if since:
+        table.put_item(Item={'pk': 'application', 'sk': TOTAL_KEY, 'count': sum(counts.values()), 'since': since})
+    return table
+
+
+def counts(planner, start, end):
+    plan = planner.plan('application', start, end)
+    return plan['strategy'], planner.execute(plan)
+
+
+def exact(events, start, end):
+    response = {}
+    for item in events.partitions['application'].values():
+        created_at = timestamps.parse_created_at(item['created_at'])
+        if start <= created_at <= end:
+            response[timestamps.day(created_at)] = response.get(timestamps.day(created_at), 0) + 1
+    return response
+
+
+def test_quiet_application_is_read_in_one_query():
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = events_table(3, 60, now)
+    # The stream function only saw the last few days, older days have no daily counts.
+    planner = Planner(events, aggregates_table(events, since='2020-03-28'))
+    start, end = datetime.datetime(2020, 3, 1, 6), datetime.datetime(2020, 3, 30, 18)
+
+    strategy, response = counts(planner, start, end)
+    assert strategy == 'raw'
+    assert response == exact(events, start, end)
+
+
+def test_busy_application_is_read_from_daily_counts():
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = events_table(1000, 30, now)
+    planner = Planner(events, aggregates_table(events, since='2020-02-01'))
+    start, end = datetime.datetime(2020, 3, 2), datetime.datetime(2020, 3, 30, 23, 59, 59, 999999)
+
+    strategy, response = counts(planner, start, end)
+    assert strategy == 'rollup'
+    assert response == exact(events, start, end)
+
+    # Partial days are counted from the events.
+    start = datetime.datetime(2020, 3, 2, 12)
+    plan = planner.plan('application', start, end)
+    assert plan['strategy'] == 'rollup'
+    assert [day_start for day_start, day_end in plan['counts']] == [start]
+    assert planner.execute(plan) == exact(events, start, end)
+    assert plan['actual']['requests'] == plan['predicted']['requests']
+
+
+def test_application_without_totals_is_sampled_and_counted_per_day():
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = events_table(100, 10, now)
+    planner = Planner(events, aggregates_table(events, since=None))
+    start, end = datetime.datetime(2020, 3, 25), datetime.datetime(2020, 3, 31, 23, 59, 59, 999999)
+
+    strategy, response = counts(planner, start, end)
+    assert strategy == 'count'
+    assert response == exact(events, start, end)
+
+
+def test_days_are_yielded_in_time_order():
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = events_table(1000, 30, now)
+    planner = Planner(events, aggregates_table(events, since='2020-02-01'))
+    # Partial days at both ends are counted, the days between are read from the daily counts.
+    start, end = datetime.datetime(2020, 3, 2, 12), datetime.datetime(2020, 3, 30, 6)
+
+    plan = planner.plan('application', start, end)
+    assert plan['strategy'] == 'rollup'
+    days = list(planner.counts(plan))
+    assert [day for day, events in days] == sorted(exact(events, start, end))
+    assert dict(days) == exact(events, start, end)
+    assert plan['actual']['requests'] == 3
+
+
+def test_hours_are_read_from_hourly_counts_after_the_first_day_seen():
+    from planner import HOURLY_PREFIX
+
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = events_table(500, 10, now)
+    aggregates = aggregates_table(events, since='2020-03-27')
+    hours = {}
+    for item in events.partitions['application'].values():
+        created_at = timestamps.parse_created_at(item['created_at'])
+        hours[timestamps.hour(created_at)] = hours.get(timestamps.hour(created_at), 0) + 1
+    # All of an hour in its first quarter, the planner sums the quarters.
+    aggregates.load([{'pk': 'application', 'sk': HOURLY_PREFIX + hour, 'q0': count} for hour, count in hours.items()
+                     if hour >= '2020-03-28'])
+    planner = Planner(events, aggregates)
+    start, end = datetime.datetime(2020, 3, 26, 22, 30), datetime.datetime(2020, 3, 31, 10, 15, 59, 999999)
+
+    cost = {'requests': 0, 'read_units': 0.0}
+    response = list(planner.hourly_counts('application', start, end, cost))
+    assert [hour for hour, events in response] == sorted(hour for hour, events in response)
+
+    expected = {}
+    for item in events.partitions['application'].values():
+        created_at = timestamps.parse_created_at(item['created_at'])
+        if start <= created_at <= end:
+            expected[timestamps.hour(created_at)] = expected.get(timestamps.hour(created_at), 0) + 1
+    assert dict(response) == expected
+    # The totals, 26 hours before the first day after the one seen first, the hourly counts and the last partial hour.
+    assert cost['requests'] == 1 + 26 + 1 + 1
+
+
+def test_operations_are_counted_on_the_index_or_filtered_out_of_the_events():
+    now = datetime.datetime(2020, 3, 31, 12)
+    events = MemoryTable('events', 'application', 'created_at')
+    events.add_index('operation', 'application_operation', 'created_at')
+    # One error for every hundred plays.
+    events.load({
+        'application': 'application',
+        'created_at': timestamps.format_created_at(now - datetime.timedelta(days=day, seconds=index * 7)),
+        'operation': operation,
+        'application_operation': 'application#' + operation,
+    } for day in range(30) for index in range(2000) for operation in ['error' if index % 100 == 0 else 'play'])
+    aggregates = aggregates_table(events, since='2020-02-01')
+    aggregates.update_item(Key={'pk': 'application', 'sk': TOTAL_KEY}, UpdateExpression='SET index_since = :since',
+                           ExpressionAttributeValues={':since': '2020-02-01'})
+    planner = Planner(events, aggregates)
+    start, end = datetime.datetime(2020, 3, 20, 12), datetime.datetime(2020, 3, 30, 18)
+
+    expected = {}
+    for item in events.partitions['application'].values():
+        created_at = timestamps.parse_created_at(item['created_at'])
+        if item['operation'] == 'error' and start <= created_at <= end:
+            expected[timestamps.day(created_at)] = expected.get(timestamps.day(created_at), 0) + 1
+
+    plans = planner.plans('application', start, end, operation='error')
+    assert [plan['strategy'] for plan in plans] == ['index', 'raw']
+    for plan in plans:
+        assert planner.execute(plan) == expected
+    assert plans[0]['actual']['read_units'] < plans[1]['actual']['read_units'] / 50
+
+
+def test_index_pages_continue_after_items_sharing_a_key():
+    events = MemoryTable('events', 'application', 'created_at')
+    events.add_index('operation', 'application_operation', 'created_at', attributes=['operation'])
+    events.load({'application': 'application-{}'.format(index % 3), 'created_at': '01/Mar/2020:00:00:00 +0000',
+                 'operation': 'play', 'application_operation': 'shared'} for index in range(3))
+    # Items without the index key are left out of the index.
+    events.put_item(Item={'application': 'application-0', 'created_at': '01/Mar/2020:00:00:01 +0000'})
+
+    items = []
+    kwargs = {'IndexName': 'operation', 'Limit': 2, 'KeyConditionExpression': Key('application_operation').eq('shared')}
+    while True:
+        data = events.query(**kwargs)
+        items.extend(data['Items'])
+        if 'LastEvaluatedKey' not in data:
+            break
+        assert set(data['LastEvaluatedKey']) == {'application', 'created_at', 'application_operation'}
+        kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+    assert sorted(item['application'] for item in items) == ['application-0', 'application-1', 'application-2']
+    assert set(items[0]) == {'application', 'created_at', 'application_operation', 'operation'}
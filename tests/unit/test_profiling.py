@@ -0,0 +1,81 @@
+import datetime
+import json
+import logging
+import time
+
+import profiling
+from local import emulator
+from local.storage import MemoryS3
+
+
+def invoke(profiler, work, request_id='request', requested=False):
+    profiler.start(requested)
+    for stage in ['parse', 'query', 'format', 'serialize']:
+        with profiler.span(stage):
+            work()
+    return profiler.finish(request_id)
+
+
+def test_disabled_profiling_costs_microseconds():
+    profiler = profiling.Profiler()
+    invocations = 20000
+
+    started = time.perf_counter()
+    for _ in range(invocations):
+        assert invoke(profiler, int) is None
+    hooked = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(invocations):
+        for stage in range(4):
+            int()
+    bare = time.perf_counter() - started
+
+    # The hooks of an invocation, start, four spans and finish, well under what a handler takes.
+    assert (hooked - bare) / invocations < 20e-6
+
+
+def test_profiles_are_collapsed_stacks_and_spans(caplog):
+    local = emulator.Emulator(profile_on_request=True)
+    now = datetime.datetime(2020, 8, 1, 12)
+    for minute in range(3):
+        local.put({'application': 'profiled', 'operation': 'play', 'currentMediaTime': 0},
+                  now=now + datetime.timedelta(minutes=minute))
+
+    caplog.set_level(logging.INFO)
+    request = {'startDate': '2020-08-01', 'endDate': '2020-08-02', 'application': 'profiled'}
+    assert local.post(request) == local.post(request, {'X-Profile': 'true'})
+    profiles = [json.loads(record.getMessage()[len('profile: '):]) for record in caplog.records
+                if record.getMessage().startswith('profile: ')]
+    assert len(profiles) == 1
+
+    profile = profiles[0]
+    assert set(profile['spans']) == {'parse', 'query', 'format', 'serialize'}
+    assert profile['peak_bytes'] > 0
+    for line in profile['cpu'] + profile['memory']:
+        stack, weight = line.rsplit(' ', 1)
+        assert stack and int(weight) > 0
+    assert any('planner.py:count' in line for line in profile['cpu'])
+
+
+def test_profiles_are_limited_per_minute_and_written_to_s3():
+    s3 = MemoryS3()
+    profiler = profiling.Profiler(rate=1.0, modes=['cpu', 'spans'], max_per_minute=2, output='s3', s3=s3,
+                                  bucket='exports', on_request=True)
+    results = [invoke(profiler, lambda: sorted(range(1000), key=str), str(index)) for index in range(3)]
+
+    assert results[2] is None
+    assert all(result['location'].startswith('s3://exports/profiles/') for result in results[:2])
+    folded = [key for bucket, key in s3.objects if key.endswith('.cpu.folded')]
+    assert len(folded) == 2
+    assert all(b'sorted' in s3.objects[('exports', key)]['Body'] for key in folded)
+
+
+def test_requested_profiles_are_opt_in_and_limited_apart():
+    profiler = profiling.Profiler(modes=['spans'], max_per_minute=2)
+    assert invoke(profiler, int, requested=True) is None
+
+    # Clients asking for profiles can't use up the sampled ones.
+    profiler = profiling.Profiler(rate=1.0, modes=['spans'], max_per_minute=2, on_request=True)
+    assert [invoke(profiler, int, requested=True) is not None for _ in range(3)] == [True, True, False]
+    assert invoke(profiler, int) is not None
@@ -0,0 +1,67 @@
+import datetime
+import io
+
+from local import emulator
+from local.replay import daily_sessions, replay
+from sessions import Sessionizer
+
+
+def fold(sessionizer, events):
+    counts = {}
+    state = None
+    for time, operation in events:
+        state = sessionizer.add(state, time, operation, counts)
+    return state, counts
+
+
+def test_sessions_end_after_the_timeout():
+    # 2020-03-01 23:50 UTC, the second session starts the next day.
+    start = 1583106600
+    state, counts = fold(Sessionizer(timeout=600), [
+        (start, 'play'), (start + 300, 'pause'), (start + 900, 'seek'), (start + 1501, 'play'), (start + 1600, 'pause')
+    ])
+    assert counts['2020-03-01']['sessions'] == 1
+    assert counts['2020-03-01']['duration'] == 900
+    assert counts['2020-03-01']['events'] == 3
+    assert counts['2020-03-02']['sessions'] == 1
+    assert counts['2020-03-02']['duration'] == 99
+    assert state == {'start': start + 1501, 'last': start + 1600, 'stage': 2, 'expires': start + 2200}
+
+
+def test_funnel_steps_are_reached_in_order():
+    start = 1583020800
+    state, counts = fold(Sessionizer(), [
+        (start, 'pause'), (start + 1, 'complete'), (start + 2, 'play'), (start + 3, 'complete'), (start + 4, 'pause'),
+        (start + 5, 'play'), (start + 6, 'complete')
+    ])
+    assert [counts['2020-03-01'][name] for name in ['play', 'pause', 'complete']] == [1, 1, 1]
+
+    # Late events of a session long over are left out of the open one.
+    state, late = fold(Sessionizer(timeout=60), [(start + 1000, 'play'), (start, 'pause')])
+    assert late['2020-03-01']['stale'] == 1
+    assert late['2020-03-01']['events'] == 1
+
+
+def test_recorded_batches_replay_to_the_same_sessions():
+    record = io.StringIO()
+    local = emulator.Emulator(record=record)
+    now = datetime.datetime(2020, 6, 1, 12)
+    for minute, source_ip, operation in [(0, '10.0.0.1', 'play'), (1, '10.0.0.2', 'play'), (5, '10.0.0.1', 'pause'),
+                                         (9, '10.0.0.1', 'complete'), (50, '10.0.0.2', 'play'),
+                                         (52, '10.0.0.2', 'pause')]:
+        local.put({'application': 'sessions', 'operation': operation, 'currentMediaTime': minute},
+                  source_ip=source_ip, now=now + datetime.timedelta(minutes=minute))
+
+    status, body = local.post({'startDate': '2020-06-01', 'endDate': '2020-06-01', 'application': 'sessions',
+                               'metric': 'sessions'})
+    assert status == 200
+    assert body['counts'] == {'2020-06-01': 3}
+    assert body['summary']['sessions']['average_length'] == 220.0
+    assert [step['sessions'] for step in body['summary']['sessions']['funnel']] == [3, 2, 1]
+    recorded = daily_sessions(local)
+
+    # Sessions do not depend on how the records were batched.
+    for batch_size in [None, 4]:
+        replayed = emulator.Emulator(stream=False)
+        assert replay(replayed, io.StringIO(record.getvalue()), batch_size)['records'] == 6
+        assert daily_sessions(replayed) == recorded
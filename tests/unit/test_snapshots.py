@@ -0,0 +1,91 @@
+import datetime
+
+import snapshots
+import timestamps
+from local import emulator
+
+
+def put(local, application, times):
+    for now in times:
+        assert local.put({'application': application, 'operation': 'play', 'currentMediaTime': 0}, now=now)[0] == 200
+
+
+def test_snapshots_are_topped_up_with_later_events():
+    local = emulator.Emulator()
+    planner = local.function_snapshot.planner
+    now = datetime.datetime(2020, 6, 10, 12)
+    put(local, 'snapshot', [now - datetime.timedelta(days=2), now - datetime.timedelta(days=1),
+                            now - datetime.timedelta(hours=2), now - datetime.timedelta(seconds=30)])
+
+    snapshots.compute(planner, local.table_aggregates, 'snapshot', 7, now)
+    start, end = datetime.datetime(2020, 6, 4), datetime.datetime(2020, 6, 10, 23, 59, 59, 999999)
+    item = local.table_aggregates.get_item(Key={'pk': 'snapshot', 'sk': snapshots.key(start, end)})['Item']
+    # The last seconds are left to the top-up.
+    assert item['counts'] == {'2020-06-08': 1, '2020-06-09': 1, '2020-06-10': 1}
+
+    put(local, 'snapshot', [now + datetime.timedelta(minutes=5)])
+    cost = {'requests': 0, 'read_units': 0.0}
+    counts = snapshots.read(planner, local.table_aggregates, 'snapshot', start, end,
+                            now + datetime.timedelta(minutes=10), cost)
+    assert counts == {'2020-06-08': 1, '2020-06-09': 1, '2020-06-10': 3}
+    assert cost['requests'] == 2
+
+    # Old snapshots and other ranges are left to the planner.
+    assert snapshots.read(planner, local.table_aggregates, 'snapshot', start, end,
+                          now + datetime.timedelta(hours=1), cost) is None
+    assert snapshots.read(planner, local.table_aggregates, 'snapshot', start + datetime.timedelta(days=1), end,
+                          now, cost) is None
+
+
+def test_windows_are_learned_from_requests():
+    local = emulator.Emulator()
+    now = datetime.datetime(2020, 6, 10, 12)
+    put(local, 'busy', [now - datetime.timedelta(hours=1)] * 3)
+    put(local, 'quiet', [now - datetime.timedelta(days=3)])
+
+    counter = snapshots.WindowCounter()
+    for _ in range(12):
+        counter.add(local.table_aggregates, 'quiet', 14, now)
+    counter.add(local.table_aggregates, 'busy', 90, now - datetime.timedelta(days=1))
+    counter.flush(local.table_aggregates)
+
+    assert snapshots.choose(local.table_aggregates, now, [1, 7]) == [('quiet', 14), ('busy', 1), ('busy', 7)]
+    assert snapshots.choose(local.table_aggregates, now, [7], min_requests=1, limit=2) == [('quiet', 14),
+                                                                                           ('busy', 90)]
+    assert snapshots.parse_windows('30, 7,1,7') == [1, 7, 30]
+
+
+def test_requested_windows_are_served_from_snapshots():
+    local = emulator.Emulator()
+    now = datetime.datetime.utcnow()
+    put(local, 'dashboard', [now - datetime.timedelta(days=2), now - datetime.timedelta(days=1)])
+    request = {'startDate': timestamps.day(now - datetime.timedelta(days=6)), 'endDate': timestamps.day(now),
+               'application': 'dashboard'}
+    for _ in range(snapshots.MIN_REQUESTS):
+        status, body = local.post(request)
+        assert sum(body['counts'].values()) == 2
+
+    assert local.invoke_snapshot() == {'computed': 1}
+    local.table.clear()
+    status, body = local.post(request)
+    assert status == 200
+    assert sum(body['counts'].values()) == 2
+
+
+def test_spans_of_comparisons_are_not_counted_as_requested_windows():
+    local = emulator.Emulator()
+    now = datetime.datetime.utcnow()
+    put(local, 'compared', [now - datetime.timedelta(days=8), now - datetime.timedelta(days=1)])
+    request = {'startDate': timestamps.day(now - datetime.timedelta(days=6)), 'endDate': timestamps.day(now),
+               'application': 'compared',
+               'compare': [{'name': 'previous', 'startDate': timestamps.day(now - datetime.timedelta(days=13)),
+                            'endDate': timestamps.day(now - datetime.timedelta(days=7))}]}
+    status, body = local.post(request)
+    assert status == 200
+    assert body['summary']['comparison']['totals'] == {'current': 1, 'previous': 1}
+
+    # The union is one span of 14 days ending today, nobody asked for it.
+    counter = local.function_post.window_counter
+    assert not [name for name in counter.counts if name[1] == 'compared']
+    local.post({'startDate': request['startDate'], 'endDate': request['endDate'], 'application': 'compared'})
+    assert [name[2] for name in counter.counts if name[1] == 'compared'] == [7]
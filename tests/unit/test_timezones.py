@@ -0,0 +1,86 @@
+import datetime
+import random
+
+import pytest
+from dateutil import tz
+
+from local import emulator
+
+
+@pytest.fixture(scope='module')
+def local():
+    local = emulator.Emulator()
+    # The first event is a day early, the hourly counts cover every day after it.
+    local.put({'application': 'zoned', 'operation': 'play', 'currentMediaTime': 1},
+              now=datetime.datetime(2020, 3, 4, 12))
+
+    generator = random.Random(1)
+    times = []
+    for _ in range(600):
+        created_at = datetime.datetime(2020, 3, 5) + datetime.timedelta(seconds=generator.randrange(27 * 86400))
+        status, body = local.put({'application': 'zoned', 'operation': 'play', 'currentMediaTime': 1},
+                                 now=created_at)
+        assert status == 200
+        times.append(created_at)
+    local.times = sorted(set(times))
+    return local
+
+
+def exact(times, start, end, name):
+    zone = tz.gettz(name)
+    response = {}
+    for created_at in times:
+        day = created_at.replace(tzinfo=tz.UTC).astimezone(zone).strftime('%Y-%m-%d')
+        if start <= day <= end:
+            response[day] = response.get(day, 0) + 1
+    return response
+
+
+@pytest.mark.parametrize('name', ['UTC', 'America/New_York', 'Europe/Amsterdam', 'Asia/Kolkata', 'Asia/Kathmandu',
+                                  'Australia/Eucla', 'Pacific/Chatham'])
+def test_local_days_match_exact_counts(local, name):
+    # Both DST changes of 2020 fall in the range, Kolkata, Kathmandu, Eucla and Chatham are off by 30 or 45 minutes.
+    status, body = local.post({'startDate': '2020-03-06', 'endDate': '2020-03-30', 'application': 'zoned',
+                               'timezone': name})
+    assert status == 200
+    assert body['counts'] == exact(local.times, '2020-03-06', '2020-03-30', name)
+    assert body['summary'] == {'timezone': name}
+
+
+def test_days_before_hourly_counts_are_counted_from_events(local):
+    status, body = local.post({'startDate': '2020-03-01', 'endDate': '2020-03-06', 'application': 'zoned',
+                               'timezone': 'Asia/Kathmandu'})
+    assert status == 200
+    assert body['counts'] == exact(local.times + [datetime.datetime(2020, 3, 4, 12)], '2020-03-01', '2020-03-06',
+                                   'Asia/Kathmandu')
+
+
+@pytest.mark.parametrize('name', ['UTC', 'Asia/Kathmandu'])
+def test_times_of_day_bound_the_local_range(local, name):
+    # Neither bound is on a quarter of an hour, events between a bound and the quarter around it are left out.
+    zone = tz.gettz(name)
+    application = 'bounded-' + name
+    local.put({'application': application, 'operation': 'play', 'currentMediaTime': 1},
+              now=datetime.datetime(2020, 3, 4, 12))
+    times = [datetime.datetime(2020, 3, 6, 3, 16), datetime.datetime(2020, 3, 6, 3, 20, 30),
+             datetime.datetime(2020, 3, 6, 3, 25), datetime.datetime(2020, 3, 9, 12),
+             datetime.datetime(2020, 3, 12, 10, 1), datetime.datetime(2020, 3, 12, 10, 7, 59),
+             datetime.datetime(2020, 3, 12, 10, 8), datetime.datetime(2020, 3, 12, 10, 14)]
+    for moment in times:
+        utc = moment.replace(tzinfo=zone).astimezone(tz.UTC).replace(tzinfo=None)
+        assert local.put({'application': application, 'operation': 'play', 'currentMediaTime': 1}, now=utc)[0] == 200
+
+    status, body = local.post({'startDate': '2020-03-06T03:20', 'endDate': '2020-03-12T10:07',
+                               'application': application, 'timezone': name})
+    assert status == 200
+    assert body['counts'] == {'2020-03-06': 2, '2020-03-09': 1, '2020-03-12': 2}
+
+
+def test_unknown_time_zones_are_rejected(local):
+    for name in ['Mars/Olympus_Mons', '/etc/passwd', '../UTC']:
+        status, body = local.post({'startDate': '2020-03-06', 'endDate': '2020-03-07', 'application': 'zoned',
+                                   'timezone': name})
+        assert status == 400
+    status, body = local.post({'startDate': '2020-03-06', 'endDate': '2020-03-07', 'application': 'zoned',
+                               'timezone': 'UTC', 'metric': 'unique_sources'})
+    assert status == 400
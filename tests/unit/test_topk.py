@@ -0,0 +1,40 @@
+import random
+from collections import Counter
+
+from topk import SpaceSaving
+
+
+def synthetic_clients(count, seed):
+    # A few clients send most of the traffic.
+    generator = random.Random(seed)
+    return ['10.0.0.{}'.format(int(generator.paretovariate(1.2))) for _ in range(count)]
+
+
+def test_heavy_hitters_match_exact_counts():
+    clients = synthetic_clients(50000, seed=1)
+    summary = SpaceSaving()
+    summary.update(clients)
+
+    for entry, (value, count) in zip(summary.top(5), Counter(clients).most_common(5)):
+        assert entry['value'] == value
+        assert entry['count'] - entry['error'] <= count <= entry['count']
+
+
+def test_merged_hours_bound_exact_counts():
+    hours = [synthetic_clients(5000, seed=hour) for hour in range(24)]
+    total = SpaceSaving()
+    for clients in hours:
+        summary = SpaceSaving()
+        summary.update(clients)
+        total.merge(SpaceSaving.from_bytes(summary.to_bytes()))
+
+    exact = Counter(client for clients in hours for client in clients)
+    assert total.total == sum(exact.values())
+    for entry in total.top(10):
+        assert entry['count'] - entry['error'] <= exact[entry['value']] <= entry['count']
+
+
+def test_memory_is_bounded_by_capacity():
+    summary = SpaceSaving(capacity=10)
+    summary.update(str(value) for value in range(10000))
+    assert len(summary.counters) == 10